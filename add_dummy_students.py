@@ -8,7 +8,7 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app, db
-from app.models import User
+from app.models import User, Plan
 from werkzeug.security import generate_password_hash
 import random
 from datetime import date, timedelta
@@ -92,6 +92,11 @@ def generate_dummy_students():
             )
             
             db.session.add(student)
+            plan = Plan(student=student, program=student.program, plan=student.plan,
+                        classes=int(student.classes), effective_from=effective_start)
+            plan.set_window()
+            db.session.add(plan)
+            student.effective_to = plan.effective_to
             print(f"Added student: {first_name} {last_name} ({username})")
         
         # Commit all changes
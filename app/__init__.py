@@ -22,4 +22,7 @@ def create_app(config_class=Config):
     app.register_blueprint(main)
     app.register_blueprint(auth)
 
+    from app.cli import register_cli
+    register_cli(app)
+
     return app 
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""Creation of attendance records.
+
+A student has at most one attendance record per day, enforced by the
+uq_attendance_student_id_date unique index. insert_attendance() relies on the
+index instead of a read-then-insert check: a single
+INSERT ... ON CONFLICT DO NOTHING RETURNING id either creates the row or
+reports that the day is already marked, which stays correct when several
+scanners (and gunicorn workers) mark the same student at once.
+
+Both functions also bump the students' plan usage counters (see
+app/summary.py) in the same transaction.
+"""
+from collections import namedtuple
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Attendance, AttendanceAudit, get_pacific_now
+from app.summary import adjust_plan_usage, uses_plan_class
+
+CreatedAttendance = namedtuple('CreatedAttendance', 'id student_id date client_id')
+
+def supports_insert_returning():
+    """INSERT ... RETURNING is available on Postgres and SQLite >= 3.35"""
+    return db.engine.dialect.insert_returning
+
+def _insert_ignoring_conflicts(index_elements=('student_id', 'date')):
+    """INSERT ... ON CONFLICT DO NOTHING for Attendance, or None where unsupported
+
+    With index_elements=None any unique conflict (day or client_id) is ignored.
+    """
+    dialect_name = db.engine.dialect.name
+    if dialect_name not in ('postgresql', 'sqlite') or not supports_insert_returning():
+        return None
+    dialect_insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    return dialect_insert(Attendance).on_conflict_do_nothing(
+        index_elements=list(index_elements) if index_elements else None
+    )
+
+def insert_attendance(student_id, attendance_date, created_by, status='present', notes=None, **values):
+    """Create a student's attendance for a day together with its 'created' audit entry
+
+    Returns the new attendance id, or None if the student already has a record
+    for that day. Runs in the current transaction (caller commits).
+    """
+    values = dict(
+        values,
+        student_id=student_id,
+        date=attendance_date,
+        status=status,
+        notes=notes,
+        created_by=created_by,
+        # Store as naive datetime in Pacific time
+        created_at=values.get('created_at') or get_pacific_now().replace(tzinfo=None)
+    )
+
+    statement = _insert_ignoring_conflicts()
+    if statement is not None:
+        attendance_id = db.session.execute(statement.values(**values).returning(Attendance.id)).scalar()
+    else:
+        # No RETURNING (old SQLite): insert in a savepoint and treat a unique violation as "already marked"
+        try:
+            with db.session.begin_nested():
+                attendance_id = db.session.execute(db.insert(Attendance).values(**values)).inserted_primary_key[0]
+        except IntegrityError:
+            attendance_id = None
+
+    if attendance_id is not None:
+        db.session.execute(db.insert(AttendanceAudit).values(
+            attendance_id=attendance_id,
+            action='created',
+            changed_by=created_by
+        ))
+        if uses_plan_class(values.get('free_class', False)):
+            adjust_plan_usage([(student_id, values['created_at'], 1)])
+    return attendance_id
+
+def insert_attendance_bulk(rows, created_by):
+    """Create attendance for many students, skipping days that are already marked
+
+    rows is a list of dicts with at least student_id and date, plus optional
+    status, notes, created_at and client_id. Attendance and audit rows are
+    written with multi-row INSERTs in the current transaction (caller commits).
+    Returns a CreatedAttendance for every record created; rows that conflict
+    with an existing record (same student and day, or same client_id) or with
+    an earlier row in rows are left out.
+    """
+    now = get_pacific_now().replace(tzinfo=None)  # Store as naive datetime in Pacific time
+    values = []
+    seen = set()
+    for row in rows:
+        # Only the first row for a day (or client_id) could be inserted, so drop the rest up front
+        keys = {('day', row['student_id'], row['date'])}
+        if row.get('client_id') is not None:
+            keys.add(('client_id', row['client_id']))
+        if keys & seen:
+            continue
+        seen |= keys
+        values.append(dict(
+            {'status': 'present', 'notes': None, 'client_id': None, 'created_at': now},
+            **row,
+            created_by=created_by,
+            updated_at=now,
+            free_class=False
+        ))
+    if not values:
+        return []
+
+    statement = _insert_ignoring_conflicts(index_elements=None)
+    if statement is not None:
+        # Executed as batched multi-row INSERT ... RETURNING statements
+        result = db.session.execute(statement.returning(
+            Attendance.id, Attendance.student_id, Attendance.date, Attendance.client_id
+        ), values)
+        created = [CreatedAttendance(*row) for row in result]
+    else:
+        created = []
+        for row in values:
+            try:
+                with db.session.begin_nested():
+                    attendance_id = db.session.execute(
+                        db.insert(Attendance).values(**row)
+                    ).inserted_primary_key[0]
+                created.append(CreatedAttendance(attendance_id, row['student_id'], row['date'], row['client_id']))
+            except IntegrityError:
+                pass
+
+    if created:
+        db.session.execute(db.insert(AttendanceAudit), [
+            dict(attendance_id=attendance.id, action='created', changed_by=created_by, changed_at=now)
+            for attendance in created
+        ])
+        # values holds one row per student and day
+        created_at = {(row['student_id'], row['date']): row['created_at'] for row in values}
+        adjust_plan_usage([
+            (attendance.student_id, created_at[(attendance.student_id, attendance.date)], 1)
+            for attendance in created
+        ])
+    return created
@@ -0,0 +1,179 @@
+"""Multi-up QR badge sheets for printing a whole intake at once.
+
+Each letter page holds BADGES_PER_PAGE badges (name, belt, photo and QR code),
+drawn with a reportlab canvas one page at a time. The QR codes for the next
+page are rasterized in the image process pool (see app/images.py) while the
+current page is drawn, a page-sized batch at a time, so a sheet for the whole
+school never has more than two pages of QR codes in flight. Photos are the
+stored medium JPEG, embedded as-is and once per picture however many badges
+use it.
+"""
+from collections import namedtuple
+from io import BytesIO
+import qrcode
+from PIL import Image
+from flask import current_app
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+from app import db
+from app.images import get_process_pool
+from app.models import User, StudentSummary, ClassEnrollment, ImageBlob, get_pacific_date
+
+BADGES_PER_PAGE = 8
+BADGE_COLUMNS = 2
+PAGE_MARGIN = 36  # points
+PHOTO_SIZE = (90, 120)  # 3:4, like the stored pictures
+QR_SIZE = 120
+NAME_FONT_SIZES = (14, 12, 10, 9)
+
+BadgeStudent = namedtuple('BadgeStudent', ['id', 'name', 'belt_level', 'qr_data', 'picture_hash'])
+
+def badge_students(student_ids=None, class_id=None):
+    """Students to print, by id, by current enrollment in a class, or all of them, ordered by name"""
+    query = db.session.query(
+        User,
+        db.func.coalesce(StudentSummary.latest_belt_level, User.belt_level).label('belt_level')
+    ).outerjoin(
+        StudentSummary, StudentSummary.student_id == User.id
+    ).filter(
+        User.role == 'student'
+    )
+    if student_ids is not None:
+        query = query.filter(User.id.in_(student_ids))
+    if class_id is not None:
+        # Enrollments starting later still count, so a new intake can be printed ahead of time
+        enrolled = db.session.query(ClassEnrollment.student_id).filter(
+            ClassEnrollment.class_id == class_id,
+            ClassEnrollment.is_active.is_(True),
+            db.or_(ClassEnrollment.enrolled_until.is_(None), ClassEnrollment.enrolled_until >= get_pacific_date())
+        )
+        query = query.filter(User.id.in_(enrolled))
+    query = query.order_by(User.last_name, User.first_name, User.id)
+    return [
+        BadgeStudent(
+            user.id,
+            f"{user.first_name} {user.last_name}",
+            belt_level or 'No Belt',
+            user.generate_qr_code_data(),
+            user.profile_picture_hash
+        )
+        for user, belt_level in query
+    ]
+
+def rasterize_qr(qr_data):
+    """(modules per side, 8-bit grayscale pixels) at one pixel per module
+
+    Runs inside the image process pool. The PDF scales the image up without
+    interpolation, so one pixel per module prints as sharply as any resolution.
+    """
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    return len(matrix), bytes(0 if dark else 255 for row in matrix for dark in row)
+
+def rasterize_qr_page(payloads):
+    """rasterize_qr for one page of badges; the unit of work sent to the process pool"""
+    return [rasterize_qr(qr_data) for qr_data in payloads]
+
+def rasterize_qr_pages(pages):
+    """Iterator of rasterize_qr_page results in order
+
+    With the process pool, the next page's batch is submitted before the
+    current one is handed out, so it renders while the caller draws.
+    """
+    if not current_app.config['IMAGE_PROCESS_WORKERS']:
+        yield from map(rasterize_qr_page, pages)
+        return
+    pool = get_process_pool()
+    pages = iter(pages)
+    first = next(pages, None)
+    if first is None:
+        return
+    future = pool.submit(rasterize_qr_page, first)
+    for page in pages:
+        following = pool.submit(rasterize_qr_page, page)
+        yield future.result()
+        future = following
+    yield future.result()
+
+def _photo_for_pdf(blob):
+    """ImageReader for a stored picture; JPEGs are passed through to the PDF undecoded"""
+    with Image.open(BytesIO(blob.data)) as img:
+        if img.format == 'JPEG' and img.mode in ('RGB', 'L'):
+            return ImageReader(BytesIO(blob.data))
+        # Pictures stored before derivatives existed may be in another format
+        buffer = BytesIO()
+        img.convert('RGB').save(buffer, format='JPEG', quality=85)
+        return ImageReader(buffer)
+
+def load_photos(picture_hashes):
+    """{sha256: _photo_for_pdf(...)} for one page's pictures, fetched in a single query"""
+    hashes = {sha256 for sha256 in picture_hashes if sha256}
+    if not hashes:
+        return {}
+    blobs = ImageBlob.query.options(db.undefer(ImageBlob.data)).filter(ImageBlob.sha256.in_(hashes)).all()
+    return {blob.sha256: _photo_for_pdf(blob) for blob in blobs}
+
+def _fit_text(text, font, sizes, width):
+    """(text, font size) that fits width, shrinking before truncating"""
+    for size in sizes:
+        if stringWidth(text, font, size) <= width:
+            return text, size
+    size = sizes[-1]
+    while text and stringWidth(text + '...', font, size) > width:
+        text = text[:-1]
+    return text + '...', size
+
+def _draw_badges(canvas, students, qr_codes, photos, page_size=letter):
+    """Draw one page of badges on the canvas"""
+    rows = -(-BADGES_PER_PAGE // BADGE_COLUMNS)
+    cell_width = (page_size[0] - 2 * PAGE_MARGIN) / BADGE_COLUMNS
+    cell_height = (page_size[1] - 2 * PAGE_MARGIN) / rows
+    text_width = cell_width - 28
+    canvas.setLineWidth(0.5)
+    for index, (student, (qr_modules, qr_pixels)) in enumerate(zip(students, qr_codes)):
+        column, row = index % BADGE_COLUMNS, index // BADGE_COLUMNS
+        x = PAGE_MARGIN + column * cell_width
+        y = page_size[1] - PAGE_MARGIN - (row + 1) * cell_height
+        canvas.setStrokeGray(0.6)
+        canvas.rect(x + 4, y + 4, cell_width - 8, cell_height - 8)
+
+        photo_x, photo_y = x + 14, y + 46
+        photo = photos.get(student.picture_hash)
+        if photo is not None:
+            canvas.drawImage(photo, photo_x, photo_y, *PHOTO_SIZE)
+        else:
+            canvas.setStrokeGray(0.85)
+            canvas.rect(photo_x, photo_y, *PHOTO_SIZE)
+
+        qr_image = Image.frombytes('L', (qr_modules, qr_modules), qr_pixels)
+        canvas.drawImage(ImageReader(qr_image), x + cell_width - 14 - QR_SIZE, photo_y, QR_SIZE, QR_SIZE)
+
+        name, name_size = _fit_text(student.name, 'Helvetica-Bold', NAME_FONT_SIZES, text_width)
+        belt, belt_size = _fit_text(student.belt_level, 'Helvetica', (10,), text_width)
+        canvas.setFillGray(0)
+        canvas.setFont('Helvetica-Bold', name_size)
+        canvas.drawString(x + 14, y + 26, name)
+        canvas.setFont('Helvetica', belt_size)
+        canvas.drawString(x + 14, y + 12, belt)
+
+def write_badge_sheet(students, output, progress=None):
+    """Write a badge sheet PDF for BadgeStudent rows to the binary file output
+
+    progress, if given, is called as progress(pages done, total pages) after
+    each page. Needs an app context.
+    """
+    pages = [students[start:start + BADGES_PER_PAGE] for start in range(0, len(students), BADGES_PER_PAGE)]
+    # invariant: no creation date or random document id, so the same students give the same file
+    canvas = Canvas(output, pagesize=letter, pageCompression=1, invariant=1)
+    qr_pages = rasterize_qr_pages([[student.qr_data for student in page] for page in pages])
+    for done, (page, qr_codes) in enumerate(zip(pages, qr_pages), 1):
+        photos = load_photos(student.picture_hash for student in page)
+        _draw_badges(canvas, page, qr_codes, photos)
+        canvas.showPage()
+        if progress is not None:
+            progress(done, len(pages))
+    canvas.save()
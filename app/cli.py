@@ -0,0 +1,117 @@
+import click
+from flask.cli import AppGroup
+
+summary_cli = AppGroup('summary', help='Maintain the denormalized student summary table.')
+
+@summary_cli.command('rebuild')
+def rebuild_summaries():
+    """Recompute every student's summary row from attendance and belt history."""
+    from app.summary import rebuild_student_summaries
+    count = rebuild_student_summaries()
+    click.echo(f'Rebuilt summaries for {count} students.')
+
+@summary_cli.command('reconcile')
+def reconcile_plan_usage():
+    """Re-derive plan usage counters from attendance rows and fix any drift."""
+    from app.summary import reconcile_plan_usage
+    corrected = reconcile_plan_usage()
+    for plan_id, (stored, actual) in sorted(corrected.items()):
+        click.echo(f'Plan {plan_id}: plan usage {stored} -> {actual}')
+    click.echo(f'Corrected {len(corrected)} plan usage counters.')
+
+images_cli = AppGroup('images', help='Manage stored profile pictures.')
+
+@images_cli.command('derive')
+def derive_variants():
+    """Render missing thumbnail/size/WebP derivatives for existing pictures."""
+    from app.images import derive_missing_variants
+    count = derive_missing_variants()
+    click.echo(f'Rendered derivatives for {count} pictures.')
+
+badges_cli = AppGroup('badges', help='Print QR badge sheets.')
+
+@badges_cli.command('sheet')
+@click.option('--class-id', type=int, help='Students currently enrolled in this class.')
+@click.option('--student-id', 'student_ids', type=int, multiple=True, help='A student to include; repeatable.')
+@click.option('--all', 'all_students', is_flag=True, help='Every student.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), default='badges.pdf', show_default=True)
+def badge_sheet(class_id, student_ids, all_students, output):
+    """Write a multi-up QR badge sheet PDF."""
+    from app.badges import badge_students, write_badge_sheet
+    if sum([class_id is not None, bool(student_ids), all_students]) != 1:
+        raise click.UsageError('Give exactly one of --class-id, --student-id or --all.')
+    students = badge_students(
+        student_ids=list(student_ids) or None,
+        class_id=class_id
+    )
+    if not students:
+        raise click.ClickException('No students to print badges for.')
+    with open(output, 'wb') as f:
+        write_badge_sheet(students, f)
+    click.echo(f'Wrote badges for {len(students)} students to {output}.')
+
+export_cli = AppGroup('export', help='Export tables for offline analysis.')
+
+@export_cli.command('tables')
+@click.argument('tables', nargs=-1)
+@click.option('--format', 'file_format', type=click.Choice(['parquet', 'arrow']), default='parquet', show_default=True)
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='Only rows recorded on or after this date.')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Only rows recorded on or before this date.')
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False, writable=True), default='.', show_default=True)
+def export_tables(tables, file_format, start, end, output_dir):
+    """Write attendance, belt_history and attendance_audit (or the TABLES named) as Parquet or Arrow files."""
+    import os
+    from datetime import timedelta
+    from app.exports import export_table, EXPORT_TABLES, EXPORT_EXTENSIONS
+    unknown = set(tables) - set(EXPORT_TABLES)
+    if unknown:
+        raise click.BadParameter(f"{', '.join(sorted(unknown))} (choose from {', '.join(EXPORT_TABLES)})", param_hint='TABLES')
+    if end is not None:
+        end += timedelta(days=1)
+    os.makedirs(output_dir, exist_ok=True)
+    for table in tables or EXPORT_TABLES:
+        output = os.path.join(output_dir, f'{table}.{EXPORT_EXTENSIONS[file_format]}')
+        with open(output, 'wb') as f:
+            for chunk in export_table(table, start, end, file_format):
+                f.write(chunk)
+        click.echo(f'Wrote {table} to {output}.')
+
+jobs_cli = AppGroup('jobs', help='Run background jobs (badge sheets, exports).')
+
+@jobs_cli.command('worker')
+@click.option('--processes', type=int, help='Jobs run at once; defaults to JOB_WORKERS.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty instead of waiting for more jobs.')
+def jobs_worker(processes, burst):
+    """Claim queued jobs and run them in a process pool until stopped."""
+    from app.jobs import run_worker
+    count = run_worker(processes=processes, burst=burst)
+    click.echo(f'Ran {count} jobs.')
+
+@jobs_cli.command('requeue')
+@click.option('--minutes', type=int, default=5, show_default=True, help='No heartbeat from their worker for longer than this.')
+def requeue_stale(minutes):
+    """Queue again jobs left running by a worker that was killed (it has stopped updating their heartbeat)."""
+    from datetime import timedelta
+    from app.jobs import requeue_stale_jobs
+    from app.models import get_pacific_datetime
+    job_ids = requeue_stale_jobs(get_pacific_datetime() - timedelta(minutes=minutes))
+    for job_id in job_ids:
+        click.echo(f'Job {job_id} queued again')
+    click.echo(f'Requeued {len(job_ids)} jobs.')
+
+@jobs_cli.command('prune')
+@click.option('--days', type=int, default=7, show_default=True, help='Finished more than this many days ago.')
+def prune_finished_jobs(days):
+    """Delete finished jobs and their stored results."""
+    from datetime import timedelta
+    from app.jobs import prune_jobs
+    from app.models import get_pacific_datetime
+    count = prune_jobs(get_pacific_datetime() - timedelta(days=days))
+    click.echo(f'Deleted {count} jobs.')
+
+def register_cli(app):
+    app.cli.add_command(summary_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(badges_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(jobs_cli)
@@ -0,0 +1,136 @@
+"""Columnar exports of the attendance, belt history and audit tables for offline analysis.
+
+Each table is written as Parquet (or an Arrow IPC stream) one row group per
+EXPORT_ROW_GROUP_SIZE rows: the query runs with yield_per, each batch of rows
+becomes an Arrow record batch and is written out before the next batch is
+fetched, so memory stays flat however long the history. Repeated short strings
+(status, belt_level, check_in_method, the audit action and field name) are
+dictionary-encoded, and pandas reads them back as categoricals. The bytes are
+handed back as they are written, so the same generator fills a file for the
+CLI and a streamed response for the web.
+
+pyarrow is only needed here; import this module where an export is made
+rather than at startup.
+"""
+from collections import namedtuple
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app import db
+from app.models import Attendance, BeltHistory, AttendanceAudit
+
+EXPORT_ROW_GROUP_SIZE = 50000
+EXPORT_FORMATS = ('parquet', 'arrow')
+EXPORT_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrows'}
+EXPORT_MIMETYPES = {'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.stream'}
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# columns: (name, model column, Arrow type); range_column is what start/end filter on
+ExportTable = namedtuple('ExportTable', ['columns', 'range_column'])
+
+EXPORT_TABLES = {
+    'attendance': ExportTable([
+        ('id', Attendance.id, pa.int64()),
+        ('student_id', Attendance.student_id, pa.int64()),
+        ('date', Attendance.date, pa.date32()),
+        ('status', Attendance.status, _CATEGORY),
+        ('free_class', Attendance.free_class, pa.bool_()),
+        ('class_id', Attendance.class_id, pa.int64()),
+        ('check_in_time', Attendance.check_in_time, pa.time64('us')),
+        ('check_in_method', Attendance.check_in_method, _CATEGORY),
+        ('notes', Attendance.notes, pa.string()),
+        ('created_at', Attendance.created_at, pa.timestamp('us')),
+        ('created_by', Attendance.created_by, pa.int64()),
+        ('updated_at', Attendance.updated_at, pa.timestamp('us')),
+    ], Attendance.created_at),
+    'belt_history': ExportTable([
+        ('id', BeltHistory.id, pa.int64()),
+        ('student_id', BeltHistory.student_id, pa.int64()),
+        ('belt_level', BeltHistory.belt_level, _CATEGORY),
+        ('date_obtained', BeltHistory.date_obtained, pa.date32()),
+        ('created_at', BeltHistory.created_at, pa.timestamp('us')),
+        ('updated_at', BeltHistory.updated_at, pa.timestamp('us')),
+    ], BeltHistory.created_at),
+    'attendance_audit': ExportTable([
+        ('id', AttendanceAudit.id, pa.int64()),
+        ('attendance_id', AttendanceAudit.attendance_id, pa.int64()),
+        ('action', AttendanceAudit.action, _CATEGORY),
+        ('field_name', AttendanceAudit.field_name, _CATEGORY),
+        ('old_value', AttendanceAudit.old_value, pa.string()),
+        ('new_value', AttendanceAudit.new_value, pa.string()),
+        ('changed_by', AttendanceAudit.changed_by, pa.int64()),
+        ('changed_at', AttendanceAudit.changed_at, pa.timestamp('us')),
+    ], AttendanceAudit.changed_at),
+}
+
+def export_schema(table):
+    return pa.schema([(name, arrow_type) for name, _, arrow_type in EXPORT_TABLES[table].columns])
+
+class _ChunkSink:
+    """Write-only file object that keeps what was written until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _writer(sink, schema, file_format):
+    if file_format == 'parquet':
+        categories = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+        return pq.ParquetWriter(sink, schema, use_dictionary=categories, compression='snappy')
+    # The stream format, not the file format: each batch may bring its own dictionaries
+    return pa.ipc.new_stream(sink, schema)
+
+def export_table(table, start=None, end=None, file_format='parquet'):
+    """Yield the table's rows with range_column from start up to (not including) end as Parquet/Arrow bytes
+
+    start and end are datetimes; either may be None for no bound. Rows are in
+    id order. Needs an app context for the whole iteration (wrap in
+    stream_with_context when returned from a view).
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'Unknown table: {table}')
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown format: {file_format}')
+    spec = EXPORT_TABLES[table]
+    schema = export_schema(table)
+    query = db.select(*[column for _, column, _ in spec.columns])
+    if start is not None:
+        query = query.where(spec.range_column >= start)
+    if end is not None:
+        query = query.where(spec.range_column < end)
+    query = query.order_by(spec.columns[0][1])
+
+    sink = _ChunkSink()
+    writer = _writer(pa.PythonFile(sink, mode='w'), schema, file_format)
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_ROW_GROUP_SIZE))
+    try:
+        for rows in result.partitions():
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                schema=schema
+            )
+            writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        result.close()
+    writer.close()
+    yield sink.drain()
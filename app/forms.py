@@ -1,6 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, SelectField, DateField, TimeField, IntegerField, BooleanField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError, Optional, NumberRange
+from app import db
 from app.models import User
 
 class RegistrationForm(FlaskForm):
@@ -23,7 +24,7 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
+        user = db.session.query(User.id).filter_by(username=username.data).first()
         if user is not None:
             raise ValidationError('Please use a different username.')
 
@@ -45,7 +46,7 @@ class AddStudentForm(FlaskForm):
     submit = SubmitField('Add Student')
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
+        user = db.session.query(User.id).filter_by(username=username.data).first()
         if user is not None:
             raise ValidationError('Please use a different username.')
 
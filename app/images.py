@@ -0,0 +1,185 @@
+"""Content-addressed image storage and profile picture derivatives.
+
+Image bytes live in the ImageBlob table keyed by their SHA-256, so identical
+uploads are stored once and a hash can be served with immutable caching.
+Each uploaded profile picture is rendered once into every size/format in
+PICTURE_SIZES x PICTURE_FORMATS; ImageVariant maps the picture (identified by
+its medium JPEG hash, which is what User.profile_picture_hash points at) to
+those derivatives.
+"""
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image
+from flask import current_app
+from app import db
+from app.models import ImageBlob, ImageVariant, User
+
+# (width, height) for each derivative, all in the 3:4 portrait ratio
+PICTURE_SIZES = {
+    'thumb': (48, 64),
+    'medium': (150, 200),
+    'large': (300, 400),
+}
+
+PICTURE_FORMATS = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+
+# The size/format User.profile_picture_hash refers to
+PRIMARY_VARIANT = 'medium.jpeg'
+
+def variant_name(size, image_format):
+    return f'{size}.{image_format}'
+
+def crop_to_ratio(img, target_width, target_height):
+    """Center-crop an image to the target aspect ratio"""
+    target_ratio = target_width / target_height
+    width, height = img.size
+    current_ratio = width / height
+
+    if current_ratio > target_ratio:
+        # Image is wider than target ratio
+        new_width = int(height * target_ratio)
+        left = (width - new_width) // 2
+        return img.crop((left, 0, left + new_width, height))
+    # Image is taller than target ratio
+    new_height = int(width / target_ratio)
+    top = (height - new_height) // 2
+    return img.crop((0, top, width, top + new_height))
+
+def render_picture_variants(img):
+    """Render every derivative of a picture; returns {variant name: (bytes, content type)}"""
+    largest_width, largest_height = max(PICTURE_SIZES.values())
+    # For JPEGs, let the decoder downscale by 1/2, 1/4 or 1/8 while still covering the largest size
+    img.draft('RGB', (largest_width, largest_height))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img = crop_to_ratio(img, largest_width, largest_height)
+
+    variants = {}
+    # Work from the largest size down so each resize starts from a smaller image
+    for size, dimensions in sorted(PICTURE_SIZES.items(), key=lambda item: item[1], reverse=True):
+        img = img.resize(dimensions, Image.Resampling.LANCZOS) if img.size != dimensions else img
+        for image_format, content_type in PICTURE_FORMATS.items():
+            buffer = BytesIO()
+            img.save(buffer, format=image_format.upper(), quality=85)
+            variants[variant_name(size, image_format)] = (buffer.getvalue(), content_type)
+    return variants
+
+def render_picture_variants_from_bytes(data):
+    """Decode an uploaded image and render its derivatives; runs inside the image process pool"""
+    with Image.open(BytesIO(data)) as img:
+        return render_picture_variants(img)
+
+_process_pool = None
+
+def get_process_pool():
+    """Per-process pool for image work, created on first use (after any gunicorn fork)"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_PROCESS_WORKERS'])
+    return _process_pool
+
+def process_uploaded_picture(data):
+    """Render derivatives for uploaded bytes off the request thread's interpreter
+
+    With IMAGE_PROCESS_WORKERS set to 0 the work runs inline instead.
+    """
+    if not current_app.config['IMAGE_PROCESS_WORKERS']:
+        return render_picture_variants_from_bytes(data)
+    future = get_process_pool().submit(render_picture_variants_from_bytes, data)
+    return future.result(timeout=current_app.config['IMAGE_PROCESS_TIMEOUT'])
+
+def store_image(data, content_type='image/jpeg'):
+    """Store image bytes (if not already present) and return their SHA-256 hex digest"""
+    sha256 = hashlib.sha256(data).hexdigest()
+    if db.session.get(ImageBlob, sha256) is None:
+        db.session.add(ImageBlob(sha256=sha256, content_type=content_type, size=len(data), data=data))
+    return sha256
+
+def store_picture_variants(variants):
+    """Store rendered derivatives and link them to the primary one; returns the primary hash"""
+    hashes = {name: store_image(data, content_type) for name, (data, content_type) in variants.items()}
+    source = hashes[PRIMARY_VARIANT]
+    existing = {variant.name for variant in ImageVariant.query.filter_by(source_sha256=source).all()}
+    for name, sha256 in hashes.items():
+        if name not in existing:
+            db.session.add(ImageVariant(source_sha256=source, name=name, sha256=sha256))
+    return source
+
+def release_image(sha256):
+    """Delete a picture's blobs and derivatives once no user references it any more"""
+    if not sha256:
+        return
+    db.session.flush()
+    still_used = db.session.query(User.id).filter(User.profile_picture_hash == sha256).first()
+    if still_used is not None:
+        return
+
+    variant_hashes = {row.sha256 for row in db.session.query(ImageVariant.sha256).filter_by(source_sha256=sha256).all()}
+    ImageVariant.query.filter_by(source_sha256=sha256).delete(synchronize_session=False)
+    for candidate in variant_hashes | {sha256}:
+        # Identical derivatives can be shared between pictures, and one picture's
+        # derivative can be another user's picture
+        shared = db.session.query(ImageVariant.source_sha256).filter(db.or_(
+            ImageVariant.sha256 == candidate,
+            ImageVariant.source_sha256 == candidate
+        )).first() or db.session.query(User.id).filter(User.profile_picture_hash == candidate).first()
+        if shared is None:
+            ImageBlob.query.filter_by(sha256=candidate).delete(synchronize_session=False)
+
+def picture_variant_hashes(source_sha256):
+    """{variant name: sha256} for a picture, falling back to the primary image for missing derivatives"""
+    if not source_sha256:
+        return {}
+    hashes = {
+        variant_name(size, image_format): source_sha256
+        for size in PICTURE_SIZES for image_format in PICTURE_FORMATS
+    }
+    for variant in ImageVariant.query.filter_by(source_sha256=source_sha256).all():
+        hashes[variant.name] = variant.sha256
+    return hashes
+
+def derive_missing_variants():
+    """Render derivatives for pictures stored before they existed; returns the number of pictures updated
+
+    Only sizes up to the stored picture's own resolution are generated, the
+    rest keep falling back to the primary image.
+    """
+    updated = 0
+    sources = [row.profile_picture_hash for row in db.session.query(User.profile_picture_hash).filter(
+        User.profile_picture_hash.isnot(None)
+    ).distinct().all()]
+    for source in sources:
+        existing = {row.name for row in db.session.query(ImageVariant.name).filter_by(source_sha256=source).all()}
+        wanted = {variant_name(size, image_format) for size in PICTURE_SIZES for image_format in PICTURE_FORMATS}
+        if wanted <= existing:
+            continue
+        blob = ImageBlob.query.options(db.undefer(ImageBlob.data)).filter_by(sha256=source).first()
+        added = False
+        with Image.open(BytesIO(blob.data)) as img:
+            img = img.convert('RGB')
+            img = crop_to_ratio(img, *PICTURE_SIZES['large'])
+            for size, dimensions in PICTURE_SIZES.items():
+                if dimensions[0] > img.size[0]:
+                    continue
+                resized = img.resize(dimensions, Image.Resampling.LANCZOS) if img.size != dimensions else img
+                for image_format, content_type in PICTURE_FORMATS.items():
+                    name = variant_name(size, image_format)
+                    if name in existing:
+                        continue
+                    if name == PRIMARY_VARIANT:
+                        sha256 = source
+                    else:
+                        buffer = BytesIO()
+                        resized.save(buffer, format=image_format.upper(), quality=85)
+                        sha256 = store_image(buffer.getvalue(), content_type)
+                    db.session.add(ImageVariant(source_sha256=source, name=name, sha256=sha256))
+                    added = True
+        # Pictures too small for the remaining sizes are decoded again next time, but not counted
+        if added:
+            db.session.commit()
+            updated += 1
+    return updated
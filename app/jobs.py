@@ -0,0 +1,427 @@
+"""Background jobs for work too slow to do inside a web request.
+
+A route queues a Job row (submit_job) and returns straight away; `flask jobs
+worker` claims queued jobs oldest first and runs each one in a process pool of
+JOB_WORKERS processes, so a big badge sheet or export occupies a job process
+instead of a gunicorn worker that everyone else is waiting on. A job is
+claimed with a conditional UPDATE (still 'queued'), so several workers can
+share the queue. Each pool process builds its own app from the worker's config
+and so has its own database connections.
+
+Handlers are registered with @job_handler(kind). They take the job's params, a
+JobProgress and a binary file to write the result into, and return a JobResult
+naming the download. The file is a temporary one in the job process; once the
+handler returns it is copied into JobResultChunk rows in the same transaction
+that marks the job done, so any web server can stream it back whether or not
+it shares a disk with the worker. Progress is written on its own connection
+between steps (pages, months of records), never while a query is still being
+read, so it works on SQLite too. While its jobs run, the worker updates their heartbeat_at every JOB_HEARTBEAT_INTERVAL;
+`flask jobs requeue` only queues again jobs whose heartbeat has stopped, so a
+job that is merely slow is never run twice.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import Job, JobResultChunk, get_pacific_datetime
+
+JOB_HANDLERS = {}
+JOB_PROGRESS_INTERVAL = 1  # seconds; progress is written at most this often
+JOB_HEARTBEAT_INTERVAL = 30  # seconds; how often a worker marks its running jobs as still alive
+JOB_RESULT_CHUNK_SIZE = 1024 * 1024  # bytes per JobResultChunk row
+
+JobResult = namedtuple('JobResult', ['name', 'mimetype'])
+
+def job_handler(kind):
+    """Register func(params, progress, output) -> JobResult as the handler for jobs of this kind"""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+def submit_job(kind, params, user_id):
+    """Queue a job and return it; raises ValueError for an unknown kind"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = Job(kind=kind, params=json.dumps(params), created_by=user_id)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+class JobProgress:
+    """Passed to handlers; call progress(done, total) as work completes"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.percent = 0
+        self.written_at = 0
+
+    def __call__(self, done, total):
+        # 100 is only set when the result is stored
+        percent = min(99, done * 100 // total) if total else 0
+        if percent <= self.percent or time.monotonic() - self.written_at < JOB_PROGRESS_INTERVAL:
+            return
+        # Own connection and transaction, so the handler's session is left alone
+        with db.engine.begin() as connection:
+            connection.execute(db.update(Job).where(Job.id == self.job_id).values(progress=percent))
+        self.percent, self.written_at = percent, time.monotonic()
+
+def _date(params, name):
+    value = params.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def _months(start, end):
+    """(first, last) day of each calendar month from start to end, clipped to the range"""
+    months = []
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        months.append((start, min(end, next_month - timedelta(days=1))))
+        start = next_month
+    return months
+
+@job_handler('badge_sheet')
+def badge_sheet_job(params, progress, output):
+    """Badge sheet PDF; params student_ids, class_id or all, as for /teacher/badges"""
+    from app.badges import badge_students, write_badge_sheet
+    students = badge_students(student_ids=params.get('student_ids'), class_id=params.get('class_id'))
+    if not students:
+        raise ValueError('No students to print badges for.')
+    write_badge_sheet(students, output, progress)
+    return JobResult(params.get('download_name', 'badges.pdf'), 'application/pdf')
+
+@job_handler('attendance_csv')
+def attendance_csv_job(params, progress, output):
+    """Attendance CSV; params start, end (YYYY-MM-DD) and the filters of /reports/attendance.csv"""
+    from app.reports import attendance_csv
+    start, end = _date(params, 'start'), _date(params, 'end')
+    if start is None or end is None or end < start:
+        raise ValueError('Invalid date range')
+    filters = {
+        name: params[name] for name in ('student_id', 'class_id', 'teacher_id', 'status')
+        if params.get(name) is not None
+    }
+    # A month at a time, so progress is written between reads
+    months = _months(start, end)
+    for done, (month_start, month_end) in enumerate(months, 1):
+        rows = attendance_csv(month_start, month_end, **filters)
+        header = next(rows)
+        if done == 1:
+            output.write(header.encode())
+        for chunk in rows:
+            output.write(chunk.encode())
+        progress(done, len(months))
+    return JobResult(f'attendance_{start}_{end}.csv', 'text/csv')
+
+@job_handler('table_export')
+def table_export_job(params, progress, output):
+    """Parquet/Arrow table export; params table, format, start and end as for /reports/export/<table>"""
+    from app.exports import export_table, EXPORT_EXTENSIONS, EXPORT_MIMETYPES
+    table, file_format = params.get('table'), params.get('format', 'parquet')
+    start, end = _date(params, 'start'), _date(params, 'end')
+    # One streaming read from start to finish, so there is no progress to report until it is done
+    for chunk in export_table(
+        table,
+        datetime.combine(start, datetime.min.time()) if start else None,
+        datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None,
+        file_format
+    ):
+        output.write(chunk)
+    return JobResult(f'{table}.{EXPORT_EXTENSIONS[file_format]}', EXPORT_MIMETYPES[file_format])
+
+def job_json(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'result_name': job.result_name,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None
+    }
+
+def _finish_job(job_id, worker, output=None, **values):
+    """Record how a job ended, and store its result file if given, in one transaction
+
+    Nothing is recorded if the job is no longer running on worker (it was queued
+    again and claimed by another), so a job run twice keeps a single result.
+    """
+    finished = db.session.execute(
+        db.update(Job).where(Job.id == job_id, Job.status == 'running', Job.worker == worker).values(
+            finished_at=get_pacific_datetime(), **values
+        )
+    ).rowcount
+    if not finished:
+        db.session.rollback()
+        logging.getLogger("jobs").warning(f"Job {job_id} is no longer running on {worker}; its result was dropped")
+        return
+    if output is not None:
+        output.seek(0)
+        for seq, data in enumerate(iter(lambda: output.read(JOB_RESULT_CHUNK_SIZE), b'')):
+            db.session.execute(db.insert(JobResultChunk).values(job_id=job_id, seq=seq, data=data))
+    db.session.commit()
+
+def job_result_chunks(job_id):
+    """A done job's result, read a chunk per query so only one is in memory at a time"""
+    seq = 0
+    while True:
+        data = db.session.execute(
+            db.select(JobResultChunk.data).where(JobResultChunk.job_id == job_id, JobResultChunk.seq == seq)
+        ).scalar()
+        if data is None:
+            return
+        yield data
+        seq += 1
+
+_job_app = None
+
+def _init_job_process(config):
+    """Pool initializer: an app with the worker's config, and so its own engine"""
+    global _job_app
+    from app import create_app
+    # Ctrl-C reaches the whole process group; the worker decides what happens to running jobs.
+    # SIGTERM (sent to every process when a host shuts down) just ends this one; its job is queued again
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Already off the request path, so badge QR codes are rendered here rather than in another pool
+    _job_app = create_app(type('JobProcessConfig', (), dict(config, IMAGE_PROCESS_WORKERS=0)))
+
+def run_job(job_id):
+    """Run a claimed job in this pool process and record its result or error on the job"""
+    with _job_app.app_context():
+        job = db.session.get(Job, job_id)
+        worker = job.worker
+        # Deleted when closed, so a job cut off part way leaves nothing behind
+        with tempfile.TemporaryFile() as output:
+            try:
+                result = JOB_HANDLERS[job.kind](json.loads(job.params), JobProgress(job_id), output)
+            except Exception as e:
+                db.session.rollback()
+                if isinstance(e, ValueError):
+                    error = str(e)
+                else:
+                    logging.getLogger("jobs").error(f"Job {job_id} ({job.kind}) failed: {e}", exc_info=True)
+                    error = 'The job failed; see the worker log'
+                _finish_job(job_id, worker, status='failed', error=error)
+                return
+            _finish_job(
+                job_id,
+                worker,
+                output,
+                status='done',
+                progress=100,
+                result_name=result.name,
+                result_mimetype=result.mimetype,
+                result_size=output.seek(0, os.SEEK_END)
+            )
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def claim_next_job(worker):
+    """Mark the oldest queued job as running on worker and return its id; None when nothing is queued"""
+    while True:
+        job_id = db.session.query(Job.id).filter(Job.status == 'queued').order_by(Job.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        claimed = db.session.execute(
+            db.update(Job).where(
+                Job.id == job_id,
+                Job.status == 'queued'
+            ).values(status='running', worker=worker, started_at=get_pacific_datetime(), heartbeat_at=get_pacific_datetime())
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+        # Another worker claimed it first; try the next one
+
+def requeue_jobs(job_ids):
+    if job_ids:
+        db.session.execute(
+            db.update(Job).where(Job.id.in_(job_ids), Job.status == 'running').values(
+                status='queued', progress=0, worker=None, started_at=None, heartbeat_at=None
+            )
+        )
+        db.session.commit()
+
+def beat_jobs(job_ids, worker):
+    """Mark worker's running jobs as still alive"""
+    if job_ids:
+        # Not a job that has since finished, or that was queued again and claimed by another worker
+        db.session.execute(
+            db.update(Job).where(Job.id.in_(job_ids), Job.status == 'running', Job.worker == worker).values(
+                heartbeat_at=get_pacific_datetime()
+            )
+        )
+        db.session.commit()
+
+def requeue_stale_jobs(older_than):
+    """Queue again running jobs with no heartbeat since older_than (their worker was killed)"""
+    job_ids = [
+        job_id for (job_id,) in db.session.query(Job.id).filter(Job.status == 'running', Job.heartbeat_at < older_than)
+    ]
+    requeue_jobs(job_ids)
+    return job_ids
+
+def prune_jobs(older_than):
+    """Delete finished jobs, and their results, that finished before older_than; returns how many"""
+    pruned = Job.query.filter(
+        Job.status.in_(['done', 'failed']),
+        Job.finished_at < older_than
+    )
+    db.session.execute(
+        db.delete(JobResultChunk).where(JobResultChunk.job_id.in_(pruned.with_entities(Job.id).scalar_subquery()))
+    )
+    count = pruned.delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def _new_pool(processes, config):
+    return ProcessPoolExecutor(max_workers=processes, initializer=_init_job_process, initargs=(config,))
+
+class _JobRunner:
+    """The worker's process pool and the jobs running in it, see run_worker"""
+
+    def __init__(self, processes, config, worker):
+        self.processes = processes
+        self.config = config
+        self.worker = worker
+        self.beaten_at = time.monotonic()
+        self.pool = _new_pool(processes, config)
+        self.running = {}  # future -> job id
+        self.suspects = set()  # Lost together with other jobs; each runs alone next time
+        self.held = None  # A claimed suspect waiting for the running jobs to finish
+        self.completed = 0
+        self.stopping = False
+
+    def _start(self, job_id):
+        self.running[self.pool.submit(run_job, job_id)] = job_id
+
+    def can_claim(self):
+        """Whether there is room for another job, with no suspect running or waiting to run alone"""
+        return self.held is None and len(self.running) < self.processes and not self.suspects & set(self.running.values())
+
+    def start_or_hold(self, job_id):
+        """Run a claimed job, or hold it back if it is a suspect and other jobs are running"""
+        if job_id in self.suspects and self.running:
+            self.held = job_id
+        else:
+            self._start(job_id)
+
+    def start_held(self):
+        """Run the held suspect once the pool has emptied"""
+        if self.held is not None and not self.running:
+            self._start(self.held)
+            self.held = None
+
+    def wait(self, timeout):
+        """Wait up to timeout for a running job to end, deal with the ones that did, and keep the rest alive"""
+        done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+        futures = set(done)
+        if any(isinstance(future.exception(), BrokenProcessPool) for future in futures):
+            futures |= self._replace_broken_pool()
+        lost = [job_id for job_id in map(self._collect, futures) if job_id is not None]
+        self._handle_lost(lost)
+        self._beat()
+
+    def _beat(self):
+        if time.monotonic() - self.beaten_at < JOB_HEARTBEAT_INTERVAL:
+            return
+        claimed = list(self.running.values()) + ([self.held] if self.held is not None else [])
+        beat_jobs(claimed, self.worker)
+        self.beaten_at = time.monotonic()
+
+    def _replace_broken_pool(self):
+        """A pool process died, and every running job is lost with it; returns their futures"""
+        futures = wait(self.running)[0]
+        self.pool.shutdown(wait=False)
+        if not self.stopping:
+            self.pool = _new_pool(self.processes, self.config)
+        return futures
+
+    def _collect(self, future):
+        """Count a job that ended; returns its id if it was cut off with its process"""
+        job_id = self.running.pop(future)
+        error = future.exception()
+        if error is None:
+            self.completed += 1
+            return None
+        # run_job records the handler's errors itself, so the job was cut off
+        logging.getLogger("jobs").error(f"Job {job_id} stopped with its process: {error!r}")
+        return job_id
+
+    def _handle_lost(self, lost):
+        """Fail a job lost on its own; queue jobs lost together (or while stopping) again"""
+        if self.stopping or len(lost) > 1:
+            requeue_jobs(lost)
+            self.suspects.update(lost)
+        elif lost:
+            self.completed += 1
+            _finish_job(lost[0], self.worker, status='failed', error='The job process exited unexpectedly')
+
+    def stop(self):
+        """Claim nothing more and wait for the running jobs; any cut off are queued again"""
+        self.stopping = True
+        if self.held is not None:
+            requeue_jobs([self.held])
+            self.held = None
+        while self.running:
+            # With a timeout, so the heartbeat goes on while slow jobs finish
+            self.wait(JOB_HEARTBEAT_INTERVAL)
+
+    def shutdown(self):
+        # Jobs still running after a second interrupt are left for `flask jobs requeue`
+        self.pool.shutdown(wait=not self.running, cancel_futures=True)
+
+def run_worker(processes=None, burst=False):
+    """Claim and run jobs in a pool of processes until interrupted; returns the number of jobs run
+
+    With burst, stops once the queue is empty instead of waiting for more.
+    A pool process dying takes every running job down with it, so a job lost
+    on its own is failed, while jobs lost together are queued again and each
+    run alone next time to find the one responsible. On Ctrl-C or SIGTERM no
+    more jobs are claimed and the running ones are waited for (any cut off are
+    queued again). Interrupting a second time stops at once and leaves the
+    running jobs for `flask jobs requeue`.
+    """
+    app = current_app._get_current_object()
+    processes = processes or app.config['JOB_WORKERS']
+    poll_interval = app.config['JOB_POLL_INTERVAL']
+    config = {key: value for key, value in app.config.items() if key.isupper()}
+    worker = worker_name()
+    signal.signal(signal.SIGTERM, _interrupt)
+    runner = _JobRunner(processes, config, worker)
+    try:
+        try:
+            while True:
+                runner.start_held()
+                if runner.can_claim():
+                    job_id = claim_next_job(worker)
+                    if job_id is not None:
+                        runner.start_or_hold(job_id)
+                        continue
+                    if burst and not runner.running:
+                        break
+                if runner.running:
+                    runner.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        runner.stop()
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        runner.shutdown()
+    return runner.completed
@@ -1,9 +1,21 @@
-from datetime import datetime
+from datetime import datetime, time, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
 from flask_login import UserMixin
 import uuid
 import pytz
 
+# Belt levels in rank order, lowest first
+BELT_LEVELS = ['No Belt', 'White', 'Yellow', 'Green', 'Purple', 'Purple-Blue', 'Blue',
+               'Blue-Brown', 'Brown', 'Brown-Red', 'Red', 'Red-Black', 'Black']
+
+# Plan length in days for each program
+PROGRAM_DURATIONS = {
+    '3 months': 90,
+    '6 months': 180,
+    '1 year': 365,
+}
+
 # Pacific timezone
 PACIFIC_TZ = pytz.timezone('US/Pacific')
 
@@ -21,8 +33,13 @@ def get_pacific_datetime():
 
 # Import db after function definitions to avoid circular imports
 from app import db, login_manager
+from app.qr_signing import sign_student_code
 
 class User(UserMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_user_role', 'role'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), nullable=False)
@@ -32,13 +49,15 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), nullable=False)  # 'teacher' or 'student'
     created_at = db.Column(db.DateTime, default=get_pacific_datetime)
     qr_code_id = db.Column(db.String(36), unique=True, name='uq_user_qr_code_id', default=lambda: str(uuid.uuid4()))
+    qr_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped to revoke signed QR codes
     profile_picture = db.Column(db.String(255))  # Store the filename of the profile picture
-    profile_picture_data = db.Column(db.Text)  # Store the base64 encoded image data
+    profile_picture_hash = db.Column(db.String(64), db.ForeignKey('image_blob.sha256', name='fk_user_profile_picture_hash'), nullable=True)  # ImageBlob holding the picture
     belt_level = db.Column(db.String(20), default='No Belt')  # Default changed from 'Not Set' to 'No Belt'
     
     # New personal information fields
     date_of_birth = db.Column(db.Date, nullable=True)
     gender = db.Column(db.String(10), nullable=True)  # Male, Female, Other
+    # Copy of the current Plan row (see sync_plan_fields); Plan is the source of truth
     program = db.Column(db.String(20), nullable=True)  # 3 months, 6 months, 1 year
     plan = db.Column(db.String(20), nullable=True)  # 1/week, 2/week
     effective_from = db.Column(db.Date, nullable=True)  # Effective period start date
@@ -74,13 +93,37 @@ class User(UserMixin, db.Model):
         return self.role == 'teacher'
 
     def generate_qr_code_data(self):
+        if current_app.config.get('QR_SIGNED_CODES'):
+            return sign_student_code(self.id, self.qr_version)
         return f"student:{self.qr_code_id}"
 
+    def rotate_qr_code(self):
+        """Revoke every printed code (signed and legacy) by issuing a new id and version"""
+        self.qr_code_id = str(uuid.uuid4())
+        self.qr_version = (self.qr_version or 1) + 1
+
+    def current_plan(self):
+        """The student's most recent plan (latest effective_from), or None"""
+        return self.plans.first()
+
+    def sync_plan_fields(self):
+        """Copy the current plan onto the User plan columns still read by older scripts"""
+        plan = self.current_plan()
+        self.program = plan.program if plan else None
+        self.plan = plan.plan if plan else None
+        self.classes = str(plan.classes) if plan and plan.classes is not None else None
+        self.effective_from = plan.effective_from if plan else None
+        self.effective_to = plan.effective_to if plan else None
+
 @login_manager.user_loader
 def load_user(id):
     return User.query.get(int(id))
 
 class BeltHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_belt_history_student_id_date_obtained', 'student_id', 'date_obtained'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     belt_level = db.Column(db.String(20), nullable=False)
@@ -88,7 +131,62 @@ class BeltHistory(db.Model):
     created_at = db.Column(db.DateTime, default=get_pacific_datetime)
     updated_at = db.Column(db.DateTime, default=get_pacific_datetime, onupdate=get_pacific_datetime)
 
+class Plan(db.Model):
+    """One plan period for a student; renewals add a row, so earlier plans are kept
+
+    starts_at/ends_at is the window attendance counts against and
+    attended_count the non-free classes in it, kept up to date by app.summary.
+    """
+    __table_args__ = (
+        db.Index('ix_plan_student_id_effective_from', 'student_id', 'effective_from'),
+        db.Index('ix_plan_starts_at_ends_at', 'starts_at', 'ends_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    program = db.Column(db.String(20), nullable=True)  # 3 months, 6 months, 1 year
+    plan = db.Column(db.String(20), nullable=True)  # 1/week, 2/week
+    classes = db.Column(db.Integer, nullable=True)  # Classes included in the plan
+    effective_from = db.Column(db.Date, nullable=True)
+    effective_to = db.Column(db.Date, nullable=True)
+    starts_at = db.Column(db.DateTime, nullable=True)  # NULL when the program length is unknown
+    ends_at = db.Column(db.DateTime, nullable=True)
+    attended_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=get_pacific_datetime)
+    updated_at = db.Column(db.DateTime, default=get_pacific_datetime, onupdate=get_pacific_datetime)
+
+    student = db.relationship('User', backref=db.backref(
+        'plans', lazy='dynamic', cascade='all, delete-orphan',
+        order_by='(Plan.effective_from.desc().nullslast(), Plan.id.desc())'
+    ))
+
+    def set_window(self):
+        """Derive effective_to and the counting window from program and effective_from"""
+        days = PROGRAM_DURATIONS.get(self.program)
+        if days is None or self.effective_from is None:
+            self.starts_at = self.ends_at = None
+            return
+        self.effective_to = self.effective_from + timedelta(days=days)
+        # Classes count from 12:01am on the first day to 11:59pm on the last
+        self.starts_at = datetime.combine(self.effective_from, time(0, 1))
+        self.ends_at = datetime.combine(self.effective_to, time(23, 59))
+
+    @property
+    def remaining(self):
+        return max(0, (self.classes or 0) - self.attended_count)
+
 class Attendance(db.Model):
+    __table_args__ = (
+        # One record per student per day; also serves check_existing_attendance
+        db.Index('uq_attendance_student_id_date', 'student_id', 'date', unique=True),
+        # Replayed scanner batches are recognised by the scan's client id
+        db.Index('uq_attendance_client_id', 'client_id', unique=True),
+        # Per-student created_at ranges (plan usage) and MAX(created_at) for the dashboard
+        db.Index('ix_attendance_student_id_created_at', 'student_id', 'created_at'),
+        # Report date ranges across all students; covers the columns app/reports.py aggregates
+        db.Index('ix_attendance_created_at_report', 'created_at', 'status', 'free_class', 'student_id', 'class_id', 'created_by'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -101,8 +199,13 @@ class Attendance(db.Model):
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=True)  # Link to specific class
     check_in_time = db.Column(db.Time, nullable=True)  # Actual check-in time within class window
     check_in_method = db.Column(db.String(20), nullable=True)  # 'qr_code' or 'manual'
+    client_id = db.Column(db.String(36), nullable=True)  # Scanner-generated UUID, makes batch uploads idempotent
 
 class AttendanceAudit(db.Model):
+    __table_args__ = (
+        db.Index('ix_attendance_audit_attendance_id_changed_at', 'attendance_id', 'changed_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     attendance_id = db.Column(db.Integer, db.ForeignKey('attendance.id'), nullable=False)
     action = db.Column(db.String(20), nullable=False)  # 'created', 'updated', 'deleted'
@@ -116,6 +219,32 @@ class AttendanceAudit(db.Model):
     attendance = db.relationship('Attendance', backref='audit_history')
     user = db.relationship('User', backref='attendance_audits')
 
+class ImageBlob(db.Model):
+    """Image bytes keyed by their SHA-256, shared by every row that references the same content"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    content_type = db.Column(db.String(32), nullable=False, default='image/jpeg')
+    size = db.Column(db.Integer, nullable=False)
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))  # Only loaded when an image is served
+    created_at = db.Column(db.DateTime, default=get_pacific_datetime)
+
+class ImageVariant(db.Model):
+    """A rendered size/format of a picture, keyed by the picture's primary image hash"""
+    source_sha256 = db.Column(db.String(64), db.ForeignKey('image_blob.sha256'), primary_key=True)
+    name = db.Column(db.String(20), primary_key=True)  # e.g. 'thumb.webp', see app.images.PICTURE_SIZES
+    sha256 = db.Column(db.String(64), db.ForeignKey('image_blob.sha256'), nullable=False)
+
+class StudentSummary(db.Model):
+    """Denormalized per-student dashboard data, maintained by app.summary"""
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_attended_at = db.Column(db.DateTime, nullable=True)  # MAX(Attendance.created_at)
+    latest_belt_level = db.Column(db.String(20), nullable=True)  # Most recent BeltHistory entry
+    month_start = db.Column(db.Date, nullable=True)  # Month that month_attendance_count refers to
+    month_attendance_count = db.Column(db.Integer, nullable=False, default=0)
+    plan_attended_count = db.Column(db.Integer, nullable=False, default=0)  # Plan.attended_count of the current plan
+    updated_at = db.Column(db.DateTime, default=get_pacific_datetime, onupdate=get_pacific_datetime)
+
+    student = db.relationship('User', backref=db.backref('summary', uselist=False))
+
 class Class(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)  # e.g., "Monday Morning Adults"
@@ -168,4 +297,36 @@ class ClassHoliday(db.Model):
     date = db.Column(db.Date, nullable=False)
     description = db.Column(db.String(200), nullable=True)  # e.g., "Christmas", "Spring Break"
     is_recurring = db.Column(db.Boolean, default=False)  # True for annual holidays like Christmas
-    created_at = db.Column(db.DateTime, default=get_pacific_datetime) 
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=get_pacific_datetime) 
+
+
+class Job(db.Model):
+    """Long-running work (badge sheets, exports) queued for `flask jobs worker`, see app.jobs"""
+    __table_args__ = (
+        # The worker claims the oldest queued job
+        db.Index('ix_job_status_id', 'status', 'id'),
+        # A teacher's recent jobs
+        db.Index('ix_job_created_by_created_at', 'created_by', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # A key of app.jobs.JOB_HANDLERS
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'done', 'failed'
+    progress = db.Column(db.Integer, nullable=False, default=0)  # Percent
+    error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)  # host:pid of the worker that claimed it
+    result_name = db.Column(db.String(200), nullable=True)  # Download file name
+    result_mimetype = db.Column(db.String(100), nullable=True)
+    result_size = db.Column(db.Integer, nullable=True)  # Bytes, stored in JobResultChunk rows
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=get_pacific_datetime)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Updated by the worker while the job runs
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class JobResultChunk(db.Model):
+    """A piece of a done job's result file, so any web server can stream it without a disk shared with the worker"""
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)  # From 0, in file order
+    data = db.Column(db.LargeBinary, nullable=False)  # Up to app.jobs.JOB_RESULT_CHUNK_SIZE bytes
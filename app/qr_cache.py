@@ -0,0 +1,113 @@
+"""Per-process cache of scanned QR code -> student for the scan path.
+
+Scanning resolves a student from the scanned code on every scan at the door.
+The cache keeps the most recently scanned students in an LRU of QR_CACHE_SIZE
+entries so repeat scans skip the user lookup. Printed ``student:`` codes are
+cached by qr_code_id; signed codes (see app/qr_signing.py) by student id along
+with the current qr_version, so a genuine code resolves with no query at all.
+Entries are dropped when a student is added, changed (including a rotated QR
+code) or deleted through the ORM in this process; other gunicorn workers pick
+such changes up after at most QR_CACHE_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app import db
+from app.models import User
+from app.qr_signing import LEGACY_QR_PREFIX, verify_student_code
+
+class QRCodeCache:
+    def __init__(self):
+        # qr_code_id or ('student', id) -> (student_id, display name, username, qr_version, expires at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[4] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        row = load().first()
+        if row is None:
+            # Unknown codes are not cached so a newly added student resolves immediately
+            return None
+
+        entry = (
+            row.id, f"{row.first_name} {row.last_name}", row.username, row.qr_version,
+            now + current_app.config['QR_CACHE_TTL']
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > current_app.config['QR_CACHE_SIZE']:
+                self._entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _students():
+        return db.session.query(
+            User.id, User.first_name, User.last_name, User.username, User.qr_version
+        ).filter(User.role == 'student')
+
+    def lookup(self, qr_code_id):
+        """(student_id, display name, username) for a printed code's qr_code_id, or None if no student has it"""
+        entry = self._get(qr_code_id, lambda: self._students().filter(User.qr_code_id == qr_code_id))
+        return entry[:3] if entry else None
+
+    def lookup_signed(self, student_id, qr_version):
+        """(student_id, display name, username) for a verified signed code, or None if its version was revoked"""
+        entry = self._get(('student', student_id), lambda: self._students().filter(User.id == student_id))
+        if entry is None or entry[3] != qr_version:
+            return None
+        return entry[:3]
+
+    def resolve(self, qr_data):
+        """(student_id, display name, username) for scanned text in either code format, or None"""
+        if qr_data.startswith(LEGACY_QR_PREFIX):
+            return self.lookup(qr_data[len(LEGACY_QR_PREFIX):])
+        signed = verify_student_code(qr_data)
+        if signed is None:
+            return None
+        return self.lookup_signed(*signed)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'size': len(self._entries),
+                'max_size': current_app.config['QR_CACHE_SIZE'],
+            }
+
+qr_cache = QRCodeCache()
+
+@db.event.listens_for(User, 'after_insert')
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def invalidate_user_qr_code(mapper, connection, target):
+    """Drop cached entries for a user's current and previous QR code ids"""
+    history = db.inspect(target).attrs.qr_code_id.history
+    for qr_code_id in {target.qr_code_id, *history.deleted}:
+        if qr_code_id:
+            qr_cache.invalidate(qr_code_id)
+    qr_cache.invalidate(('student', target.id))
@@ -0,0 +1,60 @@
+"""Printable QR code PDFs.
+
+The QR image is handed to reportlab in memory (no temp files) and the finished
+PDF bytes are kept in a per-process LRU keyed by layout, layout version, the
+QR payload and the text printed on the page. A rotated code or a renamed
+student produces a new key, so stale PDFs are never served; they simply age
+out of the cache. Bump PDF_LAYOUT_VERSION when a layout changes.
+"""
+from functools import lru_cache
+from io import BytesIO
+import qrcode
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+PDF_LAYOUT_VERSION = 1
+PDF_CACHE_SIZE = 256
+
+def qr_image_reader(qr_data):
+    """The QR code for qr_data as an in-memory reportlab image"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    return ImageReader(qr.make_image(fill_color="black", back_color="white").get_image())
+
+@lru_cache(maxsize=PDF_CACHE_SIZE)
+def _render_pdf(layout, layout_version, qr_data, username, full_name):
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=letter)
+    if layout == 'student':
+        # Student's own download: large code
+        p.drawString(100, 750, f"Attendance QR Code for {username}")
+        p.drawString(100, 730, "Print this page and bring it to class for attendance.")
+        p.drawImage(qr_image_reader(qr_data), 100, 400, width=400, height=400)
+    else:
+        # Teacher's print: small code with the student's name underneath
+        p.drawString(100, 750, f"Attendance QR Code for {username}")
+        p.drawString(100, 730, f"Name: {full_name}")
+        p.drawString(100, 710, "Print this page and bring it to class for attendance.")
+        p.drawImage(qr_image_reader(qr_data), 100, 400, width=125, height=125)
+        p.setFont("Helvetica-Bold", 12)
+        p.drawString(100, 380, full_name)
+    p.save()
+    return buffer.getvalue()
+
+def student_qr_pdf(student, layout='student'):
+    """PDF bytes of a student's QR code page ('student' download or teacher 'print' layout)"""
+    return _render_pdf(
+        layout,
+        PDF_LAYOUT_VERSION,
+        student.generate_qr_code_data(),
+        student.username,
+        f"{student.first_name} {student.last_name}"
+    )
+
+def qr_pdf_cache_info():
+    return _render_pdf.cache_info()
+
+def clear_qr_pdf_cache():
+    _render_pdf.cache_clear()
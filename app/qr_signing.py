@@ -0,0 +1,42 @@
+"""Signed, self-verifying student QR codes.
+
+A signed code reads ``sq1:<student id>.<qr version>.<signature>``. The
+signature is a truncated HMAC-SHA256 of the rest of the code, keyed with
+SECRET_KEY, so a scanner can tell a genuine code from a forged or mistyped one
+and learn the student id without touching the database. A student's code is
+rotated or revoked by bumping User.qr_version: codes carrying an older version
+stop resolving. Printed ``student:<qr_code_id>`` codes keep working alongside.
+"""
+import base64
+import hashlib
+import hmac
+from flask import current_app
+
+SIGNED_QR_PREFIX = 'sq1:'
+LEGACY_QR_PREFIX = 'student:'
+# 16 bytes of the HMAC keep the code short enough for a low-density QR
+SIGNATURE_BYTES = 16
+
+def _signature(body):
+    digest = hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).rstrip(b'=').decode('ascii')
+
+def sign_student_code(student_id, qr_version):
+    body = f'{SIGNED_QR_PREFIX}{student_id}.{qr_version}'
+    return f'{body}.{_signature(body)}'
+
+def verify_student_code(qr_data):
+    """(student_id, qr_version) for a genuine signed code, or None"""
+    if not qr_data.startswith(SIGNED_QR_PREFIX):
+        return None
+    body, _, signature = qr_data.rpartition('.')
+    if not hmac.compare_digest(signature.encode('ascii', 'replace'), _signature(body).encode('ascii')):
+        return None
+    student_id, _, qr_version = body[len(SIGNED_QR_PREFIX):].partition('.')
+    if not (student_id.isdigit() and qr_version.isdigit()):
+        return None
+    return int(student_id), int(qr_version)
+
+def is_student_code(qr_data):
+    """Whether scanned text is a student code in either format (signature not checked)"""
+    return isinstance(qr_data, str) and qr_data.startswith((SIGNED_QR_PREFIX, LEGACY_QR_PREFIX))
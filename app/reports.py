@@ -0,0 +1,227 @@
+"""Attendance reports over a date range, aggregated in SQL.
+
+Records are bucketed by the day, week (starting Monday) or month they were
+marked (created_at, like the daily report; stored as naive Pacific time) and
+grouped by student, class, belt or the teacher who marked them. The database
+returns one row per (period, group) with the counts, so the cost of a report
+depends on the number of groups, not on the number of attendance records.
+The created_at range is read from ix_attendance_created_at_report, which
+covers every column the aggregates use, so the table itself is not visited.
+Belt is the student's current belt, as shown on the dashboard.
+
+The CSV export lists the records themselves. It is written while the rows
+are read: the query runs with yield_per, so the driver hands over
+EXPORT_BATCH_SIZE rows at a time (a server-side cursor where the database
+has one) and each batch is sent to the client before the next is fetched.
+"""
+import csv
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from io import StringIO
+from app import db
+from app.models import User, Attendance, Class, StudentSummary
+
+REPORT_PERIODS = ('day', 'week', 'month')
+REPORT_GROUPS = ('student', 'class', 'belt', 'teacher')
+ATTENDANCE_STATUSES = ('present', 'late', 'absent')
+EXPORT_BATCH_SIZE = 1000
+EXPORT_HEADER = ('id', 'date', 'marked_at', 'status', 'free_class', 'student_id', 'student',
+                 'class', 'marked_by', 'check_in_time', 'check_in_method', 'notes')
+# Shown for records whose group is missing (deleted teacher, no class, no belt)
+MISSING_GROUP_LABELS = {'student': 'Unknown', 'class': 'No class', 'belt': 'No Belt', 'teacher': 'Unknown'}
+
+ReportGroup = namedtuple('ReportGroup', ['key', 'label'])
+
+def period_start(period):
+    """SQL expression for the first day of the period each record falls in"""
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite stores DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff', so day and month are prefixes of it
+        if period == 'day':
+            return db.func.substr(Attendance.created_at, 1, 10)
+        if period == 'week':
+            # 'weekday 0' moves forward to Sunday (or stays on it); six days back is that week's Monday
+            return db.func.date(Attendance.created_at, 'weekday 0', '-6 days')
+        return db.func.substr(Attendance.created_at, 1, 7).concat('-01')
+    return db.cast(db.func.date_trunc(period, Attendance.created_at), db.Date)
+
+def _as_date(value):
+    # SQLite returns the period as text, Postgres as a date
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+def _report_group(query, group_by):
+    """Join what group_by needs onto query; returns (query, ReportGroup of key and label expressions)"""
+    if group_by == 'student':
+        student = db.aliased(User)
+        query = query.join(student, student.id == Attendance.student_id)
+        return query, ReportGroup(Attendance.student_id, student.first_name + ' ' + student.last_name)
+    if group_by == 'teacher':
+        # Records by deleted teachers still count, as 'Unknown'
+        teacher = db.aliased(User)
+        query = query.outerjoin(teacher, teacher.id == Attendance.created_by)
+        return query, ReportGroup(Attendance.created_by, teacher.first_name + ' ' + teacher.last_name)
+    if group_by == 'class':
+        query = query.outerjoin(Class, Class.id == Attendance.class_id)
+        return query, ReportGroup(Attendance.class_id, Class.name)
+    student = db.aliased(User)
+    query = query.join(
+        student, student.id == Attendance.student_id
+    ).outerjoin(
+        StudentSummary, StudentSummary.student_id == Attendance.student_id
+    )
+    belt = db.func.coalesce(StudentSummary.latest_belt_level, student.belt_level)
+    return query, ReportGroup(belt, belt)
+
+def _counts():
+    return (
+        db.func.count(Attendance.id).label('records'),
+        db.func.count(Attendance.id).filter(Attendance.status == 'present').label('present'),
+        db.func.count(Attendance.id).filter(Attendance.status == 'late').label('late'),
+        db.func.count(Attendance.id).filter(Attendance.status == 'absent').label('absent'),
+        db.func.count(Attendance.id).filter(Attendance.free_class == True).label('free_classes'),
+        db.func.count(db.distinct(Attendance.student_id)).label('students')
+    )
+
+def _count_fields(row):
+    return {
+        'records': row.records,
+        'present': row.present,
+        'late': row.late,
+        'absent': row.absent,
+        'free_classes': row.free_classes,
+        'students': row.students
+    }
+
+def _in_range(start, end):
+    # Whole days from start to end, on created_at like the reports
+    return (
+        Attendance.created_at >= datetime.combine(start, datetime.min.time()),
+        Attendance.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time())
+    )
+
+def attendance_range_report(start, end, period='month', group_by='student'):
+    """Counts per (period, group) for records marked from start to end inclusive, plus overall totals
+
+    Two aggregate queries: the grouped counts, and the distinct students
+    overall (the other totals are summed from the groups). Rows are ordered by
+    period, then group label.
+    """
+    if period not in REPORT_PERIODS:
+        raise ValueError(f'Unknown period: {period}')
+    if group_by not in REPORT_GROUPS:
+        raise ValueError(f'Unknown grouping: {group_by}')
+
+    in_range = _in_range(start, end)
+    bucket = period_start(period).label('period')
+    query, group = _report_group(db.session.query(Attendance), group_by)
+    rows = query.with_entities(
+        bucket,
+        group.key.label('group_key'),
+        group.label.label('group_label'),
+        *_counts()
+    ).filter(*in_range).group_by(bucket, group.key, group.label).all()
+
+    report_rows = []
+    for row in rows:
+        report_rows.append(dict(
+            period=_as_date(row.period).strftime('%Y-%m-%d'),
+            group_id=row.group_key,
+            group=row.group_label or MISSING_GROUP_LABELS[group_by],
+            **_count_fields(row)
+        ))
+    report_rows.sort(key=lambda row: (row['period'], row['group'].lower(), str(row['group_id'])))
+
+    totals = {
+        key: sum(row[key] for row in report_rows)
+        for key in ('records', 'present', 'late', 'absent', 'free_classes')
+    }
+    totals['students'] = db.session.query(db.func.count(db.distinct(Attendance.student_id))).filter(*in_range).scalar()
+    return {
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'period': period,
+        'group_by': group_by,
+        'rows': report_rows,
+        'totals': totals
+    }
+
+def attendance_export_query(start, end, student_id=None, class_id=None, teacher_id=None, status=None):
+    """Select of the export columns for records marked from start to end inclusive, oldest first"""
+    student = db.aliased(User)
+    teacher = db.aliased(User)
+    query = db.select(
+        Attendance.id,
+        Attendance.date,
+        Attendance.created_at,
+        Attendance.status,
+        Attendance.free_class,
+        Attendance.student_id,
+        (student.first_name + ' ' + student.last_name).label('student'),
+        Class.name.label('class_name'),
+        (teacher.first_name + ' ' + teacher.last_name).label('teacher'),
+        Attendance.check_in_time,
+        Attendance.check_in_method,
+        Attendance.notes
+    ).join(
+        student, student.id == Attendance.student_id
+    ).outerjoin(
+        Class, Class.id == Attendance.class_id
+    ).outerjoin(
+        teacher, teacher.id == Attendance.created_by
+    ).where(*_in_range(start, end))
+    if student_id is not None:
+        query = query.where(Attendance.student_id == student_id)
+    if class_id is not None:
+        query = query.where(Attendance.class_id == class_id)
+    if teacher_id is not None:
+        query = query.where(Attendance.created_by == teacher_id)
+    if status is not None:
+        query = query.where(Attendance.status == status)
+    return query.order_by(Attendance.created_at, Attendance.id)
+
+def _csv_row(row):
+    return (
+        row.id,
+        row.date.strftime('%Y-%m-%d'),
+        row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else '',
+        row.status,
+        'yes' if row.free_class else 'no',
+        row.student_id,
+        row.student,
+        row.class_name or '',
+        row.teacher or 'Unknown',
+        row.check_in_time.strftime('%H:%M:%S') if row.check_in_time else '',
+        row.check_in_method or '',
+        row.notes or ''
+    )
+
+def _drain(buffer):
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
+
+def attendance_csv(start, end, **filters):
+    """Yield a CSV of the records attendance_export_query selects: the header, then one chunk per batch
+
+    Only one batch of rows is held at a time, however long the range. Needs an
+    app context for the whole iteration (wrap in stream_with_context when
+    returned from a view).
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    # Sent before the query runs, so the download starts straight away
+    yield _drain(buffer)
+    result = db.session.execute(
+        attendance_export_query(start, end, **filters).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    try:
+        for rows in result.partitions():
+            writer.writerows(_csv_row(row) for row in rows)
+            yield _drain(buffer)
+    finally:
+        result.close()
@@ -1,22 +1,33 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, jsonify, current_app, abort
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, send_file, jsonify, current_app, abort,
+                   Response, stream_with_context)
 from flask_login import login_user, logout_user, login_required, current_user
 from app import db
-from app.models import User, Attendance, BeltHistory, Class, AttendanceAudit
+from app.models import User, Attendance, BeltHistory, Class, AttendanceAudit, StudentSummary, Plan, ImageBlob, ImageVariant, Job, BELT_LEVELS
+from app.images import (process_uploaded_picture, store_picture_variants, release_image,
+                        picture_variant_hashes, variant_name, PICTURE_SIZES, PICTURE_FORMATS)
+from app.summary import refresh_student_summary, refresh_student_summaries, adjust_plan_usage, uses_plan_class, recount_plan_usage
+from app.qr_cache import qr_cache
+from app.qr_signing import is_student_code
+from app.qr_pdf import student_qr_pdf
+from app.badges import badge_students, write_badge_sheet
+from app.reports import attendance_range_report, attendance_csv, REPORT_PERIODS, REPORT_GROUPS, ATTENDANCE_STATUSES
+from app.scan_dedupe import scan_dedupe
+from app.attendance import insert_attendance, insert_attendance_bulk
+from app.jobs import submit_job, job_json, job_result_chunks
 from app.forms import RegistrationForm, AddStudentForm, ClassForm
 from datetime import datetime, time, timedelta
 import pytz
 from io import BytesIO
-import qrcode
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import tempfile
 import os
-from PIL import Image
 from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
 from collections import OrderedDict
 import calendar
 from datetime import date
 import logging
+import base64
+import json
+import tempfile
 
 main = Blueprint('main', __name__)
 auth = Blueprint('auth', __name__)
@@ -36,6 +47,32 @@ def get_pacific_datetime():
     """Get current datetime in Pacific timezone (naive)"""
     return get_pacific_now().replace(tzinfo=None)
 
+def student_roster_query():
+    """Query yielding each student with their StudentSummary fields and thumbnail hashes in one round trip"""
+    thumb_jpeg = db.aliased(ImageVariant)
+    thumb_webp = db.aliased(ImageVariant)
+    return db.session.query(
+        User,
+        StudentSummary.last_attended_at.label('last_attended'),
+        db.func.coalesce(StudentSummary.latest_belt_level, User.belt_level).label('latest_belt_level'),
+        StudentSummary.month_start.label('month_start'),
+        StudentSummary.month_attendance_count.label('month_attendance_count'),
+        StudentSummary.plan_attended_count.label('plan_attended_count'),
+        # Pictures without derivatives fall back to the primary image
+        db.func.coalesce(thumb_jpeg.sha256, User.profile_picture_hash).label('thumbnail_hash'),
+        thumb_webp.sha256.label('thumbnail_webp_hash')
+    ).outerjoin(
+        StudentSummary, StudentSummary.student_id == User.id
+    ).outerjoin(
+        thumb_jpeg, db.and_(thumb_jpeg.source_sha256 == User.profile_picture_hash, thumb_jpeg.name == 'thumb.jpeg')
+    ).outerjoin(
+        thumb_webp, db.and_(thumb_webp.source_sha256 == User.profile_picture_hash, thumb_webp.name == 'thumb.webp')
+    ).filter(
+        User.role == 'student'
+    ).order_by(
+        StudentSummary.last_attended_at.desc().nullslast()
+    )
+
 @main.route('/')
 @main.route('/index')
 @login_required
@@ -51,39 +88,151 @@ def teacher_home():
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
     
-    # Get students with their last attended information
-    students_with_last_attended = db.session.query(
-        User,
-        db.func.max(Attendance.created_at).label('last_attended')
-    ).outerjoin(
-        Attendance, User.id == Attendance.student_id
-    ).filter(
-        User.role == 'student'
-    ).group_by(
-        User.id
-    ).order_by(
-        db.func.max(Attendance.created_at).desc().nullslast()
-    ).all()
-    
-    # Extract students and their last attended info
-    students = []
-    for student, last_attended in students_with_last_attended:
-        if last_attended:
-            # Convert UTC datetime to Pacific timezone
-            pacific_time = last_attended.replace(tzinfo=pytz.UTC).astimezone(PACIFIC_TZ)
-            student.last_attended = pacific_time
-        else:
-            student.last_attended = last_attended
-        
-        # Get the latest belt from belt history
-        from app.models import BeltHistory
-        latest_belt = BeltHistory.query.filter_by(student_id=student.id).order_by(BeltHistory.date_obtained.desc()).first()
-        student.latest_belt_level = latest_belt.belt_level if latest_belt else student.belt_level
-        
-        students.append(student)
-    
+    # The roster itself is loaded page by page from main.teacher_roster
     today = get_pacific_date().strftime('%Y-%m-%d')
-    return render_template('teacher/dashboard.html', students=students, today=today)
+    return render_template('teacher/dashboard.html', today=today)
+
+ROSTER_PAGE_SIZE = 50
+ROSTER_MAX_PAGE_SIZE = 200
+# Sorts never-attended students after everyone else when ordering by last attended
+NEVER_ATTENDED = datetime(1900, 1, 1)
+
+def encode_cursor(sort_value, row_id):
+    """Opaque keyset cursor for the row a page ended on (used by the roster and attendance history)"""
+    payload = json.dumps([sort_value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_cursor(cursor):
+    sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return sort_value, int(row_id)
+
+@main.route('/teacher/roster')
+@login_required
+def teacher_roster():
+    """Keyset-paginated student roster for the teacher dashboard"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+
+    sort = request.args.get('sort', 'last_attended')
+    order = request.args.get('order', 'desc' if sort == 'last_attended' else 'asc')
+    search = request.args.get('q', '').strip().lower()
+    belt_filter = request.args.get('belt', '')
+    last_attended_filter = request.args.get('last_attended', '')
+    cursor = request.args.get('cursor')
+    try:
+        limit = min(int(request.args.get('limit', ROSTER_PAGE_SIZE)), ROSTER_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    if sort not in ('name', 'belt', 'last_attended') or order not in ('asc', 'desc') or limit < 1:
+        return jsonify({'success': False, 'message': 'Invalid sort parameters'}), 400
+
+    roster = student_roster_query().order_by(None).subquery()
+    full_name = db.func.lower(roster.c.first_name + ' ' + roster.c.last_name)
+
+    if sort == 'name':
+        sort_key = full_name
+    elif sort == 'belt':
+        sort_key = db.case(
+            {level: rank for rank, level in enumerate(BELT_LEVELS)},
+            value=roster.c.latest_belt_level,
+            else_=-1
+        )
+    else:
+        sort_key = db.func.coalesce(
+            roster.c.last_attended,
+            db.literal(NEVER_ATTENDED, db.DateTime)
+        )
+
+    query = db.session.query(
+        roster.c.id,
+        roster.c.first_name,
+        roster.c.last_name,
+        roster.c.latest_belt_level,
+        roster.c.last_attended,
+        roster.c.month_start,
+        roster.c.month_attendance_count,
+        roster.c.plan_attended_count,
+        roster.c.thumbnail_hash,
+        roster.c.thumbnail_webp_hash,
+        sort_key.label('sort_key')
+    )
+
+    # Prefix search on first name, last name or full name
+    if search:
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(db.or_(
+            db.func.lower(roster.c.first_name).like(pattern, escape='\\'),
+            db.func.lower(roster.c.last_name).like(pattern, escape='\\'),
+            full_name.like(pattern, escape='\\')
+        ))
+    if belt_filter:
+        query = query.filter(roster.c.latest_belt_level == belt_filter)
+    if last_attended_filter == 'never':
+        query = query.filter(roster.c.last_attended.is_(None))
+    elif last_attended_filter:
+        try:
+            days = int(last_attended_filter)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid last attended filter'}), 400
+        query = query.filter(roster.c.last_attended >= get_pacific_datetime() - timedelta(days=days))
+
+    if cursor:
+        try:
+            after_value, after_id = decode_cursor(cursor)
+            if sort == 'last_attended':
+                after_value = datetime.fromisoformat(after_value)
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        if order == 'asc':
+            query = query.filter(db.or_(
+                sort_key > after_value,
+                db.and_(sort_key == after_value, roster.c.id > after_id)
+            ))
+        else:
+            query = query.filter(db.or_(
+                sort_key < after_value,
+                db.and_(sort_key == after_value, roster.c.id < after_id)
+            ))
+
+    if order == 'asc':
+        query = query.order_by(sort_key.asc(), roster.c.id.asc())
+    else:
+        query = query.order_by(sort_key.desc(), roster.c.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    month_start = get_pacific_date().replace(day=1)
+    students = []
+    for row in rows:
+        last_attended = None
+        if row.last_attended:
+            # Same conversion the dashboard has always applied
+            last_attended = row.last_attended.replace(tzinfo=pytz.UTC).astimezone(PACIFIC_TZ).isoformat()
+        students.append({
+            'id': row.id,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'belt_level': row.latest_belt_level,
+            'last_attended': last_attended,
+            # A summary last refreshed in an earlier month has no classes this month yet
+            'classes_this_month': row.month_attendance_count if row.month_start == month_start else 0,
+            'plan_attended': row.plan_attended_count or 0,
+            'thumbnail_url': url_for('main.get_image', sha256=row.thumbnail_hash) if row.thumbnail_hash else None,
+            'thumbnail_webp_url': url_for('main.get_image', sha256=row.thumbnail_webp_hash) if row.thumbnail_webp_hash else None,
+            'calendar_url': url_for('main.student_calendar', student_id=row.id)
+        })
+
+    next_cursor = None
+    if has_more:
+        last_row = rows[-1]
+        sort_value = last_row.sort_key
+        if isinstance(sort_value, datetime):
+            sort_value = sort_value.isoformat()
+        next_cursor = encode_cursor(sort_value, last_row.id)
+
+    return jsonify({'success': True, 'students': students, 'next_cursor': next_cursor})
 
 @main.route('/student/home')
 @login_required
@@ -94,6 +243,16 @@ def student_home():
     attendances = current_user.student_attendances.all()
     return render_template('student/dashboard.html', attendances=attendances)
 
+def scan_repeat_response(repeat):
+    """JSON answer for a scan suppressed by the dedupe window"""
+    if repeat['status'] == 'not_found':
+        return jsonify({'success': False, 'message': 'Student not found', 'suppressed': True}), 404
+    return jsonify({
+        'success': False,
+        'message': f"Attendance already marked for {repeat['student_name']} today",
+        'suppressed': True
+    }), 400
+
 @main.route('/mark_attendance', methods=['POST'])
 @login_required
 def mark_attendance():
@@ -109,56 +268,38 @@ def mark_attendance():
         try:
             # Parse the QR code data
             qr_data = data['qr_data']
-            if not qr_data.startswith('student:'):
+            if not is_student_code(qr_data):
                 return jsonify({'success': False, 'message': 'Invalid QR code format'}), 400
-                
-            qr_code_id = qr_data.split(':')[1]
             
-            # Get the student using qr_code_id
-            student = User.query.filter_by(qr_code_id=qr_code_id, role='student').first()
+            # Repeat decodes of the same code are answered from memory
+            today = get_pacific_date()
+            repeat = scan_dedupe.check(qr_data, today)
+            if repeat is not None:
+                return scan_repeat_response(repeat)
+                
+            # Resolve the student from the per-process QR cache (signed codes are verified first)
+            student = qr_cache.resolve(qr_data)
             if not student:
+                scan_dedupe.remember(qr_data, today, {'status': 'not_found'})
                 return jsonify({'success': False, 'message': 'Student not found'}), 404
+            student_id, student_name, _ = student
             
-            # Check if attendance already marked for today
-            today = get_pacific_date()
-            existing_attendance = Attendance.query.filter_by(
-                student_id=student.id,
-                date=today
-            ).first()
-            
-            if existing_attendance:
+            # Create today's attendance unless it is already marked (one round trip, race-free)
+            if insert_attendance(student_id, today, current_user.id) is None:
+                db.session.rollback()
+                scan_dedupe.remember(qr_data, today, {'status': 'already_marked', 'student_name': student_name})
                 return jsonify({
                     'success': False,
-                    'message': f'Attendance already marked for {student.first_name} {student.last_name} today'
+                    'message': f'Attendance already marked for {student_name} today'
                 }), 400
             
-            # Create attendance record with explicit Pacific timezone
-            pacific_now = get_pacific_now()
-            attendance = Attendance(
-                student_id=student.id,
-                date=today,
-                status='present',
-                created_by=current_user.id,
-                created_at=pacific_now.replace(tzinfo=None)  # Store as naive datetime in Pacific time
-            )
-            db.session.add(attendance)
-            db.session.flush()  # Get the attendance ID
-            
-            # Create audit entry for creation
-            audit_entry = AttendanceAudit(
-                attendance_id=attendance.id,
-                action='created',
-                field_name=None,
-                old_value=None,
-                new_value=None,
-                changed_by=current_user.id
-            )
-            db.session.add(audit_entry)
+            refresh_student_summary(student_id)
             db.session.commit()
+            scan_dedupe.remember(qr_data, today, {'status': 'already_marked', 'student_name': student_name})
             
             return jsonify({
                 'success': True,
-                'student_name': f"{student.first_name} {student.last_name}"
+                'student_name': student_name
             })
         except Exception as e:
             db.session.rollback()
@@ -187,30 +328,13 @@ def mark_attendance():
                 
                 attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
                 
-                # Create new attendance record with explicit Pacific timezone
-                pacific_now = get_pacific_now()
-                attendance = Attendance(
-                    student_id=student.id,
-                    date=attendance_date,
-                    status=status,
-                    notes=notes,
-                    created_by=current_user.id,
-                    created_at=pacific_now.replace(tzinfo=None)  # Store as naive datetime in Pacific time
-                )
-                db.session.add(attendance)
-                db.session.flush()  # Get the attendance ID
-                
-                # Create audit entry for creation
-                audit_entry = AttendanceAudit(
-                    attendance_id=attendance.id,
-                    action='created',
-                    field_name=None,
-                    old_value=None,
-                    new_value=None,
-                    changed_by=current_user.id
-                )
-                db.session.add(audit_entry)
+                if insert_attendance(student.id, attendance_date, current_user.id, status=status, notes=notes) is None:
+                    db.session.rollback()
+                    flash(f'{student.first_name} {student.last_name} already has attendance marked for {date_str}. '
+                          'Edit the existing record from their calendar instead.', 'warning')
+                    return redirect(url_for('main.teacher_home'))
                 
+                refresh_student_summary(student.id)
                 db.session.commit()
                 flash(f'Attendance marked for {student.first_name} {student.last_name}!', 'success')
                 return redirect(url_for('main.teacher_home'))
@@ -224,39 +348,29 @@ def mark_attendance():
                 
                 attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
                 
-                # Process each student's attendance
-                for student in User.query.filter_by(role='student').all():
-                    status_key = f'status_{student.id}'
-                    notes_key = f'notes_{student.id}'
-                    
-                    if status_key in request.form:
-                        status = request.form[status_key]
-                        notes = request.form.get(notes_key, '')
-                        
-                        # Create new attendance record with explicit Pacific timezone
-                        pacific_now = get_pacific_now()
-                        attendance = Attendance(
-                            student_id=student.id,
-                            date=attendance_date,
-                            status=status,
-                            notes=notes,
-                            created_by=current_user.id,
-                            created_at=pacific_now.replace(tzinfo=None)  # Store as naive datetime in Pacific time
-                        )
-                        db.session.add(attendance)
-                        db.session.flush()  # Get the attendance ID
-                        
-                        # Create audit entry for creation
-                        audit_entry = AttendanceAudit(
-                            attendance_id=attendance.id,
-                            action='created',
-                            field_name=None,
-                            old_value=None,
-                            new_value=None,
-                            changed_by=current_user.id
-                        )
-                        db.session.add(audit_entry)
+                # Only the submitted status_<id> keys matter; validate those ids in one query
+                submitted = {}
+                for key, status in request.form.items():
+                    if key.startswith('status_') and key[len('status_'):].isdigit():
+                        submitted[int(key[len('status_'):])] = status
+                student_ids = [row.id for row in db.session.query(User.id).filter(
+                    User.id.in_(list(submitted)),
+                    User.role == 'student'
+                ).all()] if submitted else []
                 
+                # Students already marked for the day are skipped
+                created = insert_attendance_bulk([
+                    {
+                        'student_id': student_id,
+                        'date': attendance_date,
+                        'status': submitted[student_id],
+                        'notes': request.form.get(f'notes_{student_id}', '')
+                    }
+                    for student_id in student_ids
+                ], current_user.id)
+                marked_student_ids = [attendance.student_id for attendance in created]
+                
+                refresh_student_summaries(marked_student_ids)
                 db.session.commit()
                 flash('Attendance marked successfully!', 'success')
                 return redirect(url_for('main.teacher_home'))
@@ -276,16 +390,16 @@ def scan_qr():
     
     if request.method == 'POST':
         qr_data = request.form.get('qr_data')
-        if not qr_data or not qr_data.startswith('student:'):
+        if not is_student_code(qr_data):
             flash('Invalid QR code.', 'danger')
             return redirect(url_for('main.scan_qr'))
         
-        student_id = qr_data.split(':')[1]
-        student = User.query.filter_by(qr_code_id=student_id, role='student').first()
+        student = qr_cache.resolve(qr_data)
         
         if not student:
             flash('Student not found.', 'danger')
             return redirect(url_for('main.scan_qr'))
+        student_id, _, username = student
         
         # Check if within valid time window (9 AM to 9 PM Pacific)
         pacific = pytz.timezone('US/Pacific')
@@ -294,36 +408,139 @@ def scan_qr():
             flash('Attendance can only be marked between 9 AM and 9 PM Pacific time.', 'danger')
             return redirect(url_for('main.scan_qr'))
         
-        # Create new attendance record with explicit Pacific timezone
+        # Create today's attendance unless it is already marked
         today = datetime.now(pacific).date()
-        pacific_now = get_pacific_now()
-        attendance = Attendance(
-            student_id=student.id,
-            date=today,
-            status='present',
-            created_by=current_user.id,
-            created_at=pacific_now.replace(tzinfo=None)  # Store as naive datetime in Pacific time
-        )
-        db.session.add(attendance)
-        db.session.flush()  # Get the attendance ID
+        if insert_attendance(student_id, today, current_user.id) is None:
+            db.session.rollback()
+            flash(f'Attendance already marked for {username} today.', 'info')
+            return redirect(url_for('main.scan_qr'))
         
-        # Create audit entry for creation
-        audit_entry = AttendanceAudit(
-            attendance_id=attendance.id,
-            action='created',
-            field_name=None,
-            old_value=None,
-            new_value=None,
-            changed_by=current_user.id
-        )
-        db.session.add(audit_entry)
+        refresh_student_summary(student_id)
         db.session.commit()
         
-        flash(f'Attendance marked for {student.username}.', 'success')
+        flash(f'Attendance marked for {username}.', 'success')
         return redirect(url_for('main.scan_qr'))
     
     return render_template('main/scan_qr.html')
 
+ATTENDANCE_BATCH_MAX_ITEMS = 200
+# Device clocks may run a little fast; scans further in the future are rejected
+SCAN_CLOCK_SKEW = timedelta(minutes=5)
+SCAN_MAX_AGE = timedelta(days=7)
+
+def parse_scan_time(value):
+    """Device timestamp (ISO 8601) as a naive Pacific datetime; naive input is taken as Pacific"""
+    scanned_at = datetime.fromisoformat(value)
+    if scanned_at.tzinfo is not None:
+        scanned_at = scanned_at.astimezone(PACIFIC_TZ).replace(tzinfo=None)
+    return scanned_at
+
+@main.route('/attendance/batch', methods=['POST'])
+@login_required
+def attendance_batch():
+    """Record a batch of queued scanner hits in one transaction
+
+    Each scan carries a client-generated UUID and the device time it was
+    scanned at. Results are returned per scan in request order; resending a
+    scan that was already recorded returns its original result instead of
+    marking again.
+    """
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Only teachers can mark attendance'}), 403
+    
+    data = request.get_json(silent=True)
+    scans = data.get('scans') if isinstance(data, dict) else None
+    if not isinstance(scans, list):
+        return jsonify({'success': False, 'message': 'Expected a list of scans'}), 400
+    if len(scans) > ATTENDANCE_BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'At most {ATTENDANCE_BATCH_MAX_ITEMS} scans per batch'}), 400
+    
+    pacific_now = get_pacific_now().replace(tzinfo=None)
+    results = []
+    by_client_id = {}
+    pending = {}  # client_id -> attendance row to insert
+    for scan in scans:
+        client_id = scan.get('client_id') if isinstance(scan, dict) else None
+        if not isinstance(client_id, str) or not client_id or len(client_id) > 36:
+            results.append({'client_id': None, 'status': 'invalid', 'message': 'Missing client id'})
+            continue
+        if client_id in by_client_id:
+            # Same scan twice in one batch shares its result
+            results.append(by_client_id[client_id])
+            continue
+        result = by_client_id[client_id] = {'client_id': client_id}
+        results.append(result)
+        try:
+            scanned_at = parse_scan_time(scan.get('scanned_at'))
+        except (TypeError, ValueError):
+            result.update(status='invalid', message='Invalid scan time')
+            continue
+        if scanned_at > pacific_now + SCAN_CLOCK_SKEW or scanned_at < pacific_now - SCAN_MAX_AGE:
+            result.update(status='invalid', message='Scan time is out of range')
+            continue
+        qr_data = scan.get('qr_data')
+        if not is_student_code(qr_data):
+            result.update(status='invalid', message='Invalid QR code format')
+            continue
+        repeat = scan_dedupe.check(qr_data, scanned_at.date(), client_id)
+        if repeat is not None:
+            result.update(status=repeat['status'], suppressed=True, message=(
+                'Student not found' if repeat['status'] == 'not_found' else 'Attendance already marked for that day'
+            ))
+            if 'student_name' in repeat:
+                result['student_name'] = repeat['student_name']
+            continue
+        student = qr_cache.resolve(qr_data)
+        if not student:
+            result.update(status='not_found', message='Student not found')
+            scan_dedupe.remember(qr_data, scanned_at.date(), {'status': 'not_found', 'client_id': client_id})
+            continue
+        student_id, student_name, _ = student
+        result.update(student_id=student_id, student_name=student_name, date=scanned_at.date().isoformat())
+        result['qr_data'] = qr_data
+        pending[client_id] = {
+            'student_id': student_id,
+            'date': scanned_at.date(),
+            'created_at': scanned_at,
+            'check_in_method': 'qr_code',
+            'client_id': client_id
+        }
+    
+    try:
+        created = insert_attendance_bulk(list(pending.values()), current_user.id)
+        for attendance in created:
+            by_client_id[attendance.client_id].update(status='marked', attendance_id=attendance.id)
+        
+        # Scans that were not inserted were either recorded by an earlier upload or hit a marked day
+        leftover = [client_id for client_id in pending if 'status' not in by_client_id[client_id]]
+        if leftover:
+            for attendance_id, client_id in db.session.query(Attendance.id, Attendance.client_id).filter(
+                Attendance.client_id.in_(leftover)
+            ).all():
+                by_client_id[client_id].update(status='marked', attendance_id=attendance_id, replayed=True)
+            for client_id in leftover:
+                if 'status' not in by_client_id[client_id]:
+                    by_client_id[client_id].update(status='already_marked', message='Attendance already marked for that day')
+        
+        refresh_student_summaries(attendance.student_id for attendance in created)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error recording attendance batch: {str(e)}")
+        return jsonify({'success': False, 'message': 'Error processing attendance'}), 500
+    
+    # Further decodes of these codes from this scanner are answered from memory for a while;
+    # the scan that marked the day is remembered last so its resends still replay
+    for client_id in sorted(pending, key=lambda client_id: by_client_id[client_id]['status'] == 'marked'):
+        result = by_client_id[client_id]
+        scan_dedupe.remember(result.pop('qr_data'), pending[client_id]['date'], {
+            'status': 'already_marked',
+            'student_name': result['student_name'],
+            'client_id': client_id
+        })
+    
+    return jsonify({'success': True, 'results': results})
+
 @main.route('/student/qr_code')
 @login_required
 def student_qr_code():
@@ -331,28 +548,8 @@ def student_qr_code():
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
     
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(current_user.generate_qr_code_data())
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Create PDF
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    p.drawString(100, 750, f"Attendance QR Code for {current_user.username}")
-    p.drawString(100, 730, "Print this page and bring it to class for attendance.")
-    
-    # Save QR code to buffer
-    img_buffer = BytesIO()
-    qr_img.save(img_buffer)
-    img_buffer.seek(0)
-    
-    # Add QR code to PDF
-    p.drawImage(img_buffer, 100, 400, width=400, height=400)
-    p.save()
-    
-    buffer.seek(0)
+    # Rendered once per code and layout, then served from the in-process cache
+    buffer = BytesIO(student_qr_pdf(current_user))
     return send_file(
         buffer,
         as_attachment=True,
@@ -378,6 +575,22 @@ def logout():
     logout_user()
     return redirect(url_for('auth.login'))
 
+def add_plan_from_form(user, form):
+    """Give a new student the plan entered on the registration form, if any"""
+    if user.role != 'student' or not (form.program.data or form.plan.data or form.classes.data or form.effective_from.data):
+        return
+    plan = Plan(
+        student=user,
+        program=form.program.data or None,
+        plan=form.plan.data or None,
+        classes=int(form.classes.data) if form.classes.data else None,
+        effective_from=form.effective_from.data,
+        effective_to=form.effective_to.data
+    )
+    plan.set_window()
+    db.session.add(plan)
+    user.effective_to = plan.effective_to
+
 @auth.route('/register', methods=['GET', 'POST'])
 def register():
     from flask import Response
@@ -399,10 +612,12 @@ def register():
             program=form.program.data if form.program.data else None,
             plan=form.plan.data if form.plan.data else None,
             classes=form.classes.data if form.classes.data else None,
+            effective_from=form.effective_from.data,
             phone_number=form.phone_number.data
         )
         user.set_password(form.password.data)
         db.session.add(user)
+        add_plan_from_form(user, form)
         try:
             db.session.commit()
             logger.debug("User registered and committed to DB.")
@@ -434,10 +649,12 @@ def add_student():
             program=form.program.data if form.program.data else None,
             plan=form.plan.data if form.plan.data else None,
             classes=form.classes.data if form.classes.data else None,
+            effective_from=form.effective_from.data,
             phone_number=form.phone_number.data
         )
         user.set_password(form.password.data)
         db.session.add(user)
+        add_plan_from_form(user, form)
         try:
             db.session.commit()
             flash('Student added successfully!', 'success')
@@ -460,55 +677,8 @@ def print_student_qr(student_id):
         return redirect(url_for('main.teacher_home'))
     
     try:
-        # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(student.generate_qr_code_data())
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Create PDF
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=letter)
-        
-        # Add text
-        p.drawString(100, 750, f"Attendance QR Code for {student.username}")
-        p.drawString(100, 730, f"Name: {student.first_name} {student.last_name}")
-        p.drawString(100, 710, "Print this page and bring it to class for attendance.")
-        
-        # Save QR code to a temporary file
-        import tempfile
-        import os
-        import time
-        from PIL import Image
-        
-        # Create a temporary file with a unique name
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, f'qr_{student.id}_{int(time.time())}.png')
-        
-        try:
-            # Convert QR image to PIL Image if it's not already
-            if not isinstance(qr_img, Image.Image):
-                qr_img = qr_img.convert('RGB')
-            qr_img.save(temp_file)
-            
-            # Add QR code to PDF with reduced size (125x125)
-            p.drawImage(temp_file, 100, 400, width=125, height=125)
-            
-            # Add student's name underneath the QR code
-            p.setFont("Helvetica-Bold", 12)
-            p.drawString(100, 380, f"{student.first_name} {student.last_name}")
-            
-            p.save()
-            
-        finally:
-            # Clean up temporary file
-            try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-            except:
-                pass  # Ignore cleanup errors
-        
-        buffer.seek(0)
+        # Rendered once per code and layout, then served from the in-process cache
+        buffer = BytesIO(student_qr_pdf(student, layout='print'))
         return send_file(
             buffer,
             as_attachment=True,
@@ -518,7 +688,72 @@ def print_student_qr(student_id):
     except Exception as e:
         print(f"Error generating QR code: {str(e)}")  # For debugging
         flash('Error generating QR code. Please try again.', 'danger')
-        return redirect(url_for('main.teacher_home')) 
+        return redirect(url_for('main.teacher_home'))
+
+@main.route('/teacher/badges')
+@login_required
+def badge_sheet():
+    """Badge sheet PDF for ?student_ids=1,2,3, ?class_id=N or ?all=1
+
+    The sheet is drawn into a temporary file, which is then streamed. To build it in the
+    background instead, POST {"kind": "badge_sheet"} to /jobs.
+    """
+    if not current_user.is_teacher():
+        flash('Access denied.', 'danger')
+        return redirect(url_for('main.index'))
+
+    if request.args.get('student_ids'):
+        try:
+            student_ids = [int(value) for value in request.args['student_ids'].split(',') if value.strip()]
+        except ValueError:
+            flash('Invalid student selection.', 'danger')
+            return redirect(url_for('main.teacher_home'))
+        params = {'student_ids': student_ids}
+        download_name = 'badges.pdf'
+    elif request.args.get('class_id', type=int):
+        class_id = request.args.get('class_id', type=int)
+        params = {'class_id': class_id}
+        download_name = f'badges_class_{class_id}.pdf'
+    elif request.args.get('all'):
+        params = {}
+        download_name = 'badges_all.pdf'
+    else:
+        flash('Choose students, a class or all students to print badges for.', 'warning')
+        return redirect(url_for('main.teacher_home'))
+
+    students = badge_students(**params)
+
+    if not students:
+        flash('No students to print badges for.', 'warning')
+        return redirect(url_for('main.teacher_home'))
+
+    output = tempfile.TemporaryFile()
+    try:
+        write_badge_sheet(students, output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return send_file(output, mimetype='application/pdf', as_attachment=True, download_name=download_name)
+
+@main.route('/student/<int:student_id>/rotate_qr', methods=['POST'])
+@login_required
+def rotate_student_qr(student_id):
+    """Issue a new QR code for a student; every previously printed code stops working"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    student = User.query.filter_by(id=student_id, role='student').first()
+    if not student:
+        return jsonify({'success': False, 'message': 'Student not found'}), 404
+    
+    try:
+        student.rotate_qr_code()
+        db.session.commit()
+        return jsonify({'success': True, 'qr_version': student.qr_version})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Error rotating QR code'}), 500
 
 @main.route('/student/<int:student_id>/calendar')
 @login_required
@@ -532,9 +767,6 @@ def student_calendar(student_id):
         flash('Student not found.', 'danger')
         return redirect(url_for('main.teacher_home'))
     
-    # Get all attendance records for the student
-    attendances = Attendance.query.filter_by(student_id=student.id).all()
-    
     # --- Attendance Stats for last 12 months ---
     today = get_pacific_date()
     stats = OrderedDict()
@@ -542,49 +774,98 @@ def student_calendar(student_id):
     for i in range(0, 12):
         month = (today.month - i - 1) % 12 + 1
         year = today.year if today.month - i > 0 else today.year - 1
-        label = f"{calendar.month_abbr[month]} {str(year)[2:]}"
-        stats[label] = 0
-    for att in attendances:
-        if att.status == 'present' and att.date:
-            label = f"{calendar.month_abbr[att.date.month]} {str(att.date.year)[2:]}"
-            if label in stats:
-                stats[label] += 1
-    attendance_stats = stats
+        stats[(year, month)] = 0
+    oldest_year, oldest_month = next(reversed(stats))
+    month_year = db.extract('year', Attendance.date)
+    month_number = db.extract('month', Attendance.date)
+    monthly_counts = db.session.query(
+        month_year, month_number, db.func.count(Attendance.id)
+    ).filter(
+        Attendance.student_id == student.id,
+        Attendance.status == 'present',
+        Attendance.date >= date(oldest_year, oldest_month, 1)
+    ).group_by(month_year, month_number).all()
+    for year, month, count in monthly_counts:
+        if (int(year), int(month)) in stats:
+            stats[(int(year), int(month))] = count
+    attendance_stats = OrderedDict(
+        (f"{calendar.month_abbr[month]} {str(year)[2:]}", count) for (year, month), count in stats.items()
+    )
     # ---
     
-    # Format attendance data for FullCalendar
-    attendance_events = []
-    for attendance in attendances:
-        teacher = User.query.get(attendance.created_by)
-        teacher_name = f"{teacher.first_name} {teacher.last_name}" if teacher else "Unknown"
-        color = {
-            'present': '#28a745',
-            'absent': '#dc3545',
-            'late': '#ffc107'
-        }.get(attendance.status, '#6c757d')
-        event = {
-            'title': attendance.status.capitalize(),
-            'start': attendance.date.strftime('%Y-%m-%d'),
-            'allDay': True,
-            'backgroundColor': color,
-            'borderColor': color,
-            'textColor': '#ffffff',
-            'notes': attendance.notes,
-            'marked_by': teacher_name
-        }
-        attendance_events.append(event)
+    # Calendar events are loaded month by month from main.student_attendance_events
     # Get the latest belt from belt history
     from app.models import BeltHistory
     latest_belt = BeltHistory.query.filter_by(student_id=student.id).order_by(BeltHistory.date_obtained.desc()).first()
     latest_belt_level = latest_belt.belt_level if latest_belt else student.belt_level
+    # Most recent first; the first is the current plan, the rest are history
+    plans = student.plans.all()
     
     return render_template('teacher/student_calendar.html', 
                          student=student, 
+                         picture_urls=picture_urls(student.profile_picture_hash),
                          latest_belt_level=latest_belt_level,
-                         attendance_events=attendance_events,
                          today=get_pacific_date().strftime('%Y-%m-%d'),
                          Attendance=Attendance,
-                         attendance_stats=attendance_stats)
+                         attendance_stats=attendance_stats,
+                         plans=plans,
+                         current_plan=plans[0] if plans else None)
+
+ATTENDANCE_STATUS_COLORS = {
+    'present': '#28a745',
+    'absent': '#dc3545',
+    'late': '#ffc107'
+}
+# Longest window the events feed serves in one request
+EVENTS_MAX_RANGE = timedelta(days=400)
+
+def parse_event_date(value):
+    """Date part of a FullCalendar start/end parameter ('2026-10-01' or a full ISO datetime)"""
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+@main.route('/student/<int:student_id>/attendance_events')
+@login_required
+def student_attendance_events(student_id):
+    """FullCalendar events for a student's attendance between ?start (inclusive) and ?end (exclusive)"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    try:
+        start = parse_event_date(request.args['start'])
+        end = parse_event_date(request.args['end'])
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'start and end dates are required (YYYY-MM-DD)'}), 400
+    if end <= start or end - start > EVENTS_MAX_RANGE:
+        return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+
+    teacher = db.aliased(User)
+    rows = db.session.query(
+        Attendance.date,
+        Attendance.status,
+        Attendance.notes,
+        teacher.first_name,
+        teacher.last_name
+    ).outerjoin(
+        teacher, teacher.id == Attendance.created_by
+    ).filter(
+        Attendance.student_id == student_id,
+        Attendance.date >= start,
+        Attendance.date < end
+    ).order_by(Attendance.date).all()
+
+    events = []
+    for row in rows:
+        color = ATTENDANCE_STATUS_COLORS.get(row.status, '#6c757d')
+        events.append({
+            'title': row.status.capitalize(),
+            'start': row.date.strftime('%Y-%m-%d'),
+            'allDay': True,
+            'backgroundColor': color,
+            'borderColor': color,
+            'textColor': '#ffffff',
+            'notes': row.notes,
+            'marked_by': f"{row.first_name} {row.last_name}" if row.first_name is not None else "Unknown"
+        })
+    return jsonify(events)
 
 @main.route('/student/<int:student_id>/upload_picture', methods=['POST'])
 @login_required
@@ -618,80 +899,105 @@ def upload_profile_picture(student_id):
         
         print(f"Uploading file: {file.filename} -> {filename}")  # Debug print
         
-        # Process the image in memory
+        # Decode, crop and resize in the image process pool
         try:
-            # Read the file data
-            file_data = file.read()
-            file.seek(0)  # Reset file pointer for PIL
+            variants = process_uploaded_picture(file.read())
             
-            with Image.open(file) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Calculate target dimensions while maintaining aspect ratio
-                target_width = 150
-                target_height = 200
-                target_ratio = target_width / target_height
-                
-                # Get current dimensions
-                width, height = img.size
-                current_ratio = width / height
-                
-                if current_ratio > target_ratio:
-                    # Image is wider than target ratio
-                    new_width = int(height * target_ratio)
-                    left = (width - new_width) // 2
-                    img = img.crop((left, 0, left + new_width, height))
-                else:
-                    # Image is taller than target ratio
-                    new_height = int(width / target_ratio)
-                    top = (height - new_height) // 2
-                    img = img.crop((0, top, width, top + new_height))
-                
-                # Resize to target dimensions
-                img = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
-                
-                # Convert to base64
-                import base64
-                from io import BytesIO
-                
-                buffer = BytesIO()
-                img.save(buffer, format='JPEG', quality=85)
-                img_data = buffer.getvalue()
-                base64_data = base64.b64encode(img_data).decode('utf-8')
-                
-                # Update student's profile picture in database
-                student.profile_picture = filename
-                student.profile_picture_data = base64_data
-                print(f"Saving to database: {filename}")  # Debug print
-                db.session.commit()
-                
-                flash('Profile picture uploaded successfully.', 'success')
+            # Store the images by content hash and point the student at the primary one
+            old_hash = student.profile_picture_hash
+            student.profile_picture = filename
+            student.profile_picture_hash = store_picture_variants(variants)
+            if old_hash != student.profile_picture_hash:
+                release_image(old_hash)
+            print(f"Saving to database: {filename}")  # Debug print
+            db.session.commit()
+            
+            flash('Profile picture uploaded successfully.', 'success')
         except Exception as e:
+            db.session.rollback()
             flash(f'Error processing image: {str(e)}', 'danger')
             return redirect(url_for('main.student_calendar', student_id=student_id))
     
     return redirect(url_for('main.student_calendar', student_id=student_id)) 
 
+@main.app_errorhandler(413)
+def upload_too_large(error):
+    max_mb = current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    message = f'Upload is too large (limit {max_mb} MB)'
+    # The picture upload is posted by fetch(); other forms are submitted by the browser
+    if request.endpoint == 'main.upload_profile_picture' or request.is_json:
+        return jsonify({'success': False, 'message': message}), 413
+    flash(message, 'danger')
+    return redirect(request.referrer or url_for('main.index'))
+
+@main.route('/teacher/qr_cache_stats')
+@login_required
+def qr_cache_stats():
+    """Hit rate of this worker's QR lookup cache"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    return jsonify({'success': True, **qr_cache.stats()})
+
+@main.route('/teacher/scan_dedupe_stats')
+@login_required
+def scan_dedupe_stats():
+    """Repeat scans suppressed by this worker's dedupe window"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    return jsonify({'success': True, **scan_dedupe.stats()})
+
+# Content-addressed images never change, so clients may cache them forever
+IMAGE_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+def image_response(sha256, cache_control):
+    """Serve an ImageBlob with a strong ETag, answering revalidations with 304 without loading the bytes"""
+    if request.if_none_match.contains(sha256):
+        response = Response(status=304)
+    else:
+        blob = ImageBlob.query.options(db.undefer(ImageBlob.data)).filter_by(sha256=sha256).first()
+        if blob is None:
+            return '', 404
+        response = Response(blob.data, mimetype=blob.content_type)
+    response.set_etag(sha256)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+@main.route('/images/<string:sha256>')
+def get_image(sha256):
+    """Serve an image by content hash with immutable caching"""
+    return image_response(sha256, f'public, max-age={IMAGE_CACHE_SECONDS}, immutable')
+
 @main.route('/profile_picture/<int:student_id>')
 def get_profile_picture(student_id):
-    """Serve profile picture as base64 data"""
-    student = User.query.get_or_404(student_id)
-    
-    if not student.profile_picture_data:
-        return '', 404
-    
-    # Return the base64 data as an image
-    import base64
-    from flask import Response
-    
-    try:
-        img_data = base64.b64decode(student.profile_picture_data)
-        return Response(img_data, mimetype='image/jpeg')
-    except Exception as e:
-        print(f"Error serving profile picture: {e}")
+    """Serve a student's current profile picture, revalidated on every use
+
+    Optional ?size=thumb|medium|large and ?format=jpeg|webp select a derivative.
+    """
+    size = request.args.get('size', 'medium')
+    image_format = request.args.get('format', 'jpeg')
+    if size not in PICTURE_SIZES or image_format not in PICTURE_FORMATS:
+        return '', 400
+
+    picture_hash, variant_hash = db.session.query(
+        User.profile_picture_hash,
+        ImageVariant.sha256
+    ).outerjoin(
+        ImageVariant, db.and_(
+            ImageVariant.source_sha256 == User.profile_picture_hash,
+            ImageVariant.name == variant_name(size, image_format)
+        )
+    ).filter(User.id == student_id).first() or (None, None)
+    if not picture_hash:
         return '', 404
+    # Pictures stored before derivatives existed only have the primary image
+    return image_response(variant_hash or picture_hash, 'no-cache')
+
+def picture_urls(picture_hash):
+    """Immutable URLs for every derivative of a picture, keyed by variant name"""
+    return {
+        name: url_for('main.get_image', sha256=sha256)
+        for name, sha256 in picture_variant_hashes(picture_hash).items()
+    }
 
 @main.route('/student/<int:student_id>/update_belt_level', methods=['POST'])
 @login_required
@@ -723,6 +1029,7 @@ def update_belt_level(student_id):
             db.session.add(belt_history)
         
         student.belt_level = new_belt_level
+        refresh_student_summary(student.id)
         db.session.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -741,17 +1048,7 @@ def get_belt_history(student_id):
         return jsonify({'success': False, 'message': 'Student not found'}), 404
     
     try:
-        belt_history = BeltHistory.query.filter_by(student_id=student.id).order_by(BeltHistory.date_obtained.desc()).all()
-        
-        history_data = []
-        for entry in belt_history:
-            history_data.append({
-                'id': entry.id,
-                'belt_level': entry.belt_level,
-                'date_obtained': entry.date_obtained.strftime('%Y-%m-%d')
-            })
-        
-        return jsonify({'success': True, 'belt_history': history_data})
+        return jsonify({'success': True, 'belt_history': belt_history_data(student.id)})
     except Exception as e:
         return jsonify({'success': False, 'message': 'Error retrieving belt history'}), 500
 
@@ -774,6 +1071,7 @@ def manage_belt_history(student_id, history_id):
         
         if request.method == 'DELETE':
             db.session.delete(belt_entry)
+            refresh_student_summary(student.id)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Belt history entry deleted'})
         
@@ -787,6 +1085,7 @@ def manage_belt_history(student_id, history_id):
             if 'date_obtained' in data:
                 belt_entry.date_obtained = datetime.strptime(data['date_obtained'], '%Y-%m-%d').date()
             
+            refresh_student_summary(student.id)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Belt history entry updated'})
             
@@ -817,6 +1116,7 @@ def add_belt_history(student_id):
             date_obtained=datetime.strptime(data['date_obtained'], '%Y-%m-%d').date()
         )
         db.session.add(belt_entry)
+        refresh_student_summary(student.id)
         db.session.commit()
         logger.info("Belt history entry added successfully")
         return jsonify({'success': True, 'message': 'Belt history entry added'})
@@ -847,13 +1147,13 @@ def update_personal_info(student_id):
             student.last_name = data['last_name']
         if 'username' in data:
             # Check if username is already taken by another user
-            existing_user = User.query.filter_by(username=data['username']).first()
+            existing_user = db.session.query(User.id).filter_by(username=data['username']).first()
             if existing_user and existing_user.id != student.id:
                 return jsonify({'success': False, 'message': 'Username is already taken by another user'}), 400
             student.username = data['username']
         if 'email' in data:
             # Check if email is already taken by another user
-            existing_user = User.query.filter_by(email=data['email']).first()
+            existing_user = db.session.query(User.id).filter_by(email=data['email']).first()
             if existing_user and existing_user.id != student.id:
                 return jsonify({'success': False, 'message': 'Email is already taken by another user'}), 400
             student.email = data['email']
@@ -872,6 +1172,7 @@ def update_personal_info(student_id):
                 db.session.add(belt_history)
             student.belt_level = new_belt_level
         
+        refresh_student_summary(student.id)
         db.session.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -982,6 +1283,26 @@ def check_existing_attendance():
         return jsonify({'success': False, 'message': 'Error checking attendance'}), 500
 
 # Plan routes
+def apply_plan_fields(plan, data):
+    """Copy program/plan/classes/effective_from from a request body onto a Plan; raises ValueError on bad values"""
+    if 'program' in data:
+        plan.program = data['program'] or None
+    if 'plan' in data:
+        plan.plan = data['plan'] or None
+    if 'classes' in data:
+        plan.classes = int(data['classes']) if data['classes'] not in (None, '') else None
+    # The edit form used to send effective_date
+    effective_from = data.get('effective_from', data.get('effective_date'))
+    if effective_from:
+        plan.effective_from = datetime.strptime(effective_from, '%Y-%m-%d').date()
+    if data.get('effective_to'):
+        # Only kept for programs without a known length; set_window() derives it otherwise
+        plan.effective_to = datetime.strptime(data['effective_to'], '%Y-%m-%d').date()
+    plan.set_window()
+
+def student_plan(student_id, plan_id):
+    return Plan.query.filter_by(id=plan_id, student_id=student_id).first()
+
 @main.route('/student/<int:student_id>/plan', methods=['GET'])
 @login_required
 def get_plan(student_id):
@@ -992,131 +1313,33 @@ def get_plan(student_id):
     if not student:
         return jsonify({'success': False, 'message': 'Student not found'}), 404
     
-    # Return the student's current plan data
-    plans = []
-    if student.program or student.plan or student.classes or student.effective_from:
-        plans.append({
-            'id': 1,  # Placeholder ID
-            'program': student.program,
-            'effective_date': student.effective_from.strftime('%Y-%m-%d') if student.effective_from else None,
-            'plan': student.plan,
-            'classes': student.classes
-        })
-    
-    # Sort by effective_date in descending order (most recent first)
-    plans.sort(key=lambda x: x['effective_date'] if x['effective_date'] else '', reverse=True)
-    
-    return jsonify({'success': True, 'plans': plans})
+    return jsonify({'success': True, 'plans': plans_data(student)})
 
 @main.route('/student/<int:student_id>/plan/<int:plan_id>/remaining', methods=['GET'])
 def get_plan_remaining(student_id, plan_id):
     """Calculate remaining classes for a specific plan"""
-    student = User.query.get_or_404(student_id)
-    
-    # Get the plan data (currently stored in User model)
-    if not student.program or not student.effective_from:
-        return jsonify({'success': False, 'remaining': 0, 'message': 'No plan data found'})
-    
-    # Calculate effective end date based on program
-    effective_to = None
-    if student.program == "3 months":
-        effective_to = student.effective_from + timedelta(days=90)
-    elif student.program == "6 months":
-        effective_to = student.effective_from + timedelta(days=180)
-    elif student.program == "1 year":
-        effective_to = student.effective_from + timedelta(days=365)
-    
-    if not effective_to:
-        return jsonify({'success': False, 'remaining': 0, 'message': 'Invalid program duration'})
-    
-    # Set time range (12:01am to 11:59pm)
-    start_datetime = datetime.combine(student.effective_from, time(0, 1))  # 12:01am
-    end_datetime = datetime.combine(effective_to, time(23, 59))  # 11:59pm
-    
-    # Count attended classes in the date range (excluding free classes)
-    from app.models import Attendance
-    attended_count = Attendance.query.filter(
-        Attendance.student_id == student_id,
-        Attendance.created_at >= start_datetime,
-        Attendance.created_at <= end_datetime,
-        Attendance.free_class == False  # Exclude free classes from plan calculation
-    ).count()
-    
-    # Calculate remaining classes
-    total_classes = int(student.classes) if student.classes and student.classes.isdigit() else 0
-    remaining = max(0, total_classes - attended_count)
+    User.query.get_or_404(student_id)
+    plan = student_plan(student_id, plan_id)
+    if plan is None:
+        return jsonify({'success': False, 'remaining': 0, 'message': 'Plan not found'}), 404
     
-    return jsonify({
-        'success': True, 
-        'remaining': remaining,
-        'attended': attended_count,
-        'total': total_classes,
-        'effective_from': student.effective_from.strftime('%Y-%m-%d'),
-        'effective_to': effective_to.strftime('%Y-%m-%d')
-    })
+    # Attended classes (excluding free classes) from the incrementally maintained counter
+    return jsonify(plan_usage_data(plan))
 
 @main.route('/student/<int:student_id>/plan/<int:plan_id>/details', methods=['GET'])
 def get_plan_details(student_id, plan_id):
     """Get detailed attendance data for plan calculation"""
-    student = User.query.get_or_404(student_id)
-    
-    # Get the plan data (currently stored in User model)
-    if not student.program or not student.effective_from:
-        return jsonify({'success': False, 'message': 'No plan data found'})
-    
-    # Calculate effective end date based on program
-    effective_to = None
-    if student.program == "3 months":
-        effective_to = student.effective_from + timedelta(days=90)
-    elif student.program == "6 months":
-        effective_to = student.effective_from + timedelta(days=180)
-    elif student.program == "1 year":
-        effective_to = student.effective_from + timedelta(days=365)
-    
-    if not effective_to:
-        return jsonify({'success': False, 'message': 'Invalid program duration'})
-    
-    # Set time range (12:01am to 11:59pm)
-    start_datetime = datetime.combine(student.effective_from, time(0, 1))  # 12:01am
-    end_datetime = datetime.combine(effective_to, time(23, 59))  # 11:59pm
-    
-    # Get attended classes in the date range (excluding free classes)
-    from app.models import Attendance
-    attended_classes = Attendance.query.filter(
-        Attendance.student_id == student_id,
-        Attendance.created_at >= start_datetime,
-        Attendance.created_at <= end_datetime,
-        Attendance.free_class == False  # Exclude free classes from plan calculation
-    ).order_by(Attendance.created_at.desc()).all()
-    
-    # Format attendance data for display
-    attendance_details = []
-    for attendance in attended_classes:
-        attendance_details.append({
-            'date': attendance.date.strftime('%Y-%m-%d'),
-            'created_at': attendance.created_at.strftime('%Y-%m-%d %H:%M') + ' PT',
-            'notes': attendance.notes or '',
-            'marked_by': f"{attendance.teacher.first_name} {attendance.teacher.last_name}" if attendance.teacher else 'Unknown'
-        })
+    User.query.get_or_404(student_id)
+    plan = student_plan(student_id, plan_id)
+    if plan is None:
+        return jsonify({'success': False, 'message': 'Plan not found'}), 404
     
-    # Calculate totals
-    attended_count = len(attended_classes)
-    total_classes = int(student.classes) if student.classes and student.classes.isdigit() else 0
-    remaining = max(0, total_classes - attended_count)
-    
-    return jsonify({
-        'success': True,
-        'remaining': remaining,
-        'attended': attended_count,
-        'total': total_classes,
-        'effective_from': student.effective_from.strftime('%Y-%m-%d'),
-        'effective_to': effective_to.strftime('%Y-%m-%d'),
-        'attendance_details': attendance_details
-    })
+    return jsonify(plan_usage_data(plan, details=True))
 
 @main.route('/student/<int:student_id>/plan', methods=['POST'])
 @login_required
 def add_plan(student_id):
+    """Add a plan (a renewal keeps the earlier plans as history)"""
     if not current_user.is_teacher():
         return jsonify({'success': False, 'message': 'Access denied'}), 403
     
@@ -1125,27 +1348,25 @@ def add_plan(student_id):
         return jsonify({'success': False, 'message': 'Student not found'}), 404
     
     data = request.get_json()
+    if not data or not data.get('effective_from'):
+        return jsonify({'success': False, 'message': 'Effective from date is required'}), 400
     
     try:
-        # Update the student's plan information
-        if 'program' in data:
-            student.program = data['program']
-        if 'effective_from' in data and data['effective_from']:
-            from datetime import datetime
-            student.effective_from = datetime.strptime(data['effective_from'], '%Y-%m-%d').date()
-        if 'effective_to' in data and data['effective_to']:
-            from datetime import datetime
-            student.effective_to = datetime.strptime(data['effective_to'], '%Y-%m-%d').date()
-        if 'plan' in data:
-            student.plan = data['plan']
-        if 'classes' in data:
-            student.classes = data['classes']
-        
+        plan = Plan(student_id=student.id)
+        apply_plan_fields(plan, data)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid plan data'}), 400
+    
+    try:
+        db.session.add(plan)
+        recount_plan_usage([plan])
+        student.sync_plan_fields()
+        refresh_student_summary(student.id)
         db.session.commit()
-        return jsonify({'success': True, 'message': 'Plan updated successfully'})
+        return jsonify({'success': True, 'message': 'Plan added successfully', 'plan': plan_json(plan)})
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'message': 'Error updating plan'}), 500
+        return jsonify({'success': False, 'message': 'Error adding plan'}), 500
 
 @main.route('/student/<int:student_id>/plan/<int:plan_id>', methods=['PUT', 'DELETE'])
 @login_required
@@ -1157,15 +1378,16 @@ def manage_plan(student_id, plan_id):
     if not student:
         return jsonify({'success': False, 'message': 'Student not found'}), 404
     
+    plan = student_plan(student.id, plan_id)
+    if plan is None:
+        return jsonify({'success': False, 'message': 'Plan not found'}), 404
+    
     if request.method == 'DELETE':
         try:
-            # For now, clear the student's plan information
-            # In the future, this could delete from a separate Plan model
-            student.program = None
-            student.plan = None
-            student.classes = None
-            student.effective_from = None
-            
+            db.session.delete(plan)
+            db.session.flush()
+            student.sync_plan_fields()
+            refresh_student_summary(student.id)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Plan deleted successfully'})
         except Exception as e:
@@ -1173,26 +1395,228 @@ def manage_plan(student_id, plan_id):
             return jsonify({'success': False, 'message': 'Error deleting plan'}), 500
     
     elif request.method == 'PUT':
-        data = request.get_json()
+        data = request.get_json() or {}
+        old_window = (plan.starts_at, plan.ends_at)
+        try:
+            apply_plan_fields(plan, data)
+        except ValueError:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'Invalid plan data'}), 400
         
         try:
-            # Update the student's plan information
-            if 'program' in data:
-                student.program = data['program']
-            if 'effective_date' in data:
-                from datetime import datetime
-                student.effective_from = datetime.strptime(data['effective_date'], '%Y-%m-%d').date()
-            if 'plan' in data:
-                student.plan = data['plan']
-            if 'classes' in data:
-                student.classes = data['classes']
-            
+            # The counter only holds for the window it was counted over
+            if (plan.starts_at, plan.ends_at) != old_window:
+                recount_plan_usage([plan])
+            student.sync_plan_fields()
+            refresh_student_summary(student.id)
             db.session.commit()
-            return jsonify({'success': True, 'message': 'Plan updated successfully'})
+            return jsonify({'success': True, 'message': 'Plan updated successfully', 'plan': plan_json(plan)})
         except Exception as e:
             db.session.rollback()
             return jsonify({'success': False, 'message': 'Error updating plan'}), 500
 
+@main.route('/teacher/plans/remaining')
+@login_required
+def plans_remaining():
+    """Remaining classes for each student with a plan active today, in one query; ?max_remaining=N lists only those at or below N
+
+    A student whose plans overlap (a renewal started before the last one ran
+    out) is listed once, for the latest of them, as User.current_plan() orders
+    plans. Used by the dashboard's renewals card and for renewal follow-ups.
+    """
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    max_remaining = request.args.get('max_remaining', type=int)
+    now = get_pacific_datetime()
+    active = db.aliased(Plan)
+    latest_active = db.session.query(active.id).filter(
+        active.student_id == Plan.student_id,
+        active.starts_at <= now,
+        active.ends_at >= now
+    ).order_by(
+        active.effective_from.desc().nullslast(), active.id.desc()
+    ).limit(1).correlate(Plan).scalar_subquery()
+    remaining = (db.func.coalesce(Plan.classes, 0) - Plan.attended_count).label('remaining')
+    query = db.session.query(
+        Plan.id,
+        Plan.student_id,
+        User.first_name,
+        User.last_name,
+        Plan.program,
+        Plan.plan,
+        Plan.classes,
+        Plan.attended_count,
+        Plan.effective_to,
+        remaining
+    ).join(
+        User, User.id == Plan.student_id
+    ).filter(
+        User.role == 'student',
+        Plan.starts_at <= now,  # served by ix_plan_starts_at_ends_at
+        Plan.ends_at >= now,
+        Plan.id == latest_active  # served by ix_plan_student_id_effective_from
+    )
+    if max_remaining is not None:
+        query = query.filter(remaining <= max_remaining)
+    
+    plans = [
+        {
+            'plan_id': row.id,
+            'student_id': row.student_id,
+            'student_name': f"{row.first_name} {row.last_name}",
+            'program': row.program,
+            'plan': row.plan,
+            'total': row.classes or 0,
+            'attended': row.attended_count,
+            'remaining': max(0, row.remaining),
+            'effective_to': row.effective_to.strftime('%Y-%m-%d') if row.effective_to else None,
+            'calendar_url': url_for('main.student_calendar', student_id=row.student_id)
+        }
+        for row in query.order_by(remaining, Plan.ends_at, Plan.id).all()
+    ]
+    return jsonify({'success': True, 'plans': plans})
+
+def belt_history_data(student_id):
+    """Belt history entries for the student page, most recent first"""
+    return [
+        {
+            'id': entry.id,
+            'belt_level': entry.belt_level,
+            'date_obtained': entry.date_obtained.strftime('%Y-%m-%d')
+        }
+        for entry in BeltHistory.query.filter_by(student_id=student_id).order_by(BeltHistory.date_obtained.desc()).all()
+    ]
+
+ATTENDANCE_HISTORY_PAGE_SIZE = 50
+ATTENDANCE_HISTORY_MAX_PAGE_SIZE = 500
+
+def student_attendance_query(student_id):
+    """A student's attendance with the marking teacher's name, newest first, as one joined query"""
+    teacher = db.aliased(User)
+    return db.session.query(
+        Attendance.id,
+        Attendance.date,
+        Attendance.created_at,
+        Attendance.notes,
+        Attendance.free_class,
+        teacher.first_name.label('teacher_first_name'),
+        teacher.last_name.label('teacher_last_name')
+    ).outerjoin(
+        teacher, teacher.id == Attendance.created_by
+    ).filter(
+        Attendance.student_id == student_id
+    ).order_by(Attendance.created_at.desc(), Attendance.id.desc())
+
+def attendance_history_page(student_id, cursor=None, limit=ATTENDANCE_HISTORY_PAGE_SIZE):
+    """One keyset page of attendance history on (created_at, id): (rows, next_cursor)
+
+    Raises ValueError for a cursor that does not decode.
+    """
+    query = student_attendance_query(student_id)
+    if cursor:
+        try:
+            after_created_at, after_id = decode_cursor(cursor)
+            after_created_at = datetime.fromisoformat(after_created_at)
+        except (ValueError, TypeError) as e:
+            raise ValueError('Invalid cursor') from e
+        # Served by ix_attendance_student_id_created_at
+        query = query.filter(db.or_(
+            Attendance.created_at < after_created_at,
+            db.and_(Attendance.created_at == after_created_at, Attendance.id < after_id)
+        ))
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at.isoformat(), rows[-1].id)
+    return rows, next_cursor
+
+def attendance_summary_data(student_id):
+    """Totals for the history tab header, from one aggregate query"""
+    total, free_classes, first_attended, last_attended = db.session.query(
+        db.func.count(Attendance.id),
+        db.func.count(Attendance.id).filter(Attendance.free_class == True),
+        db.func.min(Attendance.date),
+        db.func.max(Attendance.date)
+    ).filter(Attendance.student_id == student_id).one()
+    return {
+        'total': total,
+        'free_classes': free_classes,
+        'first_attended': first_attended.strftime('%Y-%m-%d') if first_attended else None,
+        'last_attended': last_attended.strftime('%Y-%m-%d') if last_attended else None
+    }
+
+def teacher_display_name(row):
+    if row.teacher_first_name is None:
+        return 'Unknown'
+    return f"{row.teacher_first_name} {row.teacher_last_name}"
+
+def attendance_history_data(rows):
+    # created_at is stored as naive Pacific time, so it is formatted directly
+    return [
+        {
+            'id': row.id,
+            'created_at': row.created_at.strftime('%Y-%m-%d %H:%M') + ' PT',
+            'attended_date': row.date.strftime('%Y-%m-%d'),
+            'notes': row.notes or '',
+            'free_class': row.free_class,
+            'teacher_name': teacher_display_name(row)
+        }
+        for row in rows
+    ]
+
+def plan_json(plan):
+    return {
+        'id': plan.id,
+        'program': plan.program,
+        'effective_date': plan.effective_from.strftime('%Y-%m-%d') if plan.effective_from else None,
+        'effective_to': plan.effective_to.strftime('%Y-%m-%d') if plan.effective_to else None,
+        'plan': plan.plan,
+        'classes': plan.classes,
+        'attended': plan.attended_count,
+        'remaining': plan.remaining
+    }
+
+def plans_data(student):
+    """The student's plans, most recent first"""
+    return [plan_json(plan) for plan in student.plans]
+
+def plan_usage_data(plan, details=False):
+    """Remaining classes in a plan, read from its usage counter
+
+    With details, also the classes behind it, read from the plan window only.
+    """
+    if plan is None or not plan.program or not plan.effective_from:
+        return {'success': False, 'remaining': 0, 'message': 'No plan data found'}
+    if plan.starts_at is None:
+        return {'success': False, 'remaining': 0, 'message': 'Invalid program duration'}
+
+    usage = {
+        'success': True,
+        'plan_id': plan.id,
+        'remaining': plan.remaining,
+        'attended': plan.attended_count,
+        'total': plan.classes or 0,
+        'effective_from': plan.effective_from.strftime('%Y-%m-%d'),
+        'effective_to': plan.effective_to.strftime('%Y-%m-%d')
+    }
+    if details:
+        usage['attendance_details'] = [
+            {
+                'date': row.date.strftime('%Y-%m-%d'),
+                'created_at': row.created_at.strftime('%Y-%m-%d %H:%M') + ' PT',
+                'notes': row.notes or '',
+                'marked_by': teacher_display_name(row)
+            }
+            for row in student_attendance_query(plan.student_id).filter(
+                Attendance.created_at >= plan.starts_at,
+                Attendance.created_at <= plan.ends_at,
+                Attendance.free_class == False  # Free classes do not use up the plan
+            ).all()
+        ]
+    return usage
+
 @main.route('/student/<int:student_id>/attendance_history')
 @login_required
 def get_attendance_history(student_id):
@@ -1203,30 +1627,68 @@ def get_attendance_history(student_id):
     if not student:
         return jsonify({'success': False, 'message': 'Student not found'}), 404
     
+    # ?summary=1 returns only the totals
+    if request.args.get('summary') in ('1', 'true'):
+        return jsonify({'success': True, 'summary': attendance_summary_data(student.id)})
+    
     try:
-        # Get attendance history ordered by date descending
-        attendance_history = []
-        for attendance in student.student_attendances.order_by(Attendance.created_at.desc()).all():
-            # Since created_at is stored as Pacific time (naive), we can format it directly
-            # But we need to ensure it's treated as Pacific time, not UTC
-            pacific_time = attendance.created_at
-            
-            # Don't add prefix here - let frontend handle it
-            notes_display = attendance.notes or ''
-            
-            attendance_history.append({
-                'id': attendance.id,
-                'created_at': pacific_time.strftime('%Y-%m-%d %H:%M') + ' PT',
-                'attended_date': attendance.date.strftime('%Y-%m-%d'),
-                'notes': notes_display,
-                'free_class': attendance.free_class,
-                'teacher_name': f"{attendance.teacher.first_name} {attendance.teacher.last_name}" if attendance.teacher else 'Unknown'
-            })
-        
-        return jsonify({'success': True, 'attendance_history': attendance_history})
+        limit = min(int(request.args.get('limit', ATTENDANCE_HISTORY_PAGE_SIZE)), ATTENDANCE_HISTORY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit'}), 400
+    
+    try:
+        rows, next_cursor = attendance_history_page(student.id, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    try:
+        return jsonify({'success': True, 'attendance_history': attendance_history_data(rows), 'next_cursor': next_cursor})
     except Exception as e:
         return jsonify({'success': False, 'message': 'Error loading attendance history'}), 500 
 
+PROFILE_FIELDS = ('belt_history', 'attendance_history', 'plans', 'plan_usage')
+
+@main.route('/student/<int:student_id>/profile')
+@login_required
+def student_profile(student_id):
+    """Every panel of the student page in one response; ?fields=a,b limits it to PROFILE_FIELDS named
+
+    attendance_history is the first page of main.get_attendance_history, with
+    its cursor in attendance_history_next_cursor. plan_usage includes the
+    per-class details shown in the plan popup.
+    """
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+
+    fields = request.args.get('fields')
+    fields = set(fields.split(',')) if fields else set(PROFILE_FIELDS)
+    unknown = fields - set(PROFILE_FIELDS)
+    if unknown:
+        return jsonify({'success': False, 'message': f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+
+    student = User.query.filter_by(id=student_id, role='student').first()
+    if not student:
+        return jsonify({'success': False, 'message': 'Student not found'}), 404
+
+    try:
+        bundle = {'success': True}
+        if 'belt_history' in fields:
+            bundle['belt_history'] = belt_history_data(student.id)
+        if 'plans' in fields:
+            bundle['plans'] = plans_data(student)
+        if 'attendance_history' in fields:
+            rows, next_cursor = attendance_history_page(student.id)
+            bundle['attendance_history'] = attendance_history_data(rows)
+            bundle['attendance_history_next_cursor'] = next_cursor
+        if 'plan_usage' in fields:
+            bundle['plan_usage'] = plan_usage_data(student.current_plan(), details=True)
+        return jsonify(bundle)
+    except Exception as e:
+        logging.getLogger("student_profile").error(f"Error loading student profile: {e}", exc_info=True)
+        return jsonify({'success': False, 'message': 'Error loading student profile'}), 500
+
 @main.route('/attendance/<int:attendance_id>/edit', methods=['GET', 'PUT'])
 @login_required
 def edit_attendance(attendance_id):
@@ -1272,13 +1734,18 @@ def edit_attendance(attendance_id):
             if 'free_class' in data and data['free_class'] != attendance.free_class:
                 old_free_class = attendance.free_class
                 attendance.free_class = data['free_class']
+                adjust_plan_usage([(
+                    attendance.student_id,
+                    attendance.created_at,
+                    uses_plan_class(attendance.free_class) - uses_plan_class(old_free_class)
+                )])
                 changes.append({
                     'field_name': 'free_class',
                     'old_value': str(old_free_class),
                     'new_value': str(data['free_class'])
                 })
             
-            # Update date
+            # Update date (plan usage goes by created_at, so the counter is unaffected)
             if 'date' in data:
                 new_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
                 if new_date != attendance.date:
@@ -1304,9 +1771,14 @@ def edit_attendance(attendance_id):
                 )
                 db.session.add(audit_entry)
             
+            if changes:
+                refresh_student_summary(attendance.student_id)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Attendance updated successfully'})
             
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'This student already has attendance for that date'}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'success': False, 'message': 'Error updating attendance'}), 500
@@ -1345,8 +1817,180 @@ def reports():
         flash('Access denied.', 'danger')
         return redirect(url_for('main.index'))
     
-    today = get_pacific_date().strftime('%Y-%m-%d')
-    return render_template('teacher/reports.html', today=today)
+    today = get_pacific_date()
+    return render_template('teacher/reports.html', today=today.strftime('%Y-%m-%d'),
+                           month_start=today.replace(day=1).strftime('%Y-%m-%d'),
+                           report_periods=REPORT_PERIODS, report_groups=REPORT_GROUPS,
+                           attendance_statuses=ATTENDANCE_STATUSES,
+                           classes=Class.query.order_by(Class.name).all())
+
+REPORT_MAX_RANGE = timedelta(days=731)
+JOBS_PAGE_SIZE = 20
+
+@main.route('/reports/attendance')
+@login_required
+def generate_attendance_range_report():
+    """Attendance counts from start to end by day/week/month and student/class/belt/teacher; ?format=json for JSON"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    try:
+        start = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+        end = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end dates (YYYY-MM-DD) are required'}), 400
+    if end < start or end - start > REPORT_MAX_RANGE:
+        return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+    period = request.args.get('period', 'month')
+    group_by = request.args.get('group_by', 'student')
+    if period not in REPORT_PERIODS or group_by not in REPORT_GROUPS:
+        return jsonify({'success': False, 'message': 'Invalid period or grouping'}), 400
+    
+    try:
+        report = attendance_range_report(start, end, period, group_by)
+    except Exception as e:
+        logging.getLogger("reports").error(f"Error generating attendance range report: {e}", exc_info=True)
+        return jsonify({'success': False, 'message': 'Error generating report'}), 500
+    
+    if request.args.get('format') == 'json':
+        return jsonify(dict(report, success=True))
+    return render_template('teacher/attendance_range_report.html', report=report,
+                           start=start.strftime('%B %d, %Y'), end=end.strftime('%B %d, %Y'),
+                           generated_time=get_pacific_now().strftime('%B %d, %Y at %I:%M %p'))
+
+@main.route('/reports/attendance.csv')
+@login_required
+def export_attendance_csv():
+    """Every record marked from start to end, optionally for one student/class/teacher/status, streamed as CSV
+
+    To build the file in the background instead, POST {"kind": "attendance_csv"} to /jobs.
+    """
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    try:
+        start = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+        end = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end dates (YYYY-MM-DD) are required'}), 400
+    if end < start:
+        return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+    filters = {}
+    try:
+        for name in ('student_id', 'class_id', 'teacher_id'):
+            if request.args.get(name):
+                filters[name] = int(request.args[name])
+    except ValueError:
+        return jsonify({'success': False, 'message': f'Invalid {name}'}), 400
+    if request.args.get('status'):
+        if request.args['status'] not in ATTENDANCE_STATUSES:
+            return jsonify({'success': False, 'message': 'Invalid status'}), 400
+        filters['status'] = request.args['status']
+    
+    # No range limit: rows are written as they are read, so memory stays flat however many there are
+    return Response(
+        stream_with_context(attendance_csv(start, end, **filters)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=attendance_{start}_{end}.csv'}
+    )
+
+@main.route('/reports/export/<table>')
+@login_required
+def export_table_file(table):
+    """The whole attendance, belt_history or attendance_audit table as Parquet (?format=arrow for an Arrow IPC stream)
+
+    Optional start and end dates (YYYY-MM-DD, inclusive) limit it to rows
+    recorded in that range.
+    """
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    from app.exports import export_table, EXPORT_TABLES, EXPORT_FORMATS, EXPORT_EXTENSIONS, EXPORT_MIMETYPES
+    if table not in EXPORT_TABLES:
+        return jsonify({'success': False, 'message': 'Unknown table'}), 404
+    file_format = request.args.get('format', 'parquet')
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Invalid format'}), 400
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    
+    return Response(
+        stream_with_context(export_table(table, start, end, file_format)),
+        mimetype=EXPORT_MIMETYPES[file_format],
+        headers={'Content-Disposition': f'attachment; filename={table}.{EXPORT_EXTENSIONS[file_format]}'}
+    )
+
+@main.route('/jobs', methods=['GET'])
+@login_required
+def jobs_page():
+    """The current teacher's recent background jobs, with progress and downloads"""
+    if not current_user.is_teacher():
+        flash('Access denied.', 'danger')
+        return redirect(url_for('main.index'))
+    
+    jobs = Job.query.filter_by(created_by=current_user.id).order_by(Job.created_at.desc(), Job.id.desc()).limit(JOBS_PAGE_SIZE).all()
+    return render_template('teacher/jobs.html', jobs=[job_json(job) for job in jobs])
+
+@main.route('/jobs', methods=['POST'])
+@login_required
+def create_job():
+    """Queue a job from JSON {kind, params}; poll the returned status_url until it is done"""
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'success': False, 'message': 'params must be an object'}), 400
+    try:
+        job = submit_job(data.get('kind'), params, current_user.id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'job': job_json(job),
+        'status_url': url_for('main.job_status', job_id=job.id)
+    }), 202
+
+@main.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    # Other teachers' jobs (and their files) are not found, as on the jobs page
+    job = Job.query.filter_by(id=job_id, created_by=current_user.id).first()
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    data = dict(job_json(job), success=True)
+    if job.status == 'done':
+        data['download_url'] = url_for('main.job_download', job_id=job.id)
+    return jsonify(data)
+
+@main.route('/jobs/<int:job_id>/download')
+@login_required
+def job_download(job_id):
+    if not current_user.is_teacher():
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    # Other teachers' jobs (and their files) are not found, as on the jobs page
+    job = Job.query.filter_by(id=job_id, created_by=current_user.id).first()
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    if job.status != 'done':
+        return jsonify({'success': False, 'message': f'Job is {job.status}'}), 409
+    # Streamed from the database a chunk at a time
+    return Response(
+        stream_with_context(job_result_chunks(job.id)),
+        mimetype=job.result_mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={job.result_name}',
+            'Content-Length': str(job.result_size)
+        }
+    )
 
 @main.route('/reports/generate_attendance', methods=['POST'])
 @login_required
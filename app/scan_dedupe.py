@@ -0,0 +1,84 @@
+"""Per-process suppression of repeated QR scans.
+
+The scanner's camera loop can decode the same code several times a second.
+The first scan of a code from a scanner session goes through to the database.
+For SCAN_DEDUPE_SECONDS afterwards, further scans of that code for the same
+attendance day from the same session get the remembered answer straight from
+memory. The day is part of the key because queued batch scans can carry an
+earlier device date. The session is a random id kept in the Flask session cookie.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app, session
+
+# Entries are pruned on expiry; this only bounds memory if a scanner floods distinct codes
+MAX_ENTRIES = 10000
+
+def scanner_session_id():
+    """Random id identifying this browser's scanner session"""
+    if 'scanner_session' not in session:
+        session['scanner_session'] = uuid.uuid4().hex
+    return session['scanner_session']
+
+class ScanDeduper:
+    def __init__(self):
+        self._entries = OrderedDict()  # (qr data, attendance day, scanner session) -> (expires at, answer)
+        self._lock = threading.Lock()
+        self.suppressed = 0
+        self.passed = 0
+
+    def check(self, qr_data, scan_date, client_id=None):
+        """Remembered answer for a repeat scan for scan_date from this session, or None if the scan should go through
+
+        A resend of the scan that produced the answer (same client_id) goes
+        through, so batch uploads keep their idempotent replay results.
+        """
+        key = (qr_data, scan_date, scanner_session_id())
+        now = time.monotonic()
+        with self._lock:
+            # Entries are mostly in expiry order, so expired ones are at the front
+            while self._entries and next(iter(self._entries.values()))[0] <= now:
+                self._entries.popitem(last=False)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                # Expired, but queued behind entries from a longer window
+                del self._entries[key]
+                entry = None
+            if entry is not None and (client_id is None or entry[1].get('client_id') != client_id):
+                self.suppressed += 1
+                return entry[1]
+            self.passed += 1
+            return None
+
+    def remember(self, qr_data, scan_date, answer):
+        """Answer repeats of this scan for scan_date until the window expires
+
+        answer is a dict with status ('already_marked' or 'not_found'), plus
+        student_name and the client_id of the scan that produced it where known.
+        """
+        key = (qr_data, scan_date, scanner_session_id())
+        expires_at = time.monotonic() + current_app.config['SCAN_DEDUPE_SECONDS']
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires_at, answer)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.suppressed = 0
+            self.passed = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'suppressed': self.suppressed,
+                'passed': self.passed,
+                'active': len(self._entries),
+                'window_seconds': current_app.config['SCAN_DEDUPE_SECONDS'],
+            }
+
+scan_dedupe = ScanDeduper()
@@ -0,0 +1,208 @@
+"""Maintenance of the StudentSummary table.
+
+Routes that change attendance, belt history or plan data call
+refresh_student_summaries() before committing, so the summary rows change in
+the same transaction as the data they are derived from. The
+``flask summary rebuild`` command recomputes every row for repair.
+
+Plan usage is a counter on each Plan row rather than a recount: creating
+attendance (app/attendance.py) and toggling free_class call
+adjust_plan_usage(), a single conditional UPDATE against the plan windows.
+recount_plan_usage() re-derives a plan's count when it is created or its
+window changes, and ``flask summary reconcile`` corrects any drift. The
+summary row keeps a copy of the current plan's count for the roster.
+"""
+from app import db
+from app.models import User, Attendance, BeltHistory, StudentSummary, Plan, get_pacific_date
+
+# Keeps IN (...) lists to a reasonable statement size
+REFRESH_CHUNK_SIZE = 500
+
+def current_month_start():
+    return get_pacific_date().replace(day=1)
+
+def refresh_student_summaries(student_ids):
+    """Recompute the summary rows for the given students in the current session (caller commits)"""
+    student_ids = sorted({int(student_id) for student_id in student_ids if student_id is not None})
+    for i in range(0, len(student_ids), REFRESH_CHUNK_SIZE):
+        _refresh_chunk(student_ids[i:i + REFRESH_CHUNK_SIZE])
+
+def refresh_student_summary(student_id):
+    refresh_student_summaries([student_id])
+
+def adjust_plan_usage(changes):
+    """Apply (student_id, created_at, delta) changes to the plan usage counters
+
+    A change counts against every plan of the student whose window contains
+    created_at. One executemany UPDATE, no reads.
+    """
+    changes = [
+        {'plan_student_id': student_id, 'attended_at': created_at, 'delta': delta}
+        for student_id, created_at, delta in changes if delta
+    ]
+    if not changes:
+        return
+    # Core table rather than the ORM entity: an ORM executemany UPDATE would be matched by primary key only
+    plan = Plan.__table__
+    db.session.execute(
+        plan.update().where(
+            plan.c.student_id == db.bindparam('plan_student_id'),
+            plan.c.starts_at <= db.bindparam('attended_at'),
+            plan.c.ends_at >= db.bindparam('attended_at')
+        ).values(
+            attended_count=plan.c.attended_count + db.bindparam('delta')
+        ),
+        changes
+    )
+
+def uses_plan_class(free_class):
+    """Whether a record with this free_class value uses up a plan class (unset counts as free, like the SQL filter)"""
+    return free_class is not None and not free_class
+
+def count_plan_attendance(plan_ids):
+    """{plan_id: non-free classes attended in the plan window} from the attendance rows, in one grouped query"""
+    return dict(db.session.query(
+        Plan.id,
+        db.func.count(Attendance.id)
+    ).outerjoin(Attendance, db.and_(
+        Attendance.student_id == Plan.student_id,
+        Attendance.created_at >= Plan.starts_at,
+        Attendance.created_at <= Plan.ends_at,
+        Attendance.free_class == False  # Free classes do not use up the plan
+    )).filter(
+        Plan.id.in_(plan_ids)
+    ).group_by(Plan.id).all())
+
+def recount_plan_usage(plans):
+    """Re-derive attended_count for the given plans, e.g. after their window changed (caller commits)"""
+    db.session.flush()
+    counts = count_plan_attendance([plan.id for plan in plans])
+    for plan in plans:
+        plan.attended_count = counts.get(plan.id, 0)
+
+def current_plan_counts(student_ids):
+    """{student_id: attended_count of the student's current plan}, matching User.current_plan()"""
+    counts = {}
+    for student_id, attended_count in db.session.query(Plan.student_id, Plan.attended_count).filter(
+        Plan.student_id.in_(student_ids)
+    ).order_by(Plan.student_id, Plan.effective_from.desc().nullslast(), Plan.id.desc()):
+        counts.setdefault(student_id, attended_count)
+    return counts
+
+def supports_window_functions():
+    """Window functions are available on Postgres and SQLite >= 3.25"""
+    if db.engine.dialect.name == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    return True
+
+def latest_belt_subquery(student_ids=None):
+    """Subquery of (student_id, belt_level) holding each student's most recent BeltHistory entry"""
+    if supports_window_functions():
+        ranked = db.session.query(
+            BeltHistory.student_id,
+            BeltHistory.belt_level,
+            db.func.row_number().over(
+                partition_by=BeltHistory.student_id,
+                order_by=(BeltHistory.date_obtained.desc(), BeltHistory.id.desc())
+            ).label('belt_rank')
+        )
+        if student_ids is not None:
+            ranked = ranked.filter(BeltHistory.student_id.in_(student_ids))
+        ranked = ranked.subquery()
+        return db.session.query(
+            ranked.c.student_id,
+            ranked.c.belt_level
+        ).filter(ranked.c.belt_rank == 1).subquery()
+
+    # Fallback for old SQLite: pick the newest entry per student with a correlated lookup
+    newer = db.aliased(BeltHistory)
+    latest_id = db.session.query(newer.id).filter(
+        newer.student_id == BeltHistory.student_id
+    ).order_by(
+        newer.date_obtained.desc(), newer.id.desc()
+    ).limit(1).scalar_subquery()
+    latest = db.session.query(
+        BeltHistory.student_id,
+        BeltHistory.belt_level
+    ).filter(BeltHistory.id == latest_id)
+    if student_ids is not None:
+        latest = latest.filter(BeltHistory.student_id.in_(student_ids))
+    return latest.subquery()
+
+def _refresh_chunk(student_ids):
+    # Make pending attendance/belt changes visible to the aggregates below
+    db.session.flush()
+
+    month_start = current_month_start()
+
+    last_attended = dict(db.session.query(
+        Attendance.student_id,
+        db.func.max(Attendance.created_at)
+    ).filter(
+        Attendance.student_id.in_(student_ids)
+    ).group_by(Attendance.student_id).all())
+
+    month_counts = dict(db.session.query(
+        Attendance.student_id,
+        db.func.count(Attendance.id)
+    ).filter(
+        Attendance.student_id.in_(student_ids),
+        Attendance.status == 'present',
+        Attendance.date >= month_start
+    ).group_by(Attendance.student_id).all())
+
+    latest_belt = latest_belt_subquery(student_ids)
+    latest_belts = dict(db.session.query(latest_belt.c.student_id, latest_belt.c.belt_level).all())
+
+    plan_counts = current_plan_counts(student_ids)
+
+    students = User.query.filter(User.id.in_(student_ids)).all()
+    existing = {
+        summary.student_id: summary
+        for summary in StudentSummary.query.filter(StudentSummary.student_id.in_(student_ids)).all()
+    }
+
+    for student in students:
+        summary = existing.get(student.id)
+        if summary is None:
+            summary = StudentSummary(student_id=student.id)
+            db.session.add(summary)
+        summary.last_attended_at = last_attended.get(student.id)
+        summary.latest_belt_level = latest_belts.get(student.id)
+        summary.month_start = month_start
+        summary.month_attendance_count = month_counts.get(student.id, 0)
+        summary.plan_attended_count = plan_counts.get(student.id, 0)
+
+def reconcile_plan_usage():
+    """Re-derive every plan usage counter from the attendance rows and fix any that drifted
+
+    Returns {plan_id: (stored count, actual count)} for the corrected plans;
+    the summary copies of corrected students are refreshed too.
+    """
+    corrected = {}
+    plan_ids = [row.id for row in db.session.query(Plan.id).order_by(Plan.id).all()]
+    for i in range(0, len(plan_ids), REFRESH_CHUNK_SIZE):
+        chunk = plan_ids[i:i + REFRESH_CHUNK_SIZE]
+        actual = count_plan_attendance(chunk)
+        student_ids = set()
+        for plan in Plan.query.filter(Plan.id.in_(chunk)).all():
+            count = actual.get(plan.id, 0)
+            if plan.attended_count != count:
+                corrected[plan.id] = (plan.attended_count, count)
+                plan.attended_count = count
+                student_ids.add(plan.student_id)
+        refresh_student_summaries(student_ids)
+        db.session.commit()
+    return corrected
+
+def rebuild_student_summaries():
+    """Recompute the summary for every student; returns the number of rows written"""
+    student_ids = [row.id for row in db.session.query(User.id).filter(User.role == 'student').all()]
+    StudentSummary.query.filter(~StudentSummary.student_id.in_(
+        db.session.query(User.id).filter(User.role == 'student')
+    )).delete(synchronize_session=False)
+    reconcile_plan_usage()
+    refresh_student_summaries(student_ids)
+    db.session.commit()
+    return len(student_ids)
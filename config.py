@@ -10,6 +10,28 @@ class Config:
     db_path = os.path.join(basedir, 'instance', 'app.db')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{db_path}'
     
+    # Uploads (profile pictures) larger than this are rejected with 413
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024)
+    
+    # Processes used to decode and resize uploaded pictures; 0 processes them in the request
+    IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS') or 2)
+    IMAGE_PROCESS_TIMEOUT = 30  # seconds
+    
+    # Per-process QR code -> student cache used by the scan routes
+    QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE') or 2048)
+    QR_CACHE_TTL = 300  # seconds; bounds staleness across worker processes
+    
+    # Print signed, self-verifying QR codes (sq1:...) instead of student:<qr_code_id>;
+    # both formats are accepted when scanning either way
+    QR_SIGNED_CODES = os.environ.get('QR_SIGNED_CODES', '').lower() in ('1', 'true', 'yes')
+    
+    # Repeat scans of a code from the same scanner within this window are answered from memory
+    SCAN_DEDUPE_SECONDS = 10
+    
+    # Processes `flask jobs worker` runs background jobs (badge sheets, exports) in
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)
+    JOB_POLL_INTERVAL = 2  # seconds between checks of an empty queue
+    
     @staticmethod
     def init_app(app):
         pass 
\ No newline at end of file
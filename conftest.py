@@ -0,0 +1,102 @@
+"""
+Shared fixtures for the test scripts
+
+make_app builds the app on a throwaway SQLite database, make_user and login
+cover the usual teacher and student accounts, and sql_statements records the
+SQL a call issues.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User
+from app.qr_cache import qr_cache
+from app.qr_pdf import clear_qr_pdf_cache
+from app.scan_dedupe import scan_dedupe
+from config import Config
+
+PASSWORD = 'password123'
+
+@pytest.fixture
+def make_app(tmp_path):
+    """make_app(database_url=None, **config) -> app with its tables created
+
+    Without database_url each app gets its own SQLite file, whose tables are
+    dropped after the test. The in-process caches are cleared too, since ids
+    repeat from one throwaway database to the next.
+    """
+    apps = []
+
+    def make(database_url=None, **config):
+        throwaway = database_url is None
+        if throwaway:
+            database_url = f"sqlite:///{tmp_path / f'test{len(apps)}.db'}"
+        settings = dict(TESTING=True, WTF_CSRF_ENABLED=False, SQLALCHEMY_DATABASE_URI=database_url)
+        settings.update(config)
+        app = create_app(type('TestConfig', (Config,), settings))
+        with app.app_context():
+            db.create_all()
+        qr_cache.clear()
+        scan_dedupe.clear()
+        clear_qr_pdf_cache()
+        apps.append((app, throwaway))
+        return app
+
+    yield make
+    for app, throwaway in apps:
+        with app.app_context():
+            if throwaway:
+                db.drop_all()
+            db.engine.dispose()
+
+@pytest.fixture
+def make_user():
+    """make_user(username, role='student', with_password=False, **columns) -> a new, unsaved User
+
+    The email comes from the username. Only users made with_password can log
+    in; the others get a placeholder hash, which is much quicker to make.
+    """
+    def make(username, role='student', with_password=False, **columns):
+        columns.setdefault('first_name', 'Test')
+        columns.setdefault('last_name', role.capitalize())
+        user = User(username=username, email=f'{username}@example.com', role=role, **columns)
+        if with_password:
+            user.set_password(PASSWORD)
+        else:
+            user.password_hash = 'x'
+        return user
+    return make
+
+@pytest.fixture
+def login():
+    """login(app, username) -> a test client logged in as that user"""
+    def log_in(app, username):
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': PASSWORD})
+        return client
+    return log_in
+
+@pytest.fixture
+def sql_statements():
+    """sql_statements(engine, func, match=None) -> (func's result, the statements it issued)
+
+    match, a tuple of strings, keeps only the statements containing one of them.
+    """
+    def record(engine, func, match=None):
+        statements = []
+
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            if match is None or any(text in statement for text in match):
+                statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', before_execute)
+        try:
+            result = func()
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_execute)
+        return result, statements
+    return record
@@ -0,0 +1,118 @@
+"""Move profile pictures from base64 user column to image_blob table
+
+Revision ID: 9b41c7d25e8a
+Revises: 6e2f0b8c4d17
+Create Date: 2026-10-18 13:05:17.902114
+
+"""
+import base64
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b41c7d25e8a'
+down_revision = '6e2f0b8c4d17'
+branch_labels = None
+depends_on = None
+
+# Rows converted per round trip, so large tables are not held in memory at once
+BATCH_SIZE = 100
+
+user_table = sa.table(
+    'user',
+    sa.column('id', sa.Integer),
+    sa.column('profile_picture_data', sa.Text),
+    sa.column('profile_picture_hash', sa.String),
+)
+
+image_blob_table = sa.table(
+    'image_blob',
+    sa.column('sha256', sa.String),
+    sa.column('content_type', sa.String),
+    sa.column('size', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+    sa.column('created_at', sa.DateTime),
+)
+
+
+def upgrade():
+    op.create_table('image_blob',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('content_type', sa.String(length=32), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture_hash', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_user_profile_picture_hash', 'image_blob', ['profile_picture_hash'], ['sha256'])
+
+    connection = op.get_bind()
+    stored = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(user_table.c.id, user_table.c.profile_picture_data)
+            .where(user_table.c.profile_picture_data.isnot(None), user_table.c.id > last_id)
+            .order_by(user_table.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for user_id, encoded in rows:
+            try:
+                data = base64.b64decode(encoded)
+            except (ValueError, TypeError):
+                print(f"Skipping undecodable profile picture for user {user_id}")
+                continue
+            sha256 = hashlib.sha256(data).hexdigest()
+            if sha256 not in stored:
+                exists = connection.execute(
+                    sa.select(image_blob_table.c.sha256).where(image_blob_table.c.sha256 == sha256)
+                ).first()
+                if exists is None:
+                    connection.execute(image_blob_table.insert().values(
+                        sha256=sha256, content_type='image/jpeg', size=len(data), data=data
+                    ))
+                stored.add(sha256)
+            connection.execute(
+                user_table.update().where(user_table.c.id == user_id).values(profile_picture_hash=sha256)
+            )
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('profile_picture_data')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_picture_data', sa.Text(), nullable=True))
+
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(user_table.c.id, image_blob_table.c.data)
+            .select_from(user_table.join(image_blob_table, user_table.c.profile_picture_hash == image_blob_table.c.sha256))
+            .where(user_table.c.id > last_id)
+            .order_by(user_table.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for user_id, data in rows:
+            connection.execute(
+                user_table.update().where(user_table.c.id == user_id)
+                .values(profile_picture_data=base64.b64encode(data).decode('utf-8'))
+            )
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_user_profile_picture_hash', type_='foreignkey')
+        batch_op.drop_column('profile_picture_hash')
+
+    op.drop_table('image_blob')
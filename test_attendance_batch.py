@@ -0,0 +1,77 @@
+"""
+Test script to verify the batched scanner upload endpoint
+
+Posts batches of queued scans to /attendance/batch on a throwaway SQLite
+database and checks the per-scan results, that resending a batch (a retry after
+a dropped connection) marks nothing twice, that device timestamps decide the
+attendance day (also for the repeat-scan window), and that invalid scans do
+not affect the rest of the batch.
+"""
+
+import uuid
+from app import db
+from app.models import Attendance, AttendanceAudit, get_pacific_now
+from datetime import timedelta
+
+def scan(student, scanned_at):
+    return {'client_id': str(uuid.uuid4()), 'qr_data': student.generate_qr_code_data(), 'scanned_at': scanned_at.isoformat()}
+
+def test_attendance_batch(make_app, make_user, login):
+    app = make_app()
+    with app.app_context():
+        students = [make_user(f'student{i}', first_name=f'First{i}', last_name=f'Last{i}') for i in range(3)]
+        db.session.add(make_user('teacher', role='teacher', with_password=True))
+        db.session.add_all(students)
+        db.session.commit()
+
+        client = login(app, 'teacher')
+
+        now = get_pacific_now()
+        yesterday = now - timedelta(days=1)
+        scans = [
+            scan(students[0], now),
+            scan(students[0], now),  # Second scan of the same student the same day
+            scan(students[1], yesterday),  # Queued offline since yesterday
+            scan(students[2], now + timedelta(days=1)),  # Device clock far ahead
+            {'client_id': str(uuid.uuid4()), 'qr_data': 'student:nobody', 'scanned_at': now.isoformat()},
+            {'qr_data': students[2].generate_qr_code_data(), 'scanned_at': now.isoformat()},
+        ]
+        scans.append(dict(scans[0]))  # Same client id twice in one batch
+
+        response = client.post('/attendance/batch', json={'scans': scans})
+        assert response.status_code == 200
+        results = response.get_json()['results']
+        assert [item['status'] for item in results] == [
+            'marked', 'already_marked', 'marked', 'invalid', 'not_found', 'invalid', 'marked'
+        ], results
+        assert results[0]['student_name'] == 'First0 Last0'
+        assert results[0]['attendance_id'] == results[6]['attendance_id']
+
+        assert Attendance.query.count() == 2
+        offline = Attendance.query.filter_by(student_id=students[1].id).one()
+        assert offline.date == yesterday.date()
+        assert offline.created_at == yesterday.replace(tzinfo=None)
+        assert offline.check_in_method == 'qr_code'
+        assert AttendanceAudit.query.filter_by(action='created').count() == 2
+
+        # A retry of the same batch returns the same outcome and marks nothing new
+        retry = client.post('/attendance/batch', json={'scans': scans}).get_json()['results']
+        assert [item['status'] for item in retry] == [item['status'] for item in results]
+        assert retry[0]['attendance_id'] == results[0]['attendance_id'] and retry[0]['replayed']
+        assert Attendance.query.count() == 2
+        assert AttendanceAudit.query.count() == 2
+
+        assert client.post('/attendance/batch', json={'scans': 'nope'}).status_code == 400
+        too_many = [scan(students[0], now) for _ in range(201)]
+        assert client.post('/attendance/batch', json={'scans': too_many}).status_code == 400
+
+        # Yesterday's queued scan does not answer a scan of the same code today
+        late = make_user('late', first_name='Late', last_name='Sync')
+        db.session.add(late)
+        db.session.commit()
+        queued = client.post('/attendance/batch', json={'scans': [scan(late, yesterday)]}).get_json()['results']
+        assert queued[0]['status'] == 'marked' and queued[0]['date'] == yesterday.date().isoformat()
+        fresh = client.post('/attendance/batch', json={'scans': [scan(late, now)]}).get_json()['results']
+        assert fresh[0]['status'] == 'marked' and not fresh[0].get('suppressed'), fresh
+        assert client.post('/mark_attendance', json={'qr_data': late.generate_qr_code_data()}).get_json()['suppressed']
+        assert Attendance.query.filter_by(student_id=late.id).count() == 2
@@ -0,0 +1,59 @@
+"""
+Test script to verify parallel QR scans create a single attendance record
+
+Fires simultaneous scans for the same student from several threads (each with
+its own logged-in client and database connection) and checks that exactly one
+scan succeeds, every other scan is told the day is already marked, and exactly
+one attendance record with one 'created' audit entry exists. Uses a throwaway
+SQLite database unless TEST_DATABASE_URL points at a Postgres instance.
+"""
+
+import os
+import threading
+from app import db
+from app.models import Attendance, AttendanceAudit
+
+SCANNERS = 8
+ROUNDS = 5
+
+def parallel_scans(app, login, qr_data):
+    """Scan the same code from SCANNERS threads at once; returns the status codes"""
+    clients = [login(app, 'teacher') for _ in range(SCANNERS)]
+
+    barrier = threading.Barrier(SCANNERS)
+    statuses = []
+    def scan(client):
+        barrier.wait()
+        statuses.append(client.post('/mark_attendance', json={'qr_data': qr_data}).status_code)
+
+    threads = [threading.Thread(target=scan, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+def test_parallel_scans_create_one_record(make_app, make_user, login):
+    database_url = os.environ.get('TEST_DATABASE_URL')
+    if database_url:
+        app = make_app(database_url)
+    else:
+        app = make_app(SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}})
+    with app.app_context():
+        students = [make_user(f'student{i}', first_name=f'First{i}', last_name=f'Last{i}') for i in range(ROUNDS)]
+        db.session.add(make_user('teacher', role='teacher', with_password=True))
+        db.session.add_all(students)
+        db.session.commit()
+        scans = [(student.id, student.generate_qr_code_data()) for student in students]
+
+    for student_id, qr_data in scans:
+        statuses = parallel_scans(app, login, qr_data)
+        assert sorted(statuses) == [200] + [400] * (SCANNERS - 1), f"Unexpected scan results: {statuses}"
+
+    with app.app_context():
+        for student_id, _ in scans:
+            records = Attendance.query.filter_by(student_id=student_id).all()
+            assert len(records) == 1, f"Student {student_id} has {len(records)} attendance records"
+            audits = AttendanceAudit.query.filter_by(attendance_id=records[0].id, action='created').count()
+            assert audits == 1
+        assert AttendanceAudit.query.count() == ROUNDS
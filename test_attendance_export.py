@@ -0,0 +1,122 @@
+"""
+Test script to verify the streaming attendance CSV export
+
+Fills a throwaway SQLite database with attendance for many students, marked
+by several teachers (one since deleted) in a few classes. Checks that the CSV
+lists exactly the records in the range, oldest first, with the filters
+applied. Also checks that the header is sent before any rows are read, that
+rows arrive one batch per chunk, and that peak memory while exporting does
+not grow with the number of records.
+"""
+
+import os
+import csv
+import tracemalloc
+from datetime import date, datetime, timedelta
+from io import StringIO
+from app import db
+from app.models import User, Attendance, Class
+from app.reports import EXPORT_BATCH_SIZE, EXPORT_HEADER
+
+STUDENTS = int(os.environ.get('BENCH_EXPORT_STUDENTS', 200))
+DAYS = 200
+STATUSES = ['present', 'present', 'present', 'late', 'absent']
+
+def export(client, url):
+    response = client.get(url, buffered=False)
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    chunks = [chunk.decode() for chunk in response.response]
+    response.close()
+    return chunks
+
+def streamed_lines(client, url):
+    """Stream the export, keeping nothing; returns (lines, peak bytes allocated)"""
+    tracemalloc.start()
+    response = client.get(url, buffered=False)
+    lines = sum(chunk.count(b'\n') for chunk in response.response)
+    response.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return lines, peak
+
+def rows_of(chunks):
+    return list(csv.reader(StringIO(''.join(chunks))))
+
+def test_attendance_csv_export(make_app, make_user, login):
+    app = make_app()
+    start = date(2025, 1, 1)
+    with app.app_context():
+        teachers = [
+            make_user(f'teacher{i}', role='teacher', with_password=i == 0, first_name='Teacher', last_name=str(i))
+            for i in range(3)
+        ]
+        students = [make_user(f'student{i}', first_name='Student', last_name=f'{i:04d}') for i in range(STUDENTS)]
+        classes = [
+            Class(name=name, day_of_week=0, start_time=datetime.min.time(), end_time=datetime.max.time())
+            for name in ('Kids', 'Adults')
+        ]
+        db.session.add_all(teachers + students + classes)
+        db.session.flush()
+        teacher_ids = [teacher.id for teacher in teachers] + [999999]  # The last teacher was deleted
+        class_ids = [classes[0].id, classes[1].id, None]
+        records = []
+        for s, student in enumerate(students):
+            for day in range(DAYS):
+                attended = start + timedelta(days=day)
+                records.append({
+                    'student_id': student.id, 'date': attended, 'status': STATUSES[(s + day) % 5],
+                    'free_class': (s + day) % 9 == 0, 'created_by': teacher_ids[(s + day) % 4],
+                    'class_id': class_ids[s % 3], 'notes': 'Said "hi", left early' if day == 0 else None,
+                    'created_at': datetime.combine(attended, datetime.min.time()) + timedelta(hours=17, seconds=s)
+                })
+        db.session.execute(db.insert(Attendance), records)
+        db.session.commit()
+        student_id, class_id, teacher_id = students[7].id, classes[1].id, teacher_ids[1]
+
+    # Requests run outside an app context, as in production
+    client = login(app, 'teacher0')
+
+    # A month: every record in it, oldest first, the header sent on its own first
+    end = start + timedelta(days=29)
+    chunks = export(client, f'/reports/attendance.csv?start={start}&end={end}')
+    assert rows_of(chunks[:1]) == [list(EXPORT_HEADER)]
+    rows = rows_of(chunks)[1:]
+    assert len(rows) == STUDENTS * 30
+    assert len(chunks) == 1 + -(-len(rows) // EXPORT_BATCH_SIZE)
+    marked_at = [row[2] for row in rows]
+    assert marked_at == sorted(marked_at) and marked_at[0] == '2025-01-01 17:00:00'
+    assert marked_at[-1].startswith(str(end))
+    first = dict(zip(EXPORT_HEADER, rows[0]))
+    assert first['student'] == 'Student 0000' and first['class'] == 'Kids' and first['notes'] == 'Said "hi", left early'
+    assert 'Unknown' in {row[EXPORT_HEADER.index('marked_by')] for row in rows}
+
+    # The whole range: several times the records, about the same peak memory
+    _, small_peak = streamed_lines(client, f'/reports/attendance.csv?start={start}&end={end}')
+    end = start + timedelta(days=DAYS - 1)
+    lines, large_peak = streamed_lines(client, f'/reports/attendance.csv?start={start}&end={end}')
+    assert lines - 1 == STUDENTS * DAYS
+    assert large_peak < small_peak * 1.5, (small_peak, large_peak)
+
+    # Filters
+    rows = rows_of(export(client, f'/reports/attendance.csv?start={start}&end={end}&student_id={student_id}'))[1:]
+    assert len(rows) == DAYS and {row[5] for row in rows} == {str(student_id)}
+    rows = rows_of(export(client, f'/reports/attendance.csv?start={start}&end={end}&class_id={class_id}&status=late'))[1:]
+    expected = sum(
+        1 for s in range(STUDENTS) for day in range(DAYS)
+        if s % 3 == 1 and STATUSES[(s + day) % 5] == 'late'
+    )
+    assert len(rows) == expected and {(row[3], row[7]) for row in rows} == {('late', 'Adults')}
+    rows = rows_of(export(client, f'/reports/attendance.csv?start={start}&end={end}&teacher_id={teacher_id}'))[1:]
+    assert {row[8] for row in rows} == {'Teacher 1'}
+    assert len(rows_of(export(client, f'/reports/attendance.csv?start=2024-01-01&end=2024-12-31'))) == 1
+
+    assert client.get(f'/reports/attendance.csv?start={start}').status_code == 400
+    assert client.get(f'/reports/attendance.csv?start={end}&end={start}').status_code == 400
+    assert client.get(f'/reports/attendance.csv?start={start}&end={end}&class_id=kids').status_code == 400
+    assert client.get(f'/reports/attendance.csv?start={start}&end={end}&status=excused').status_code == 400
+
+    with app.app_context():
+        db.session.get(User, student_id).set_password('password123')
+        db.session.commit()
+    student_client = login(app, 'student7')
+    assert student_client.get(f'/reports/attendance.csv?start={start}&end={end}').status_code == 403
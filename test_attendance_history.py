@@ -0,0 +1,105 @@
+"""
+Test script to verify keyset-paginated attendance history
+
+Gives a student years of attendance marked by several teachers (one since
+deleted, and many records sharing a created_at) on a throwaway SQLite
+database. Walks the history page by page and checks that the pages join up
+to the full history newest first with no gaps or repeats, that each page
+takes a fixed number of queries however long the history is, and that the
+summary-only mode and bad parameters behave.
+"""
+
+import os
+from datetime import datetime, timedelta
+from app import db
+from app.models import Attendance, get_pacific_date
+
+HISTORY_DAYS = int(os.environ.get('BENCH_HISTORY_DAYS', 1500))
+
+def test_attendance_history_pages(make_app, make_user, login, sql_statements):
+    app = make_app()
+    with app.app_context():
+        teachers = [
+            make_user(f'teacher{i}', role='teacher', with_password=i == 0, first_name='Teacher', last_name=str(i))
+            for i in range(3)
+        ]
+        student = make_user('student', first_name='Long', last_name='Timer')
+        newcomer = make_user('newcomer', first_name='New', last_name='Comer')
+        db.session.add_all(teachers + [student, newcomer])
+        db.session.flush()
+
+        today = get_pacific_date()
+        # Records entered in a batch share a created_at, so pages must break ties on id
+        batch_time = datetime.combine(today, datetime.min.time()) - timedelta(days=HISTORY_DAYS)
+        db.session.add_all([
+            Attendance(student_id=student.id, date=today - timedelta(days=day), status='present',
+                       notes=f'day {day}', created_by=teachers[day % 3].id if day % 10 else 999999,
+                       free_class=day % 7 == 0,
+                       created_at=batch_time if day % 4 == 0 else datetime.combine(today - timedelta(days=day), datetime.min.time()) + timedelta(hours=18))
+            for day in range(HISTORY_DAYS)
+        ])
+        db.session.add(Attendance(student_id=newcomer.id, date=today, status='present', created_by=teachers[0].id))
+        db.session.commit()
+        student_id, newcomer_id = student.id, newcomer.id
+        expected = [
+            row.id for row in Attendance.query.filter_by(student_id=student_id).order_by(
+                Attendance.created_at.desc(), Attendance.id.desc()
+            ).all()
+        ]
+        engine = db.engine
+
+    # Requests run outside an app context so each one loads the logged-in user as in production
+    client = login(app, 'teacher0')
+
+    def statement_count(func):
+        result, statements = sql_statements(engine, func)
+        return result, len(statements)
+
+    url = f'/student/{student_id}/attendance_history'
+    response, first_statements = statement_count(lambda: client.get(url))
+    first = response.get_json()
+    assert first['success'] and len(first['attendance_history']) == 50 and first['next_cursor']
+    _, short_statements = statement_count(lambda: client.get(f'/student/{newcomer_id}/attendance_history'))
+    assert first_statements == short_statements, (first_statements, short_statements)
+
+    # Walk every page: no gaps, no repeats, newest first
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page_url = f'{url}?limit=200' + (f'&cursor={cursor}' if cursor else '')
+        response, statements = statement_count(lambda: client.get(page_url))
+        data = response.get_json()
+        assert statements == first_statements
+        seen.extend(row['id'] for row in data['attendance_history'])
+        pages += 1
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert seen == expected
+    assert pages == -(-HISTORY_DAYS // 200)
+    assert 'Unknown' in {row['teacher_name'] for row in first['attendance_history']}
+
+    # The last student on file has one short page
+    newcomer_page = client.get(f'/student/{newcomer_id}/attendance_history').get_json()
+    assert len(newcomer_page['attendance_history']) == 1 and newcomer_page['next_cursor'] is None
+
+    # Summary-only mode
+    summary = client.get(f'{url}?summary=1').get_json()
+    assert set(summary) == {'success', 'summary'}
+    assert summary['summary'] == {
+        'total': HISTORY_DAYS,
+        'free_classes': len(range(0, HISTORY_DAYS, 7)),
+        'first_attended': str(today - timedelta(days=HISTORY_DAYS - 1)),
+        'last_attended': str(today)
+    }
+
+    # The profile bundle carries the first page and its cursor
+    bundle = client.get(f'/student/{student_id}/profile?fields=attendance_history').get_json()
+    assert bundle['attendance_history'] == first['attendance_history']
+    assert bundle['attendance_history_next_cursor'] == first['next_cursor']
+
+    assert client.get(f'{url}?cursor=not-a-cursor').status_code == 400
+    assert client.get(f'{url}?limit=0').status_code == 400
+    assert client.get(f'{url}?limit=many').status_code == 400
+    assert len(client.get(f'{url}?limit=100000').get_json()['attendance_history']) == 500
@@ -0,0 +1,133 @@
+"""
+Test script to verify date-range attendance reports
+
+Fills a throwaway SQLite database with a year of attendance for a few
+hundred students, marked by several teachers (one since deleted) in a few
+classes. Runs the range report for every period and grouping and checks the
+counts against the same report computed in Python, checks the week buckets
+start on Monday, that the report takes a fixed number of queries, and that
+the HTML view, the JSON form and bad parameters behave.
+"""
+
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from app import db
+from app.models import Attendance, Class, StudentSummary
+from app.reports import attendance_range_report, REPORT_PERIODS, REPORT_GROUPS
+
+STUDENTS = int(os.environ.get('BENCH_REPORT_STUDENTS', 300))
+DAYS = 365
+STATUSES = ['present', 'present', 'present', 'late', 'absent']
+
+def bucket(day, period):
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def expected_report(records, period, group_by, labels):
+    """The report computed in Python from the inserted rows"""
+    counts = defaultdict(lambda: {'records': 0, 'present': 0, 'late': 0, 'absent': 0, 'free_classes': 0, 'students': set()})
+    for record in records:
+        key = (bucket(record['created_at'].date(), period).strftime('%Y-%m-%d'), labels[group_by](record))
+        entry = counts[key]
+        entry['records'] += 1
+        entry[record['status']] += 1
+        entry['free_classes'] += record['free_class']
+        entry['students'].add(record['student_id'])
+    return {key: dict(value, students=len(value['students'])) for key, value in counts.items()}
+
+def test_attendance_range_reports(make_app, make_user, login, sql_statements):
+    app = make_app()
+    start = date(2025, 1, 1)
+    end = start + timedelta(days=DAYS - 1)
+    with app.app_context():
+        teachers = [
+            make_user(f'teacher{i}', role='teacher', with_password=i == 0, first_name='Teacher', last_name=str(i))
+            for i in range(3)
+        ]
+        students = [
+            make_user(f'student{i}', first_name='Student', last_name=f'{i:04d}', belt_level=['White', 'Yellow', None][i % 3])
+            for i in range(STUDENTS)
+        ]
+        classes = [
+            Class(name=name, day_of_week=0, start_time=datetime.min.time(), end_time=datetime.max.time())
+            for name in ('Kids', 'Adults')
+        ]
+        db.session.add_all(teachers + students + classes)
+        db.session.flush()
+        # A belt promotion recorded on the summary wins over User.belt_level, as on the dashboard
+        db.session.add_all([
+            StudentSummary(student_id=student.id, latest_belt_level='Green')
+            for student in students[::10]
+        ])
+        teacher_ids = [teacher.id for teacher in teachers] + [999999]  # The last teacher was deleted
+        class_ids = [classes[0].id, classes[1].id, None]
+        records = []
+        for s, student in enumerate(students):
+            for day in range(s % 3, DAYS, 3):
+                attended = start + timedelta(days=day)
+                records.append({
+                    'student_id': student.id, 'date': attended, 'status': STATUSES[(s + day) % 5],
+                    'free_class': (s + day) % 9 == 0, 'created_by': teacher_ids[(s + day) % 4],
+                    'class_id': class_ids[s % 3],
+                    'created_at': datetime.combine(attended, datetime.min.time()) + timedelta(hours=17, minutes=s % 60)
+                })
+        # Just outside the range on both sides
+        for outside in (start - timedelta(days=1), end + timedelta(days=1)):
+            records.append({
+                'student_id': students[0].id, 'date': outside, 'status': 'present', 'free_class': False,
+                'created_by': teacher_ids[0], 'class_id': None,
+                'created_at': datetime.combine(outside, datetime.min.time()) + timedelta(hours=17)
+            })
+        db.session.execute(db.insert(Attendance), records)
+        db.session.commit()
+        in_range = records[:-2]
+
+        names = {student.id: f"{student.first_name} {student.last_name}" for student in students + teachers}
+        class_names = {classes[0].id: 'Kids', classes[1].id: 'Adults'}
+        belts = {student.id: student.belt_level or 'No Belt' for student in students}
+        belts.update({student.id: 'Green' for student in students[::10]})
+        labels = {
+            'student': lambda record: names[record['student_id']],
+            'teacher': lambda record: names.get(record['created_by'], 'Unknown'),
+            'class': lambda record: class_names.get(record['class_id'], 'No class'),
+            'belt': lambda record: belts[record['student_id']],
+        }
+        engine = db.engine
+
+        for period in REPORT_PERIODS:
+            for group_by in REPORT_GROUPS:
+                report, statements = sql_statements(
+                    engine, lambda: attendance_range_report(start, end, period, group_by)
+                )
+                assert len(statements) == 2, statements
+                actual = {
+                    (row['period'], row['group']): {key: row[key] for key in ('records', 'present', 'late', 'absent', 'free_classes', 'students')}
+                    for row in report['rows']
+                }
+                assert actual == expected_report(in_range, period, group_by, labels), (period, group_by)
+                assert [row['period'] for row in report['rows']] == sorted(row['period'] for row in report['rows'])
+                assert report['totals']['records'] == len(in_range)
+                assert report['totals']['students'] == STUDENTS
+                if period == 'week':
+                    assert all(date.fromisoformat(row['period']).weekday() == 0 for row in report['rows'])
+
+        # A single day matches the daily report's records
+        one_day = attendance_range_report(start + timedelta(days=10), start + timedelta(days=10), 'day', 'teacher')
+        assert one_day['totals']['records'] == sum(1 for record in in_range if record['date'] == start + timedelta(days=10))
+
+    client = login(app, 'teacher0')
+    url = f'/reports/attendance?start={start}&end={end}&period=month&group_by=class'
+    data = client.get(url + '&format=json').get_json()
+    assert data['success'] and data['group_by'] == 'class' and len(data['rows']) == 12 * 3
+    html = client.get(url).get_data(as_text=True)
+    assert 'Month of 2025-03-01' in html and 'No class' in html and 'Adults' in html
+
+    assert client.get(f'/reports/attendance?start={start}').status_code == 400
+    assert client.get(f'/reports/attendance?start={end}&end={start}').status_code == 400
+    assert client.get(f'/reports/attendance?start=2020-01-01&end={end}').status_code == 400
+    assert client.get(f'/reports/attendance?start={start}&end={end}&group_by=status').status_code == 400
+    assert client.get(f'/reports/attendance?start={start}&end={end}&period=hour').status_code == 400
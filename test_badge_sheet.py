@@ -0,0 +1,182 @@
+"""
+Test script to verify multi-up QR badge sheets
+
+Builds a throwaway SQLite database with students (some with profile pictures)
+and a class with current, ended and inactive enrollments, then downloads badge
+sheets for a selection, the class and all students. Checks that the PDF's
+cross-reference table points at every object, that each badge carries the
+student's QR code and photo (embedded once however many badges share it),
+that QR codes are rasterized a page at a time and at most one page ahead of
+drawing, that the CLI writes the same sheet, and that rasterizing the QR codes
+inline and in the process pool gives the same sheet.
+"""
+
+import base64
+import os
+import re
+import zlib
+from datetime import time, timedelta
+from io import BytesIO
+import qrcode
+from PIL import Image
+import app.badges as badges
+from app import db
+from app.models import Class, ClassEnrollment, get_pacific_date
+from app.images import render_picture_variants_from_bytes, store_picture_variants
+from app.badges import BADGES_PER_PAGE
+
+STUDENTS = int(os.environ.get('BENCH_BADGE_STUDENTS', 200))
+IMAGE_PROCESS_WORKERS = 2
+
+def sample_picture():
+    img = Image.linear_gradient('L').convert('RGB').resize((600, 800))
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def pdf_objects(data):
+    """{object id: (dictionary, decoded stream or None)}"""
+    objects = {}
+    for match in re.finditer(rb'(\d+) 0 obj\n<<\n(.*?)\n>>\n(?:stream\n(.*?)endstream\n)?endobj\n', data, re.S):
+        dictionary, stream = match.group(2), match.group(3)
+        if stream is not None:
+            filters = re.search(rb'/Filter \[ ([^\]]*) \]', dictionary).group(1).split()
+            if b'/ASCII85Decode' in filters:
+                stream = base64.a85decode(stream.strip(), adobe=True)
+            if b'/FlateDecode' in filters:
+                stream = zlib.decompress(stream)
+        objects[int(match.group(1))] = (dictionary, stream)
+    return objects
+
+def check_pdf(data):
+    """Validate the xref table and return the number of pages"""
+    assert data.startswith(b'%PDF-') and data.endswith(b'%%EOF\n')
+    xref_offset = int(re.search(rb'startxref\n(\d+)\n', data).group(1))
+    assert data[xref_offset:].startswith(b'xref\n')
+    count = int(re.match(rb'xref\n0 (\d+)\n', data[xref_offset:]).group(1))
+    entries = data[xref_offset:].split(b'\n')[3:3 + count - 1]
+    for obj_id, entry in enumerate(entries, start=1):
+        offset = int(entry[:10])
+        assert data[offset:].startswith(b'%d 0 obj\n' % obj_id), obj_id
+    pages = int(re.search(rb'/Count (\d+) /Kids', data).group(1))
+    assert len(re.findall(rb'/Type /Page\n', data)) == pages
+    return pages
+
+def image_streams(data, kind):
+    """Streams of the images of one kind ('DCTDecode' photos, still JPEG, or 'FlateDecode' QR codes), in object order"""
+    return [
+        stream for _, (dictionary, stream) in sorted(pdf_objects(data).items())
+        if b'/Subtype /Image' in dictionary and b'/' + kind.encode() in dictionary
+    ]
+
+def page_contents(data):
+    """Decompressed page content streams"""
+    objects = pdf_objects(data)
+    return [
+        objects[int(match.group(1))][1]
+        for match in re.finditer(rb'/Contents (\d+) 0 R', data)
+    ]
+
+def download(client, url):
+    response = client.get(url)
+    assert response.status_code == 200 and response.mimetype == 'application/pdf', response.status_code
+    assert response.is_streamed
+    data = b''.join(response.response)
+    response.close()
+    return data
+
+class RecordingPool:
+    """Stands in for the image process pool, recording each QR batch and when it was submitted"""
+
+    def __init__(self, pool, events):
+        self.pool = pool
+        self.events = events
+
+    def submit(self, func, payloads):
+        self.events.append(('submit', len(payloads)))
+        return self.pool.submit(func, payloads)
+
+def test_badge_sheet(make_app, make_user, login, tmp_path, monkeypatch):
+    app = make_app(IMAGE_PROCESS_WORKERS=IMAGE_PROCESS_WORKERS)
+    with app.app_context():
+        db.session.add(make_user('teacher', role='teacher', with_password=True))
+        picture_hash = store_picture_variants(render_picture_variants_from_bytes(sample_picture()))
+        students = [
+            make_user(f'student{i}', first_name=f'First{i:04d}', belt_level='Yellow',
+                      profile_picture_hash=picture_hash if i % 3 == 0 else None)
+            for i in range(STUDENTS)
+        ]
+        students[1].first_name = 'Bartholomew-Maximilian Alexander Montgomery'
+        db.session.add_all(students)
+        db.session.flush()
+
+        today = get_pacific_date()
+        intake = Class(name='New Intake', day_of_week=0, start_time=time(17, 0), end_time=time(18, 0))
+        db.session.add(intake)
+        db.session.flush()
+        db.session.add_all([
+            ClassEnrollment(class_id=intake.id, student_id=student.id, enrolled_from=today + timedelta(days=7))
+            for student in students[:10]
+        ] + [
+            ClassEnrollment(class_id=intake.id, student_id=students[10].id, enrolled_until=today - timedelta(days=1)),
+            ClassEnrollment(class_id=intake.id, student_id=students[11].id, is_active=False),
+        ])
+        db.session.commit()
+        class_id = intake.id
+        selected = [students[0].id, students[1].id, students[2].id]
+        expected_qr = students[1].generate_qr_code_data()
+
+    client = login(app, 'teacher')
+
+    # A selection fits on one page
+    data = download(client, f"/teacher/badges?student_ids={','.join(map(str, selected))}")
+    assert check_pdf(data) == 1
+    assert len(image_streams(data, 'FlateDecode')) == 3
+    photos = image_streams(data, 'DCTDecode')
+    assert len(photos) == 1 and Image.open(BytesIO(photos[0])).size == (150, 200)
+    # Badges are ordered by name, so Bartholomew comes first; the QR image holds their code
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(expected_qr)
+    qr.make(fit=True)
+    first_qr = image_streams(data, 'FlateDecode')[0]
+    assert first_qr == bytes(0 if dark else 255 for row in qr.get_matrix() for dark in row)
+    # Long names are shrunk and then truncated to fit the badge
+    assert b'(Bartholomew-Maximilian' in page_contents(data)[0] and b'...) Tj' in page_contents(data)[0]
+
+    # Class: current and upcoming enrollments only
+    data = download(client, f'/teacher/badges?class_id={class_id}')
+    assert check_pdf(data) == 2 and len(image_streams(data, 'FlateDecode')) == 10
+
+    # Everyone; inline rasterizing vs the process pool, a page-sized batch at a time
+    expected_pages = -(-STUDENTS // BADGES_PER_PAGE)
+    app.config['IMAGE_PROCESS_WORKERS'] = 0
+    inline = download(client, '/teacher/badges?all=1')
+    app.config['IMAGE_PROCESS_WORKERS'] = IMAGE_PROCESS_WORKERS
+    events = []
+    get_process_pool, draw_badges = badges.get_process_pool, badges._draw_badges
+    monkeypatch.setattr(badges, 'get_process_pool', lambda: RecordingPool(get_process_pool(), events))
+    monkeypatch.setattr(badges, '_draw_badges', lambda *args: events.append(('draw',)) or draw_badges(*args))
+    pooled = download(client, '/teacher/badges?all=1')
+    assert check_pdf(pooled) == expected_pages
+    assert inline == pooled
+    assert len(image_streams(pooled, 'FlateDecode')) == STUDENTS
+    assert len(image_streams(pooled, 'DCTDecode')) == 1
+    batches = [event[1] for event in events if event[0] == 'submit']
+    assert len(batches) == expected_pages and max(batches) == BADGES_PER_PAGE and sum(batches) == STUDENTS
+    submitted = drawn = 0
+    for event in events:
+        submitted, drawn = submitted + (event[0] == 'submit'), drawn + (event[0] == 'draw')
+        assert submitted - drawn <= 2, "QR codes were rasterized more than a page ahead"
+
+    # Nothing selected or nobody matching
+    assert client.get('/teacher/badges').status_code == 302
+    assert client.get('/teacher/badges?student_ids=999999').status_code == 302
+
+    # The CLI writes the same sheet
+    output = str(tmp_path / 'class.pdf')
+    result = app.test_cli_runner().invoke(args=['badges', 'sheet', '--class-id', str(class_id), '-o', output])
+    assert result.exit_code == 0, result.output
+    with open(output, 'rb') as f:
+        assert check_pdf(f.read()) == 2
+    result = app.test_cli_runner().invoke(args=['badges', 'sheet', '--all', '--class-id', str(class_id)])
+    assert result.exit_code != 0
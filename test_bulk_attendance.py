@@ -0,0 +1,111 @@
+"""
+Test script to verify bulk attendance marking is set-based
+
+Posts the bulk form of /mark_attendance for 50, 500 and 5,000 students on
+throwaway SQLite databases and counts the SQL statements issued, compared with
+the previous one-flush-per-student loop. Also checks that ids of non-students
+are ignored, already-marked students are skipped, and every created record has
+its 'created' audit entry, and that rows repeating a student and day are
+inserted once, counted against the plan at the time of the row that was kept.
+"""
+
+import app.attendance as attendance_module
+from app import db
+from app.attendance import insert_attendance_bulk
+from app.models import User, Attendance, AttendanceAudit, Plan
+from app.summary import count_plan_attendance
+from datetime import date, datetime
+
+MARK_DATE = date(2026, 3, 2)
+
+def seed(make_user, student_count):
+    teacher = make_user('teacher', role='teacher', with_password=True)
+    db.session.add(teacher)
+    db.session.add_all([
+        make_user(f'student{i}', first_name=f'First{i}', last_name=f'Last{i}')
+        for i in range(student_count)
+    ])
+    db.session.commit()
+    return teacher.id, [row.id for row in db.session.query(User.id).filter_by(role='student').all()]
+
+def per_student_loop(student_ids, teacher_id):
+    """The previous implementation: one Attendance + flush + AttendanceAudit per student"""
+    for student in User.query.filter_by(role='student').all():
+        if student.id in student_ids:
+            attendance = Attendance(student_id=student.id, date=MARK_DATE, status='present', notes='', created_by=teacher_id)
+            db.session.add(attendance)
+            db.session.flush()
+            db.session.add(AttendanceAudit(attendance_id=attendance.id, action='created', changed_by=teacher_id))
+    db.session.commit()
+
+def statement_counts(make_app, make_user, login, sql_statements, student_count):
+    """(bulk form statements, per-student loop statements) for marking student_count students"""
+    app = make_app()
+    with app.app_context():
+        teacher_id, student_ids = seed(make_user, student_count)
+
+        _, loop_statements = sql_statements(db.engine, lambda: per_student_loop(set(student_ids), teacher_id))
+        AttendanceAudit.query.delete()
+        Attendance.query.delete()
+        db.session.commit()
+
+        # One student is already marked, and a teacher id sneaks into the form
+        db.session.add(Attendance(student_id=student_ids[0], date=MARK_DATE, status='present', created_by=teacher_id))
+        db.session.commit()
+        form = {'date': MARK_DATE.isoformat(), f'status_{teacher_id}': 'present', 'status_abc': 'present'}
+        for student_id in student_ids:
+            form[f'status_{student_id}'] = 'late' if student_id % 2 else 'present'
+            form[f'notes_{student_id}'] = f'note {student_id}'
+
+        client = login(app, 'teacher')
+        response, bulk_statements = sql_statements(db.engine, lambda: client.post('/mark_attendance', data=form))
+        assert response.status_code == 302
+
+        assert Attendance.query.filter_by(date=MARK_DATE).count() == student_count
+        assert Attendance.query.filter_by(student_id=teacher_id).count() == 0
+        assert AttendanceAudit.query.filter_by(action='created').count() == student_count - 1
+        sample = Attendance.query.filter_by(student_id=student_ids[-1]).one()
+        assert sample.notes == f'note {student_ids[-1]}'
+        assert sample.status == ('late' if student_ids[-1] % 2 else 'present')
+
+    return len(bulk_statements), len(loop_statements)
+
+def test_bulk_marking_is_set_based(make_app, make_user, login, sql_statements):
+    for student_count in (50, 500, 5000):
+        bulk_statements, loop_statements = statement_counts(make_app, make_user, login, sql_statements, student_count)
+        # Batched inserts plus the chunked summary refresh, not two statements per student
+        assert bulk_statements < student_count / 10 + 20
+        assert bulk_statements < loop_statements
+
+def test_repeated_rows_are_inserted_once(make_app, make_user, monkeypatch):
+    app = make_app()
+    with app.app_context():
+        teacher_id, (student_id,) = seed(make_user, 1)
+        # The plan ends at noon: the first scan is inside it, the repeat after it
+        plan = Plan(student_id=student_id, classes=10, starts_at=datetime(2026, 3, 1),
+                    ends_at=datetime(2026, 3, 2, 12))
+        db.session.add(plan)
+        db.session.commit()
+        rows = [
+            {'student_id': student_id, 'date': MARK_DATE, 'created_at': datetime(2026, 3, 2, 10), 'client_id': 'a'},
+            {'student_id': student_id, 'date': MARK_DATE, 'created_at': datetime(2026, 3, 2, 15), 'client_id': 'b'},
+            {'student_id': student_id, 'date': MARK_DATE, 'created_at': datetime(2026, 3, 2, 16), 'client_id': 'a'},
+        ]
+
+        # With INSERT ... RETURNING, then the savepoint-per-row fallback
+        for returning in (True, False):
+            if not returning:
+                monkeypatch.setattr(attendance_module, '_insert_ignoring_conflicts', lambda index_elements: None)
+            created = insert_attendance_bulk(rows, teacher_id)
+            db.session.commit()
+            assert [(attendance.student_id, attendance.client_id) for attendance in created] == [(student_id, 'a')]
+            record = Attendance.query.filter_by(student_id=student_id).one()
+            assert record.created_at == datetime(2026, 3, 2, 10)
+            assert AttendanceAudit.query.count() == 1
+            db.session.refresh(plan)
+            assert plan.attended_count == count_plan_attendance([plan.id])[plan.id] == 1
+
+            AttendanceAudit.query.delete()
+            Attendance.query.delete()
+            plan.attended_count = 0
+            db.session.commit()
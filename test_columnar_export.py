@@ -0,0 +1,112 @@
+"""
+Test script to verify the Parquet/Arrow exports for offline analysis
+
+Fills a throwaway SQLite database with attendance, audit entries and belt
+history. Exports each table through the endpoint and the CLI. Checks that
+Parquet files come out in row groups of EXPORT_ROW_GROUP_SIZE, one streamed
+chunk per group, with status, belt_level and check_in_method
+dictionary-encoded. Checks that the rows read back match the database, and
+that the Arrow format, date filters and bad parameters behave.
+"""
+
+import os
+from datetime import date, datetime, time as clock, timedelta
+from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app import db
+from app.models import Attendance, AttendanceAudit, BeltHistory
+from app.exports import EXPORT_ROW_GROUP_SIZE
+
+RECORDS = int(os.environ.get('BENCH_EXPORT_RECORDS', 120000))
+STATUSES = ['present', 'present', 'present', 'late', 'absent']
+
+def download(client, url):
+    response = client.get(url, buffered=False)
+    assert response.status_code == 200, response.status_code
+    chunks = list(response.response)
+    response.close()
+    return chunks
+
+def test_columnar_exports(make_app, make_user, login, tmp_path):
+    app = make_app()
+    start = datetime(2020, 1, 1, 17)
+    with app.app_context():
+        teacher = make_user('teacher', role='teacher', with_password=True)
+        student = make_user('student', with_password=True)
+        db.session.add_all([teacher, student])
+        db.session.flush()
+        db.session.execute(db.insert(Attendance), [
+            {
+                'student_id': 1000 + i, 'date': (start + timedelta(minutes=i)).date(), 'status': STATUSES[i % 5],
+                'free_class': i % 9 == 0, 'created_by': teacher.id, 'class_id': i % 3 or None,
+                'check_in_time': clock(17, i % 60), 'check_in_method': ['qr_code', 'manual', None][i % 3],
+                'notes': f'note {i}' if i % 100 == 0 else None,
+                'created_at': start + timedelta(minutes=i), 'updated_at': start + timedelta(minutes=i)
+            }
+            for i in range(RECORDS)
+        ])
+        db.session.execute(db.insert(AttendanceAudit), [
+            {'attendance_id': i + 1, 'action': 'updated', 'field_name': 'status', 'old_value': 'present',
+             'new_value': 'late', 'changed_by': teacher.id, 'changed_at': start + timedelta(minutes=i, seconds=30)}
+            for i in range(0, RECORDS, 50)
+        ])
+        db.session.add_all([
+            BeltHistory(student_id=student.id, belt_level=belt, date_obtained=date(2020 + n, 6, 1),
+                        created_at=datetime(2020 + n, 6, 1, 12))
+            for n, belt in enumerate(['White', 'Yellow', 'Orange'])
+        ])
+        db.session.commit()
+        expected_statuses = [status for (status,) in db.session.query(Attendance.status).order_by(Attendance.id)]
+
+    client = login(app, 'teacher')
+
+    # Attendance as Parquet: one row group and one chunk per EXPORT_ROW_GROUP_SIZE rows, then the footer
+    chunks = download(client, '/reports/export/attendance')
+    groups = -(-RECORDS // EXPORT_ROW_GROUP_SIZE)
+    assert len(chunks) == groups + 1
+    parquet = pq.ParquetFile(BytesIO(b''.join(chunks)))
+    assert parquet.metadata.num_row_groups == groups
+    assert all(parquet.metadata.row_group(g).num_rows <= EXPORT_ROW_GROUP_SIZE for g in range(groups))
+    table = parquet.read()
+    assert table.num_rows == RECORDS
+    for name in ('status', 'check_in_method'):
+        assert pa.types.is_dictionary(table.schema.field(name).type)
+        assert 'RLE_DICTIONARY' in parquet.metadata.row_group(0).column(table.schema.get_field_index(name)).encodings
+    assert pa.types.is_string(table.schema.field('notes').type)
+    assert table.column('status').to_pylist() == expected_statuses
+    assert table.column('id').to_pylist() == list(range(1, RECORDS + 1))
+    first = table.slice(0, 1).to_pylist()[0]
+    assert first['created_at'] == start and first['check_in_time'] == clock(17, 0) and first['free_class'] is True
+    assert first['class_id'] is None and first['notes'] == 'note 0' and first['check_in_method'] == 'qr_code'
+
+    # Audit and belt history
+    audit = pq.read_table(BytesIO(b''.join(download(client, '/reports/export/attendance_audit'))))
+    assert audit.num_rows == len(range(0, RECORDS, 50))
+    assert pa.types.is_dictionary(audit.schema.field('action').type)
+    belts = pq.read_table(BytesIO(b''.join(download(client, '/reports/export/belt_history'))))
+    assert belts.column('belt_level').to_pylist() == ['White', 'Yellow', 'Orange']
+    assert pa.types.is_dictionary(belts.schema.field('belt_level').type)
+
+    # Arrow IPC stream, limited to rows recorded on the first day
+    arrow = pa.ipc.open_stream(b''.join(download(client, '/reports/export/attendance?format=arrow&start=2020-01-01&end=2020-01-01'))).read_all()
+    assert arrow.num_rows == 7 * 60 and arrow.schema == table.schema
+    empty = pq.read_table(BytesIO(b''.join(download(client, '/reports/export/belt_history?start=2030-01-01'))))
+    assert empty.num_rows == 0 and empty.schema == belts.schema
+
+    assert client.get('/reports/export/user').status_code == 404
+    assert client.get('/reports/export/attendance?format=csv').status_code == 400
+    assert client.get('/reports/export/attendance?start=yesterday').status_code == 400
+    student_client = login(app, 'student')
+    assert student_client.get('/reports/export/attendance').status_code == 403
+
+    # The CLI writes the same files
+    output_dir = str(tmp_path / 'export')
+    result = app.test_cli_runner().invoke(args=['export', 'tables', '--start', '2021-01-01', '-o', output_dir])
+    assert result.exit_code == 0, result.output
+    assert sorted(os.listdir(output_dir)) == ['attendance.parquet', 'attendance_audit.parquet', 'belt_history.parquet']
+    assert pq.read_table(os.path.join(output_dir, 'belt_history.parquet')).column('belt_level').to_pylist() == ['Yellow', 'Orange']
+    assert pq.read_table(os.path.join(output_dir, 'attendance.parquet')).num_rows == max(0, RECORDS - 366 * 24 * 60)
+    result = app.test_cli_runner().invoke(args=['export', 'tables', 'attendance', '--format', 'arrow', '-o', output_dir])
+    assert result.exit_code == 0 and pa.ipc.open_stream(open(os.path.join(output_dir, 'attendance.arrows'), 'rb').read()).read_all().num_rows == RECORDS
+    assert app.test_cli_runner().invoke(args=['export', 'tables', 'user', '-o', output_dir]).exit_code != 0
@@ -0,0 +1,80 @@
+"""
+Test script to verify the teacher dashboard query count does not grow with the roster
+
+Seeds throwaway SQLite databases with increasing numbers of students (each with
+belt history and attendance), loads /teacher/home plus the first roster page and
+counts the SQL statements issued. Also walks every roster page to check the
+keyset pagination.
+"""
+
+from app import db
+from app.models import Attendance, BeltHistory
+from app.summary import rebuild_student_summaries
+from datetime import date, datetime, timedelta
+
+BELTS = ['White', 'Yellow', 'Green', 'Purple']
+
+def seed(make_user, student_count):
+    teacher = make_user('teacher', role='teacher', with_password=True)
+    db.session.add(teacher)
+    db.session.flush()
+
+    students = [
+        make_user(f'student{i}', first_name=f'First{i}', last_name=f'Last{i}')
+        for i in range(student_count)
+    ]
+    db.session.add_all(students)
+    db.session.flush()
+
+    for i, student in enumerate(students):
+        for j, belt in enumerate(BELTS[:i % len(BELTS) + 1]):
+            db.session.add(BeltHistory(student_id=student.id, belt_level=belt, date_obtained=date(2024, 1, 1) + timedelta(days=30 * j)))
+        db.session.add(Attendance(
+            student_id=student.id,
+            date=date(2025, 1, 1),
+            status='present',
+            created_by=teacher.id,
+            created_at=datetime(2025, 1, 1, 18, 0) + timedelta(minutes=i)
+        ))
+    db.session.commit()
+    rebuild_student_summaries()
+    return students
+
+def count_dashboard_queries(make_app, make_user, login, sql_statements, student_count):
+    app = make_app()
+    with app.app_context():
+        students = seed(make_user, student_count)
+        expected_belts = {s.id: BELTS[i % 4] for i, s in enumerate(students)}
+        expected_order = [s.id for s in sorted(students, key=lambda s: (f"{s.first_name} {s.last_name}".lower(), s.id))]
+
+        client = login(app, 'teacher')
+        (response, page), statements = sql_statements(
+            db.engine, lambda: (client.get('/teacher/home'), client.get('/teacher/roster').get_json())
+        )
+
+        assert response.status_code == 200
+        assert page['success']
+        for student in page['students']:
+            assert student['belt_level'] == expected_belts[student['id']]
+
+        check_roster_pagination(client, expected_order)
+    return len(statements)
+
+def check_roster_pagination(client, expected_ids):
+    """Walk every page of the name-sorted roster and compare with the expected order"""
+    seen = []
+    cursor = None
+    while True:
+        url = '/teacher/roster?sort=name&limit=37'
+        if cursor:
+            url += f'&cursor={cursor}'
+        page = client.get(url).get_json()
+        seen.extend(student['id'] for student in page['students'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert seen == expected_ids, "Roster pages skipped or repeated students"
+
+def test_dashboard_query_count_is_constant(make_app, make_user, login, sql_statements):
+    counts = [count_dashboard_queries(make_app, make_user, login, sql_statements, n) for n in (10, 100, 1000)]
+    assert len(set(counts)) == 1, f"Query count grew with roster size: {counts}"
@@ -0,0 +1,84 @@
+"""
+Test script to verify profile picture uploads are processed off the request
+
+Generates a 12MP phone-sized JPEG, checks that rendering the derivatives
+decodes it in draft mode at a reduced scale that still covers the largest
+size, uploads it through the route and checks the stored derivatives, and
+checks that uploads over MAX_CONTENT_LENGTH are rejected with 413 (a flash
+and redirect for other forms).
+"""
+
+from io import BytesIO
+from PIL import Image, JpegImagePlugin
+from app import db
+from app.images import (render_picture_variants_from_bytes, process_uploaded_picture,
+                        picture_variant_hashes, PICTURE_SIZES, PICTURE_FORMATS)
+from app.models import User, ImageBlob
+
+def make_12mp_jpeg():
+    """4000x3000 JPEG with enough detail that it does not compress to nothing"""
+    img = Image.effect_mandelbrot((4000, 3000), (-2.0, -1.2, 1.0, 1.2), 100).convert('RGB')
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def test_upload_processing(make_app, make_user, login, monkeypatch):
+    data = make_12mp_jpeg()
+
+    # The decoder downscales while reading, instead of decoding all 12MP
+    decoded_sizes = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+    def recording_draft(img, mode, size):
+        result = draft(img, mode, size)
+        decoded_sizes.append(img.size)
+        return result
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft', recording_draft)
+
+    variants = render_picture_variants_from_bytes(data)
+    assert set(variants) == {f'{size}.{fmt}' for size in PICTURE_SIZES for fmt in PICTURE_FORMATS}
+    for name, (rendered, _) in variants.items():
+        with Image.open(BytesIO(rendered)) as img:
+            assert img.size == PICTURE_SIZES[name.split('.')[0]], f"{name} has the wrong size"
+    largest_width, largest_height = max(PICTURE_SIZES.values())
+    assert len(decoded_sizes) == 1
+    width, height = decoded_sizes[0]
+    assert width * 2 <= 4000 and height * 2 <= 3000, decoded_sizes
+    assert width >= largest_width and height >= largest_height, decoded_sizes
+
+    max_content_length = len(data) + 64 * 1024
+    app = make_app(IMAGE_PROCESS_WORKERS=1, MAX_CONTENT_LENGTH=max_content_length)
+    with app.app_context():
+        student = make_user('student')
+        db.session.add_all([make_user('teacher', role='teacher', with_password=True), student])
+        db.session.commit()
+
+        # Through the pool, the same derivatives as rendering inline
+        assert process_uploaded_picture(data).keys() == variants.keys()
+
+        client = login(app, 'teacher')
+        response = client.post(f'/student/{student.id}/upload_picture', data={
+            'profile_picture': (BytesIO(data), 'cropped.jpg')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 302
+
+        db.session.expire_all()
+        student = db.session.get(User, student.id)
+        assert student.profile_picture_hash is not None
+        hashes = picture_variant_hashes(student.profile_picture_hash)
+        assert len(set(hashes.values())) == len(hashes), "Derivatives were not stored"
+        assert ImageBlob.query.count() == len(hashes)
+
+        too_large = BytesIO(b'\0' * (max_content_length + 1))
+        response = client.post(f'/student/{student.id}/upload_picture', data={
+            'profile_picture': (too_large, 'cropped.jpg')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 413
+        response_message = response.get_json()['message']
+        assert response_message.startswith('Upload is too large')
+
+        # Other forms get the message flashed instead of JSON
+        response = client.post('/add_class', data={'name': 'x' * (max_content_length + 1)},
+                               headers={'Referer': f'/student/{student.id}/calendar'})
+        assert response.status_code == 302 and response.location.endswith(f'/student/{student.id}/calendar')
+        with client.session_transaction() as session:
+            assert session['_flashes'][-1] == ('danger', response_message)
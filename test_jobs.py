@@ -0,0 +1,195 @@
+"""
+Test script to verify the background job queue and worker
+
+Queues badge sheet, CSV and Parquet jobs through the web routes on a
+throwaway SQLite database, then runs `flask jobs worker --burst` with a
+process pool. Checks that every job ends with the same file the synchronous
+routes produce, stored in the database and downloadable once done. Also checks that a handler's error
+and a pool process dying fail only their own job, that jobs running alongside
+a pool process killed from outside are run again one at a time and finish,
+that two claims never get
+the same job, that progress writes are throttled, that another teacher cannot
+see or download a job, and that requeue and prune behave.
+"""
+
+import os
+import signal
+import threading
+import time
+from datetime import date, datetime, timedelta
+from io import BytesIO
+import pyarrow.parquet as pq
+from app import db
+from app.models import Attendance, Job, JobResultChunk, get_pacific_datetime
+from app.jobs import job_handler, claim_next_job, beat_jobs, submit_job, _finish_job, JobProgress, JobResult, JOB_HANDLERS
+
+STUDENTS = 30
+DAYS = 90
+
+@job_handler('crash')
+def crash_job(params, progress, output):
+    # Stands in for a pool process killed mid-job (out of memory, say)
+    os._exit(1)
+
+@job_handler('wait_to_be_killed')
+def wait_to_be_killed_job(params, progress, output):
+    # The first run leaves its pid for the test to kill, and waits; the run after that finishes at once
+    pid_file = os.path.join(params['dir'], f"{params['name']}.pid")
+    if not os.path.exists(pid_file):
+        with open(pid_file, 'w') as f:
+            f.write(str(os.getpid()))
+        time.sleep(30)
+    output.write(params['name'].encode())
+    return JobResult(f"{params['name']}.txt", 'text/plain')
+
+def test_background_jobs(make_app, make_user, login, monkeypatch):
+    # Small chunks, so every result is stored in several (the pool processes are forked and see this)
+    monkeypatch.setattr('app.jobs.JOB_RESULT_CHUNK_SIZE', 4096)
+    app = make_app(JOB_WORKERS=2, JOB_POLL_INTERVAL=0.05)
+    start = date(2025, 1, 1)
+    end = start + timedelta(days=DAYS - 1)
+    with app.app_context():
+        teacher = make_user('teacher', role='teacher', with_password=True)
+        db.session.add(make_user('other_teacher', role='teacher', with_password=True))
+        students = [make_user(f'student{i}', first_name='Student', last_name=f'{i:02d}') for i in range(STUDENTS)]
+        db.session.add_all([teacher] + students)
+        db.session.flush()
+        db.session.execute(db.insert(Attendance), [
+            {'student_id': student.id, 'date': start + timedelta(days=day), 'status': 'present', 'free_class': False,
+             'created_by': teacher.id, 'created_at': datetime.combine(start + timedelta(days=day), datetime.min.time()) + timedelta(hours=17)}
+            for student in students for day in range(0, DAYS, 2)
+        ])
+        students[0].set_password('password123')
+        db.session.commit()
+
+    client = login(app, 'teacher')
+
+    # Queue work from the web: POST /jobs answers at once, and GETs never queue anything
+    csv_url = f'/reports/attendance.csv?start={start}&end={end}'
+    assert client.get(csv_url + '&background=1').status_code == 200
+    with app.app_context():
+        assert Job.query.count() == 0
+    badge_job = client.post('/jobs', json={'kind': 'badge_sheet', 'params': {'download_name': 'badges_all.pdf'}})
+    assert badge_job.status_code == 202
+    csv_job = client.post('/jobs', json={'kind': 'attendance_csv', 'params': {'start': str(start), 'end': str(end)}})
+    assert csv_job.status_code == 202
+    queued = client.post('/jobs', json={'kind': 'table_export', 'params': {'table': 'attendance'}})
+    assert queued.status_code == 202
+    status_url = queued.get_json()['status_url']
+    bad_range = client.post('/jobs', json={'kind': 'attendance_csv', 'params': {'start': str(end), 'end': str(start)}}).get_json()['job']
+    assert client.post('/jobs', json={'kind': 'crash'}).status_code == 202
+    assert client.post('/jobs', json={'kind': 'shell'}).status_code == 400
+    assert client.post('/jobs', json={'kind': 'attendance_csv', 'params': [1]}).status_code == 400
+
+    status = client.get(status_url).get_json()
+    assert status['status'] == 'queued' and status['progress'] == 0 and 'download_url' not in status
+    assert client.get(f"/jobs/{status['id']}/download").status_code == 409
+
+    # The worker runs everything queued, in pool processes, then exits
+    result = app.test_cli_runner().invoke(args=['jobs', 'worker', '--burst'])
+    assert result.exit_code == 0, result.output
+    assert 'Ran 5 jobs.' in result.output, result.output
+
+    with app.app_context():
+        jobs = {job.kind if job.kind != 'attendance_csv' or job.id != bad_range['id'] else 'bad_range': job for job in Job.query.all()}
+        assert {kind: job.status for kind, job in jobs.items()} == {
+            'badge_sheet': 'done', 'attendance_csv': 'done', 'table_export': 'done', 'bad_range': 'failed', 'crash': 'failed'
+        }
+        assert jobs['bad_range'].error == 'Invalid date range'
+        assert jobs['crash'].error == 'The job process exited unexpectedly'
+        assert all(job.progress == 100 and job.started_at <= job.finished_at for job in jobs.values() if job.status == 'done')
+        job_ids = {kind: job.id for kind, job in jobs.items()}
+        # Results are stored in chunks; failed jobs, including the one cut off, have none
+        chunked = {job_id for (job_id,) in db.session.query(JobResultChunk.job_id).distinct()}
+        assert chunked == {jobs[kind].id for kind in ('badge_sheet', 'attendance_csv', 'table_export')}
+        assert db.session.query(JobResultChunk).filter_by(job_id=jobs['attendance_csv'].id).count() > 1
+        csv_size = jobs['attendance_csv'].result_size
+
+    # Results match what the routes stream directly
+    download = client.get(f"/jobs/{job_ids['attendance_csv']}/download")
+    assert download.is_streamed
+    assert download.headers['Content-Disposition'] == f'attachment; filename=attendance_{start}_{end}.csv'
+    assert download.data == client.get(csv_url).data
+    assert int(download.headers['Content-Length']) == csv_size == len(download.data)
+    assert download.data.count(b'\n') == 1 + STUDENTS * len(range(0, DAYS, 2))
+    badges = client.get(f"/jobs/{job_ids['badge_sheet']}/download")
+    assert badges.mimetype == 'application/pdf' and badges.data.startswith(b'%PDF')
+    assert badges.headers['Content-Disposition'] == 'attachment; filename=badges_all.pdf'
+    parquet = client.get(client.get(status_url).get_json()['download_url'])
+    assert pq.read_table(BytesIO(parquet.data)).num_rows == STUDENTS * len(range(0, DAYS, 2))
+
+    page = client.get('/jobs').get_data(as_text=True)
+    assert f"/jobs/{job_ids['attendance_csv']}/download" in page and 'Invalid date range' in page
+
+    # Another teacher's jobs are not found
+    other_client = login(app, 'other_teacher')
+    assert other_client.get(status_url).status_code == 404
+    assert other_client.get(f"/jobs/{job_ids['attendance_csv']}/download").status_code == 404
+    assert f"/jobs/{job_ids['attendance_csv']}" not in other_client.get('/jobs').get_data(as_text=True)
+
+    with app.app_context():
+        # Two claims never get the same job
+        for _ in range(2):
+            db.session.add(Job(kind='attendance_csv', params='{}', created_by=1))
+        db.session.commit()
+        first, second = claim_next_job('a:1'), claim_next_job('b:2')
+        assert first != second and None not in (first, second) and claim_next_job('c:3') is None
+        # Progress is written on its own connection, at most once a JOB_PROGRESS_INTERVAL
+        progress = JobProgress(second)
+        progress(1, 4)
+        progress(3, 4)
+        assert db.session.get(Job, second).progress == 25
+        # A job left running by a killed worker is queued again; one that is slow but still beating is not
+        for job_id in (first, second):
+            db.session.get(Job, job_id).started_at = get_pacific_datetime() - timedelta(hours=3)
+            db.session.get(Job, job_id).heartbeat_at = get_pacific_datetime() - timedelta(hours=3)
+        db.session.commit()
+        beat_jobs([first, second], 'b:2')
+    result = app.test_cli_runner().invoke(args=['jobs', 'requeue'])
+    assert f'Job {first} queued again' in result.output and 'Requeued 1 jobs.' in result.output
+    with app.app_context():
+        assert db.session.get(Job, first).status == 'queued' and db.session.get(Job, first).heartbeat_at is None
+        assert db.session.get(Job, second).status == 'running'
+        # The worker that lost the job can no longer record a result for it
+        _finish_job(first, 'a:1', BytesIO(b'stale'), status='done', result_size=5)
+        assert db.session.get(Job, first).status == 'queued' and not JobResultChunk.query.filter_by(job_id=first).count()
+    result = app.test_cli_runner().invoke(args=['jobs', 'prune', '--days', '0'])
+    assert 'Deleted 5 jobs.' in result.output
+    with app.app_context():
+        assert Job.query.count() == 2 and JobResultChunk.query.count() == 0
+
+    student_client = login(app, 'student0')
+    assert student_client.post('/jobs', json={'kind': 'table_export'}).status_code == 403
+    assert student_client.get(status_url).status_code == 403
+
+    del JOB_HANDLERS['crash']
+
+def test_killed_pool_process(make_app, make_user, tmp_path):
+    app = make_app(JOB_WORKERS=2, JOB_POLL_INTERVAL=0.05)
+    with app.app_context():
+        teacher = make_user('teacher', role='teacher')
+        db.session.add(teacher)
+        db.session.commit()
+        job_ids = [submit_job('wait_to_be_killed', {'dir': str(tmp_path), 'name': name}, teacher.id).id
+                   for name in ('first', 'second')]
+
+    def kill_first():
+        # Once both jobs are running, kill the first one's process as the OOM killer would
+        pid_files = [tmp_path / f'{name}.pid' for name in ('first', 'second')]
+        deadline = time.monotonic() + 20
+        while not all(path.exists() and path.read_text() for path in pid_files) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        os.kill(int(pid_files[0].read_text()), signal.SIGKILL)
+
+    killer = threading.Thread(target=kill_first)
+    killer.start()
+    started = time.monotonic()
+    result = app.test_cli_runner().invoke(args=['jobs', 'worker', '--burst'])
+    killer.join()
+    assert result.exit_code == 0, result.output
+    # Both jobs were lost with the pool, queued again and each run alone, so neither waited out its sleep
+    assert 'Ran 2 jobs.' in result.output and time.monotonic() - started < 20
+    with app.app_context():
+        jobs = [db.session.get(Job, job_id) for job_id in job_ids]
+        assert [job.status for job in jobs] == ['done', 'done'], [job.error for job in jobs]
+    del JOB_HANDLERS['wait_to_be_killed']
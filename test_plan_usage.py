@@ -0,0 +1,106 @@
+"""
+Test script to verify incremental plan usage counters
+
+Marks attendance through the single, bulk and scan routes on a throwaway
+SQLite database, toggles free_class and moves dates through the edit route,
+changes and renews plans, and checks after every step that each Plan
+counter (and its copy on StudentSummary) matches a recount of the
+attendance rows. Checks that reading the
+remaining classes does not touch the attendance table, and that
+`flask summary reconcile` finds and fixes a counter that drifted.
+"""
+
+from datetime import timedelta
+from app import db
+from app.models import User, Attendance, StudentSummary, Plan, get_pacific_date
+from app.summary import count_plan_attendance
+
+def counter_matches(app, student_ids):
+    """{student_id: current plan's counter}, after checking every plan against a recount"""
+    with app.app_context():
+        plans = Plan.query.filter(Plan.student_id.in_(student_ids)).all()
+        actual = count_plan_attendance([plan.id for plan in plans])
+        for plan in plans:
+            assert plan.attended_count == actual[plan.id], (plan.id, plan.attended_count, actual)
+        current = {}
+        for student in User.query.filter(User.id.in_(student_ids)).all():
+            plan = student.current_plan()
+            current[student.id] = plan.attended_count if plan else 0
+            assert db.session.get(StudentSummary, student.id).plan_attended_count == current[student.id]
+        return current
+
+def test_plan_usage_counters(make_app, make_user, login, sql_statements):
+    app = make_app(SCAN_DEDUPE_SECONDS=0)
+    with app.app_context():
+        teacher = make_user('teacher', role='teacher', with_password=True)
+        today = get_pacific_date()
+        students = [make_user(f'student{i}', first_name='Student', last_name=str(i)) for i in range(3)]
+        db.session.add_all([teacher] + students)
+        db.session.flush()
+        for student in students:
+            plan = Plan(student_id=student.id, program='3 months', plan='Basic', classes=20,
+                        effective_from=today - timedelta(days=10))
+            plan.set_window()
+            db.session.add(plan)
+        db.session.commit()
+        student_ids = [student.id for student in students]
+        plan_ids = [student.current_plan().id for student in students]
+        qr_data = students[0].generate_qr_code_data()
+        engine = db.engine
+
+    client = login(app, 'teacher')
+
+    # Scan, single and bulk marking each count one class
+    assert client.post('/mark_attendance', json={'qr_data': qr_data}).get_json()['success']
+    client.post('/mark_attendance', data={'student_id': student_ids[0], 'date': str(today - timedelta(days=1)), 'status': 'present'})
+    client.post('/mark_attendance', data={
+        'date': str(today - timedelta(days=2)),
+        **{f'status_{student_id}': 'present' for student_id in student_ids}
+    })
+    assert counter_matches(app, student_ids) == {student_ids[0]: 3, student_ids[1]: 1, student_ids[2]: 1}
+
+    # Remaining classes are read from the counter
+    remaining_url = f'/student/{student_ids[0]}/plan/{plan_ids[0]}/remaining'
+    response, statements = sql_statements(engine, lambda: client.get(remaining_url), match=('FROM attendance',))
+    assert response.get_json()['remaining'] == 17 and response.get_json()['attended'] == 3
+    assert not statements, statements
+
+    # Free class toggles move the counter both ways; date edits leave it alone
+    with app.app_context():
+        attendance_id = Attendance.query.filter_by(student_id=student_ids[0], date=today).first().id
+    client.put(f'/attendance/{attendance_id}/edit', json={'free_class': True})
+    assert counter_matches(app, student_ids)[student_ids[0]] == 2
+    client.put(f'/attendance/{attendance_id}/edit', json={'free_class': True})
+    assert counter_matches(app, student_ids)[student_ids[0]] == 2
+    client.put(f'/attendance/{attendance_id}/edit', json={'free_class': False})
+    assert counter_matches(app, student_ids)[student_ids[0]] == 3
+    client.put(f'/attendance/{attendance_id}/edit', json={'date': str(today - timedelta(days=30))})
+    assert counter_matches(app, student_ids)[student_ids[0]] == 3
+
+    # Moving a plan to start tomorrow recounts it; a renewal starts its own count and keeps the old plan
+    client.put(f'/student/{student_ids[1]}/plan/{plan_ids[1]}', json={'effective_from': str(today + timedelta(days=1))})
+    assert counter_matches(app, student_ids)[student_ids[1]] == 0
+    renewal = client.post(f'/student/{student_ids[2]}/plan', json={
+        'program': '3 months', 'plan': 'Basic', 'classes': '20', 'effective_from': str(today - timedelta(days=1))
+    }).get_json()
+    assert renewal['success'] and renewal['plan']['attended'] == 1
+    client.post('/mark_attendance', data={'student_id': student_ids[2], 'date': str(today), 'status': 'present'})
+    assert counter_matches(app, student_ids)[student_ids[2]] == 2
+    with app.app_context():
+        assert db.session.get(Plan, plan_ids[2]).attended_count == 2  # Overlapping windows both count
+    client.delete(f'/student/{student_ids[2]}/plan/{renewal["plan"]["id"]}')
+    assert counter_matches(app, student_ids)[student_ids[2]] == 2
+    client.delete(f'/student/{student_ids[2]}/plan/{plan_ids[2]}')
+    assert counter_matches(app, student_ids)[student_ids[2]] == 0
+
+    # Reconciliation fixes drift and leaves correct counters alone
+    with app.app_context():
+        db.session.get(Plan, plan_ids[0]).attended_count = 99
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['summary', 'reconcile'])
+    assert result.exit_code == 0, result.output
+    assert f'Plan {plan_ids[0]}: plan usage 99 -> 3' in result.output
+    assert 'Corrected 1 plan usage counters.' in result.output
+    counter_matches(app, student_ids)
+    result = app.test_cli_runner().invoke(args=['summary', 'reconcile'])
+    assert 'Corrected 0 plan usage counters.' in result.output
@@ -0,0 +1,125 @@
+"""
+Test script to verify plan history and the bulk remaining-classes query
+
+Gives students current, expired, upcoming and unknown-length plans on a
+throwaway SQLite database. Checks that renewals keep earlier plans, that the
+User plan columns follow the current plan, that adding a student with a plan
+creates a Plan row, and that /teacher/plans/remaining lists every student
+with an active plan once, with the right remaining classes, in a fixed number
+of queries however many students there are.
+"""
+
+import os
+from datetime import datetime, timedelta
+from app import db
+from app.models import User, Attendance, Plan, get_pacific_date
+from app.summary import reconcile_plan_usage
+
+STUDENTS = int(os.environ.get('BENCH_PLAN_STUDENTS', 300))
+
+def add_plan(student_id, effective_from, program='3 months', classes=20):
+    plan = Plan(student_id=student_id, program=program, plan='1/week', classes=classes, effective_from=effective_from)
+    plan.set_window()
+    db.session.add(plan)
+    return plan
+
+def test_plan_history_and_bulk_remaining(make_app, make_user, login, sql_statements):
+    app = make_app()
+    today = get_pacific_date()
+    with app.app_context():
+        teacher = make_user('teacher', role='teacher', with_password=True)
+        students = [make_user(f'student{i}', first_name='Student', last_name=f'{i:04d}') for i in range(STUDENTS)]
+        db.session.add_all([teacher] + students)
+        db.session.flush()
+        for i, student in enumerate(students):
+            # Student i has used i % 25 of 20 classes on a plan that started 30 days ago
+            add_plan(student.id, today - timedelta(days=30))
+            started = datetime.combine(today - timedelta(days=29), datetime.min.time()) + timedelta(hours=18)
+            db.session.add_all([
+                Attendance(student_id=student.id, date=(started + timedelta(days=day)).date(), status='present',
+                           created_by=teacher.id, free_class=False, created_at=started + timedelta(days=day))
+                for day in range(i % 25)
+            ])
+        # Not active today: expired, upcoming and unknown program length
+        add_plan(students[0].id, today - timedelta(days=400))
+        add_plan(students[1].id, today + timedelta(days=10))
+        add_plan(students[2].id, today - timedelta(days=5), program='2 weeks')
+        db.session.commit()
+        reconcile_plan_usage()
+        student_ids = [student.id for student in students]
+        engine = db.engine
+
+    client = login(app, 'teacher')
+
+    # Every active plan, fewest classes left first
+    response, statements = sql_statements(engine, lambda: client.get('/teacher/plans/remaining'))
+    plans = response.get_json()['plans']
+    assert len(plans) == STUDENTS
+    by_student = {plan['student_id']: plan for plan in plans}
+    for i, student_id in enumerate(student_ids):
+        assert by_student[student_id]['attended'] == i % 25
+        assert by_student[student_id]['remaining'] == max(0, 20 - i % 25)
+    assert [plan['remaining'] for plan in plans] == sorted(plan['remaining'] for plan in plans)
+
+    # Renewal follow-ups: five or fewer classes left
+    due = client.get('/teacher/plans/remaining?max_remaining=5').get_json()['plans']
+    assert {plan['student_id'] for plan in due} == {
+        student_id for i, student_id in enumerate(student_ids) if 20 - i % 25 <= 5
+    }
+    assert all(plan['calendar_url'].endswith(f"/student/{plan['student_id']}/calendar") for plan in due)
+
+    # Same number of queries with a fraction of the students
+    with app.app_context():
+        Plan.query.filter(Plan.student_id.in_(student_ids[10:])).delete(synchronize_session=False)
+        db.session.commit()
+    response, few_statements = sql_statements(engine, lambda: client.get('/teacher/plans/remaining'))
+    assert len(response.get_json()['plans']) == 10
+    assert len(few_statements) == len(statements), (few_statements, statements)
+
+    # A renewal adds a plan and keeps the old one; the User columns follow the current plan
+    student_id = student_ids[5]
+    renewal = client.post(f'/student/{student_id}/plan', json={
+        'program': '6 months', 'plan': '2/week', 'classes': '96', 'effective_from': str(today)
+    }).get_json()
+    assert renewal['success'] and renewal['plan']['effective_to'] == str(today + timedelta(days=180))
+    history = client.get(f'/student/{student_id}/plan').get_json()['plans']
+    assert [plan['id'] for plan in history][0] == renewal['plan']['id'] and len(history) == 2
+    assert history[1]['attended'] == 5
+    with app.app_context():
+        student = db.session.get(User, student_id)
+        assert (student.program, student.plan, student.classes, student.effective_from) == ('6 months', '2/week', '96', today)
+    usage = client.get(f'/student/{student_id}/profile?fields=plan_usage').get_json()['plan_usage']
+    assert usage['plan_id'] == renewal['plan']['id'] and usage['total'] == 96
+    # Both plans are active today; the student is listed once, for the renewal
+    listed = [plan for plan in client.get('/teacher/plans/remaining').get_json()['plans'] if plan['student_id'] == student_id]
+    assert [plan['plan_id'] for plan in listed] == [renewal['plan']['id']] and listed[0]['remaining'] == 96
+
+    # Editing and deleting act on the plan named, not "the" plan
+    old_plan_id = history[1]['id']
+    assert client.put(f'/student/{student_id}/plan/{old_plan_id}', json={'classes': '48'}).get_json()['success']
+    assert client.get(f'/student/{student_id}/plan/{old_plan_id}/remaining').get_json()['remaining'] == 43
+    assert client.put(f'/student/{student_id}/plan/{old_plan_id}', json={'classes': 'lots'}).status_code == 400
+    assert client.delete(f'/student/{student_ids[6]}/plan/{old_plan_id}').status_code == 404
+    assert client.delete(f'/student/{student_id}/plan/{renewal["plan"]["id"]}').get_json()['success']
+    with app.app_context():
+        assert db.session.get(User, student_id).classes == '48'
+    assert client.post(f'/student/{student_id}/plan', json={'program': '3 months'}).status_code == 400
+
+    # Adding a student with a plan creates the Plan row
+    client.post('/teacher/add_student', data={
+        'username': 'newstudent', 'email': 'new@example.com', 'first_name': 'New', 'last_name': 'Student',
+        'password': 'password123', 'confirm_password': 'password123', 'program': '1 year', 'plan': '1/week',
+        'classes': '48', 'effective_from': str(today)
+    })
+    with app.app_context():
+        student = User.query.filter_by(username='newstudent').first()
+        plan = student.current_plan()
+        assert plan.classes == 48 and plan.effective_to == today + timedelta(days=365)
+        assert student.effective_to == plan.effective_to
+
+    # Students cannot list plans
+    with app.app_context():
+        db.session.get(User, student_ids[0]).set_password('password123')
+        db.session.commit()
+    student_client = login(app, 'student0')
+    assert student_client.get('/teacher/plans/remaining').status_code == 403
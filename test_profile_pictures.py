@@ -0,0 +1,162 @@
+"""
+Test script to verify content-addressed profile pictures and their HTTP caching
+
+Stores a student's picture as an ImageBlob on a throwaway SQLite database and
+checks that /images/<sha256> is served with a strong ETag and immutable
+caching, that /profile_picture/<id> is revalidated on every use, and that a
+matching If-None-Match gets a 304. Also takes the database back to before
+the image_blob migration, stores pictures base64-encoded in the user row as
+they used to be, upgrades again and checks the same bytes are served.
+Finally checks that ?size= and ?format= pick a picture's derivative, that
+`flask images derive` fills them in for older pictures, and that replacing a
+picture only deletes the blobs nothing else uses.
+"""
+
+import os
+import base64
+import hashlib
+from io import BytesIO
+from flask_migrate import downgrade, stamp, upgrade
+from PIL import Image
+from app import db
+from app.images import (
+    store_image, store_picture_variants, release_image, render_picture_variants_from_bytes,
+    variant_name, PICTURE_SIZES, PICTURE_FORMATS, PRIMARY_VARIANT
+)
+from app.models import User, ImageBlob, ImageVariant
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+BEFORE_IMAGE_BLOBS = '6e2f0b8c4d17'
+
+def sample_jpeg(color):
+    buffer = BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def test_image_caching_headers(make_app, make_user, login):
+    app = make_app()
+    data = sample_jpeg('red')
+    sha256 = hashlib.sha256(data).hexdigest()
+    with app.app_context():
+        student = make_user('student', profile_picture_hash=store_image(data))
+        db.session.add_all([make_user('teacher', role='teacher', with_password=True), student])
+        db.session.commit()
+        student_id = student.id
+    client = login(app, 'teacher')
+
+    # By hash: a strong ETag and cached for a year without revalidation
+    response = client.get(f'/images/{sha256}')
+    assert response.status_code == 200 and response.data == data
+    assert response.mimetype == 'image/jpeg'
+    assert response.headers['ETag'] == f'"{sha256}"'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    revalidated = client.get(f'/images/{sha256}', headers={'If-None-Match': f'"{sha256}"'})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+    assert revalidated.headers['ETag'] == f'"{sha256}"'
+    assert revalidated.headers['Cache-Control'] == response.headers['Cache-Control']
+    assert client.get(f'/images/{sha256}', headers={'If-None-Match': '"other"'}).status_code == 200
+    assert client.get(f"/images/{'0' * 64}").status_code == 404
+
+    # By student: the picture can change, so clients revalidate and get a 304 while it has not
+    response = client.get(f'/profile_picture/{student_id}')
+    assert response.status_code == 200 and response.data == data
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+    assert client.get(f'/profile_picture/{student_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        db.session.get(User, student_id).profile_picture_hash = store_image(sample_jpeg('blue'))
+        db.session.commit()
+    changed = client.get(f'/profile_picture/{student_id}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+def test_base64_pictures_are_migrated(make_app, make_user, login):
+    app = make_app()
+    pictures = {'first': sample_jpeg('red'), 'second': sample_jpeg('red'), 'third': sample_jpeg('green')}
+    with app.app_context():
+        db.session.add(make_user('teacher', role='teacher', with_password=True))
+        db.session.add_all([make_user(username) for username in pictures])
+        db.session.add(make_user('without'))
+        db.session.commit()
+        # The tables were created at the current schema; step back to when pictures were base64
+        stamp(directory=MIGRATIONS)
+        downgrade(directory=MIGRATIONS, revision=BEFORE_IMAGE_BLOBS)
+        for username, data in pictures.items():
+            db.session.execute(
+                db.text('UPDATE user SET profile_picture_data = :data WHERE username = :username'),
+                {'data': base64.b64encode(data).decode('utf-8'), 'username': username}
+            )
+        db.session.commit()
+        upgrade(directory=MIGRATIONS)
+
+        # Students sharing a picture share its blob
+        assert ImageBlob.query.count() == 2
+        users = {user.username: user for user in User.query.all()}
+        assert users['first'].profile_picture_hash == users['second'].profile_picture_hash
+        assert users['without'].profile_picture_hash is None
+        student_ids = {username: users[username].id for username in pictures}
+
+    client = login(app, 'teacher')
+    for username, data in pictures.items():
+        response = client.get(f'/profile_picture/{student_ids[username]}')
+        assert response.status_code == 200 and response.data == data
+        sha256 = hashlib.sha256(data).hexdigest()
+        assert response.headers['ETag'] == f'"{sha256}"'
+        assert client.get(f'/images/{sha256}').data == data
+
+def test_picture_derivatives(make_app, make_user, login):
+    app = make_app(IMAGE_PROCESS_WORKERS=0)
+    with app.app_context():
+        variants = render_picture_variants_from_bytes(sample_jpeg('red'))
+        # Stored before derivatives existed: only the primary image, at 150x200
+        legacy_data = render_picture_variants_from_bytes(sample_jpeg('green'))[PRIMARY_VARIANT][0]
+        student = make_user('student', profile_picture_hash=store_picture_variants(variants))
+        legacy = make_user('legacy', profile_picture_hash=store_image(legacy_data))
+        db.session.add_all([make_user('teacher', role='teacher', with_password=True), student, legacy])
+        db.session.commit()
+        student_id, legacy_id = student.id, legacy.id
+    client = login(app, 'teacher')
+
+    # ?size= and ?format= pick the derivative; medium JPEG by default
+    for size, dimensions in PICTURE_SIZES.items():
+        for image_format, content_type in PICTURE_FORMATS.items():
+            response = client.get(f'/profile_picture/{student_id}?size={size}&format={image_format}')
+            assert response.status_code == 200
+            assert response.data == variants[variant_name(size, image_format)][0]
+            assert response.mimetype == content_type
+            assert Image.open(BytesIO(response.data)).size == dimensions
+    assert client.get(f'/profile_picture/{student_id}').data == variants[PRIMARY_VARIANT][0]
+    assert client.get(f'/profile_picture/{student_id}?size=huge').status_code == 400
+    assert client.get(f'/profile_picture/{student_id}?format=gif').status_code == 400
+
+    # Older pictures fall back to the primary image until their derivatives are rendered
+    assert client.get(f'/profile_picture/{legacy_id}?size=thumb&format=webp').data == legacy_data
+    result = app.test_cli_runner().invoke(args=['images', 'derive'])
+    assert result.exit_code == 0 and 'Rendered derivatives for 1 pictures.' in result.output
+    thumb = client.get(f'/profile_picture/{legacy_id}?size=thumb&format=webp')
+    assert thumb.mimetype == 'image/webp' and Image.open(BytesIO(thumb.data)).size == PICTURE_SIZES['thumb']
+    assert client.get(f'/profile_picture/{legacy_id}?format=webp').mimetype == 'image/webp'
+    # Never scaled up past the stored picture
+    assert client.get(f'/profile_picture/{legacy_id}?size=large').data == legacy_data
+    assert client.get(f'/profile_picture/{legacy_id}').data == legacy_data
+    result = app.test_cli_runner().invoke(args=['images', 'derive'])
+    assert 'Rendered derivatives for 0 pictures.' in result.output
+
+    with app.app_context():
+        # Another student's picture happens to be the same bytes as one of the student's derivatives
+        thumb_hash = store_image(*variants['thumb.jpeg'])
+        db.session.get(User, legacy_id).profile_picture_hash = thumb_hash
+        student = db.session.get(User, student_id)
+        old_hash, student.profile_picture_hash = student.profile_picture_hash, store_image(sample_jpeg('blue'))
+        old_hashes = {variant.sha256 for variant in ImageVariant.query.filter_by(source_sha256=old_hash)}
+        release_image(old_hash)
+        db.session.commit()
+
+        assert ImageVariant.query.filter_by(source_sha256=old_hash).count() == 0
+        remaining = {blob.sha256 for blob in ImageBlob.query.filter(ImageBlob.sha256.in_(old_hashes))}
+        assert remaining == {thumb_hash}
+        # Still referenced pictures are left alone
+        release_image(thumb_hash)
+        db.session.commit()
+        assert db.session.get(ImageBlob, thumb_hash) is not None
+    assert client.get(f'/profile_picture/{legacy_id}').data == variants['thumb.jpeg'][0]
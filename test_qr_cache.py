@@ -0,0 +1,89 @@
+"""
+Test script to verify QR scans resolve students from the in-process cache
+
+Scans students through /mark_attendance on a throwaway SQLite database, checks
+that repeat scans issue no user lookup, that the cache stays within
+QR_CACHE_SIZE, and that changing, regenerating or deleting a student's QR code
+drops the cached entry, and that hot students keep hitting the cache.
+"""
+
+import uuid
+from app import db
+from app.models import Attendance, AttendanceAudit, StudentSummary
+from app.qr_cache import qr_cache
+
+QR_CACHE_SIZE = 5
+
+def scan(client, student):
+    return client.post('/mark_attendance', json={'qr_data': student.generate_qr_code_data()})
+
+def clear_attendance():
+    AttendanceAudit.query.delete()
+    Attendance.query.delete()
+    db.session.commit()
+
+def test_qr_cache(make_app, make_user, login, sql_statements):
+    # Repeat scans here must reach the lookup
+    app = make_app(QR_CACHE_SIZE=QR_CACHE_SIZE, SCAN_DEDUPE_SECONDS=0)
+    with app.app_context():
+        students = [make_user(f'student{i}', first_name=f'First{i}', last_name=f'Last{i}') for i in range(10)]
+        db.session.add(make_user('teacher', role='teacher', with_password=True))
+        db.session.add_all(students)
+        db.session.commit()
+
+        client = login(app, 'teacher')
+
+        def user_lookups(func):
+            """Run func and return the number of statements that look a user up by QR code"""
+            result, statements = sql_statements(db.engine, func, match=('uq_user_qr_code_id =',))
+            return result, len(statements)
+
+        # The first scan loads the student, the repeat scan is served from the cache
+        student = students[0]
+        response, lookups = user_lookups(lambda: scan(client, student))
+        assert response.get_json()['student_name'] == 'First0 Last0'
+        assert lookups == 1
+        clear_attendance()
+        response, lookups = user_lookups(lambda: scan(client, student))
+        assert response.get_json()['student_name'] == 'First0 Last0'
+        assert lookups == 0
+        assert qr_cache.stats()['hits'] == 1
+
+        # Renaming a student drops the entry so the new name is shown
+        student.first_name = 'Renamed'
+        db.session.commit()
+        clear_attendance()
+        assert scan(client, student).get_json()['student_name'] == 'Renamed Last0'
+
+        # A regenerated QR code stops resolving under the old id straight away
+        old_qr_data = student.generate_qr_code_data()
+        student.qr_code_id = str(uuid.uuid4())
+        db.session.commit()
+        assert client.post('/mark_attendance', json={'qr_data': old_qr_data}).status_code == 404
+        clear_attendance()
+        assert scan(client, student).status_code == 200
+
+        # Deleted students are dropped too
+        deleted = students[1]
+        scan(client, deleted)
+        deleted_qr_data = deleted.generate_qr_code_data()
+        clear_attendance()
+        StudentSummary.query.filter_by(student_id=deleted.id).delete()
+        db.session.delete(deleted)
+        db.session.commit()
+        assert client.post('/mark_attendance', json={'qr_data': deleted_qr_data}).status_code == 404
+
+        # The cache never holds more than QR_CACHE_SIZE entries
+        clear_attendance()
+        for other in students[2:]:
+            scan(client, other)
+        stats = client.get('/teacher/qr_cache_stats').get_json()
+        assert stats['size'] <= QR_CACHE_SIZE
+
+        # Hot students keep hitting the cache
+        for _ in range(20):
+            clear_attendance()
+            _, lookups = user_lookups(lambda: scan(client, students[9]))
+            assert lookups == 0, "Cached scan still looked the student up"
+        stats = client.get('/teacher/qr_cache_stats').get_json()
+        assert stats['hits'] > stats['misses'] and stats['max_size'] == QR_CACHE_SIZE
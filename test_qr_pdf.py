@@ -0,0 +1,53 @@
+"""
+Test script to verify QR code PDFs are rendered once and served from memory
+
+Downloads a student's QR PDF (both the student's own page and the teacher's
+print page) repeatedly on a throwaway SQLite database and checks that repeat
+downloads come from the PDF cache without touching the temp directory, that
+reissuing or renaming the student produces a fresh PDF, and that the PDF
+contains the QR image.
+"""
+
+import os
+import tempfile
+from app import db
+from app.models import User
+from app.qr_pdf import qr_pdf_cache_info
+
+def test_qr_pdf_cache(make_app, make_user, login):
+    app = make_app()
+    with app.app_context():
+        student = make_user('student', with_password=True)
+        db.session.add_all([make_user('teacher', role='teacher', with_password=True), student])
+        db.session.commit()
+        student_id = student.id
+
+    # Requests run outside the setup context so each client gets its own logged-in user
+    teacher_client = login(app, 'teacher')
+    student_client = login(app, 'student')
+
+    temp_files_before = set(os.listdir(tempfile.gettempdir()))
+    print_url = f'/teacher/print_student_qr/{student_id}'
+    first = teacher_client.get(print_url)
+    assert first.status_code == 200 and first.mimetype == 'application/pdf'
+    assert first.data.startswith(b'%PDF') and b'/Subtype /Image' in first.data
+    assert teacher_client.get(print_url).data == first.data
+
+    own = student_client.get('/student/qr_code')
+    own_again = student_client.get('/student/qr_code')
+    assert own.status_code == 200 and own.data == own_again.data and own.data != first.data
+
+    info = qr_pdf_cache_info()
+    assert (info.hits, info.misses) == (2, 2), info
+    assert set(os.listdir(tempfile.gettempdir())) == temp_files_before, "PDF rendering touched the temp directory"
+
+    # A reissued code or a new name is rendered afresh
+    teacher_client.post(f'/student/{student_id}/rotate_qr')
+    reissued = teacher_client.get(print_url)
+    assert reissued.data != first.data
+    with app.app_context():
+        db.session.get(User, student_id).first_name = 'Renamed'
+        db.session.commit()
+    renamed = teacher_client.get(print_url)
+    assert renamed.data != reissued.data
+    assert qr_pdf_cache_info().misses == 4
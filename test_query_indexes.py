@@ -0,0 +1,84 @@
+"""
+Test script to verify the hot route queries are served by indexes
+
+Runs EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (Postgres) on the queries issued by
+the dashboard, attendance marking, plan and report routes and fails if any of
+them falls back to a sequential scan. Uses a throwaway SQLite database unless
+TEST_DATABASE_URL points at a Postgres instance.
+"""
+
+import os
+from app import db
+from app.models import User, Attendance, AttendanceAudit, BeltHistory, StudentSummary
+from datetime import date, datetime, time
+
+def route_queries():
+    """Queries matching the predicates used in app/routes.py"""
+    today = date(2026, 1, 15)
+    start_datetime = datetime.combine(today, time(0, 1))
+    end_datetime = datetime.combine(today, time(23, 59))
+    return {
+        'teacher_roster': db.session.query(
+            User.id,
+            StudentSummary.last_attended_at,
+            StudentSummary.latest_belt_level
+        ).outerjoin(
+            StudentSummary, StudentSummary.student_id == User.id
+        ).filter(
+            User.role == 'student'
+        ),
+        'refresh_last_attended': db.session.query(
+            Attendance.student_id,
+            db.func.max(Attendance.created_at)
+        ).filter(
+            Attendance.student_id.in_([1, 2, 3])
+        ).group_by(Attendance.student_id),
+        'mark_attendance': Attendance.query.filter_by(student_id=1, date=today),
+        'check_existing_attendance': Attendance.query.filter_by(student_id=1, date=today),
+        'get_plan_remaining': Attendance.query.filter(
+            Attendance.student_id == 1,
+            Attendance.created_at >= start_datetime,
+            Attendance.created_at <= end_datetime,
+            Attendance.free_class == False
+        ),
+        'generate_attendance_report': Attendance.query.filter(
+            Attendance.created_at >= start_datetime,
+            Attendance.created_at <= end_datetime
+        ).order_by(Attendance.created_at.desc()),
+        'get_attendance_audit': AttendanceAudit.query.filter_by(attendance_id=1).order_by(AttendanceAudit.changed_at.desc()),
+        'get_belt_history': BeltHistory.query.filter_by(student_id=1).order_by(BeltHistory.date_obtained.desc()),
+        'students_by_role': User.query.filter_by(role='student'),
+    }
+
+def explain(query):
+    """Return the plan lines for a query on the current dialect"""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+        return [row[-1] for row in rows]
+    rows = db.session.execute(db.text(f'EXPLAIN {sql}')).fetchall()
+    return [row[0] for row in rows]
+
+def is_sequential_scan(line, dialect_name):
+    if dialect_name == 'sqlite':
+        # "SCAN attendance" is a table scan; "SCAN x USING (COVERING) INDEX" walks an index
+        return line.startswith('SCAN') and 'USING' not in line
+    return 'Seq Scan' in line
+
+def test_route_queries_use_indexes(make_app):
+    app = make_app(os.environ.get('TEST_DATABASE_URL'))
+    with app.app_context():
+        dialect_name = db.engine.dialect.name
+        if dialect_name == 'postgresql':
+            # Tables are empty, so make the planner prefer any usable index
+            db.session.execute(db.text('SET enable_seqscan = off'))
+
+        plans = {name: explain(query) for name, query in route_queries().items()}
+        db.session.rollback()
+
+    failures = {
+        name: plan for name, plan in plans.items()
+        if any(is_sequential_scan(line, dialect_name) for line in plan)
+    }
+    assert not failures, f"Sequential scan in: {failures}"
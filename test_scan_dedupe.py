@@ -0,0 +1,70 @@
+"""
+Test script to verify repeated scans are suppressed without touching the database
+
+Scans the same QR code repeatedly from one scanner session, as the camera loop
+does, through /mark_attendance and /attendance/batch on a throwaway SQLite
+database. Checks that only the first scan reaches attendance or QR lookups,
+that another scanner session is not affected, that resent batches still
+replay, and that the counters at /teacher/scan_dedupe_stats add up.
+"""
+
+import uuid
+from app import db
+from app.models import Attendance, get_pacific_now
+
+REPEATS = 50
+# Statements that touch attendance or look a student up by QR code
+SCAN_STATEMENTS = ('attendance', 'uq_user_qr_code_id =')
+
+def test_repeat_scans_are_suppressed(make_app, make_user, login, sql_statements):
+    app = make_app(SCAN_DEDUPE_SECONDS=60)
+    with app.app_context():
+        student = make_user('student')
+        other = make_user('other', first_name='Other', last_name='Student')
+        db.session.add_all([make_user('teacher', role='teacher', with_password=True), student, other])
+        db.session.commit()
+        qr_data = student.generate_qr_code_data()
+
+        def scan_statements(func):
+            return sql_statements(db.engine, func, match=SCAN_STATEMENTS)
+
+        scanner = login(app, 'teacher')
+        response, statements = scan_statements(lambda: scanner.post('/mark_attendance', json={'qr_data': qr_data}))
+        assert response.get_json()['success']
+        assert statements
+
+        for _ in range(REPEATS):
+            response, statements = scan_statements(lambda: scanner.post('/mark_attendance', json={'qr_data': qr_data}))
+            assert response.status_code == 400
+            assert response.get_json()['suppressed']
+            assert response.get_json()['message'] == 'Attendance already marked for Test Student today'
+            assert not statements, f"Suppressed scan queried the database: {statements}"
+
+        # Unknown codes are remembered too
+        for _ in range(3):
+            response, statements = scan_statements(lambda: scanner.post('/mark_attendance', json={'qr_data': 'student:nobody'}))
+            assert response.status_code == 404
+        assert len(statements) == 0
+
+        # A second scanner is a separate session and still gets a real answer
+        second_scanner = login(app, 'teacher')
+        response = second_scanner.post('/mark_attendance', json={'qr_data': qr_data})
+        assert response.status_code == 400 and 'suppressed' not in response.get_json()
+
+        # Batches: the first upload marks, later decodes are suppressed, a resend still replays
+        now = get_pacific_now().isoformat()
+        first = {'client_id': str(uuid.uuid4()), 'qr_data': other.generate_qr_code_data(), 'scanned_at': now}
+        results = scanner.post('/attendance/batch', json={'scans': [first]}).get_json()['results']
+        assert results[0]['status'] == 'marked'
+        repeats = [dict(first, client_id=str(uuid.uuid4())) for _ in range(5)]
+        response, statements = scan_statements(lambda: scanner.post('/attendance/batch', json={'scans': repeats}))
+        assert all(item['status'] == 'already_marked' and item['suppressed'] for item in response.get_json()['results'])
+        assert all(item['student_name'] == 'Other Student' for item in response.get_json()['results'])
+        assert not [s for s in statements if 'INSERT' in s]
+        resent = scanner.post('/attendance/batch', json={'scans': [first]}).get_json()['results']
+        assert resent[0]['status'] == 'marked' and resent[0]['replayed']
+
+        assert Attendance.query.count() == 2
+        stats = scanner.get('/teacher/scan_dedupe_stats').get_json()
+        assert stats['suppressed'] == REPEATS + 2 + len(repeats)
+        assert stats['passed'] == 1 + 1 + 1 + 1 + 1
@@ -0,0 +1,81 @@
+"""
+Test script to verify signed QR codes
+
+Checks on a throwaway SQLite database that signed codes resolve to their
+student, that forged or altered codes are rejected without a database query,
+that a warm cache resolves a genuine code with no query, that reissuing a
+student's code revokes both the old signed and the old printed code, and that
+existing student:<qr_code_id> codes keep working.
+"""
+
+from app import db
+from app.models import User, Attendance, AttendanceAudit
+from app.qr_cache import qr_cache
+from app.qr_signing import sign_student_code, verify_student_code
+
+SECRET_KEY = 'test-secret'
+
+def clear_attendance():
+    AttendanceAudit.query.delete()
+    Attendance.query.delete()
+    db.session.commit()
+
+def test_signed_qr_codes(make_app, make_user, login, sql_statements):
+    app = make_app(SECRET_KEY=SECRET_KEY, QR_SIGNED_CODES=True, SCAN_DEDUPE_SECONDS=0)
+    with app.app_context():
+        student = make_user('student')
+        db.session.add_all([make_user('teacher', role='teacher', with_password=True), student])
+        db.session.commit()
+
+        def statement_count(func):
+            result, statements = sql_statements(db.engine, func)
+            return result, len(statements)
+
+        signed = student.generate_qr_code_data()
+        legacy = f"student:{student.qr_code_id}"
+        assert signed.startswith('sq1:')
+        assert verify_student_code(signed) == (student.id, 1)
+
+        # Forged, altered and truncated codes fail verification without a query
+        forged = [
+            signed.rsplit('.', 1)[0] + '.' + ('B' if signed.rsplit('.', 1)[1][0] == 'A' else 'A') + signed.rsplit('.', 1)[1][1:],
+            signed.replace(f'sq1:{student.id}.', f'sq1:{student.id + 1}.'),
+            signed.rsplit('.', 1)[0],
+            'sq1:garbage',
+        ]
+        for code in forged:
+            resolved, statements = statement_count(lambda: qr_cache.resolve(code))
+            assert resolved is None and statements == 0, code
+        # A code signed with another deployment's key is not accepted
+        app.config['SECRET_KEY'] = 'another-secret'
+        assert verify_student_code(signed) is None
+        app.config['SECRET_KEY'] = SECRET_KEY
+
+        # Genuine code: one lookup when cold, none once cached
+        resolved, statements = statement_count(lambda: qr_cache.resolve(signed))
+        assert resolved == (student.id, 'Test Student', 'student') and statements == 1
+        resolved, statements = statement_count(lambda: qr_cache.resolve(signed))
+        assert resolved == (student.id, 'Test Student', 'student') and statements == 0
+        # A genuine signature for a version that was never issued does not resolve
+        assert qr_cache.resolve(sign_student_code(student.id, 2)) is None
+
+        client = login(app, 'teacher')
+        assert client.post('/mark_attendance', json={'qr_data': signed}).get_json()['student_name'] == 'Test Student'
+        clear_attendance()
+        # Printed codes from before signing keep working
+        assert client.post('/mark_attendance', json={'qr_data': legacy}).get_json()['success']
+        clear_attendance()
+
+        # Reissuing revokes both old codes
+        assert client.post(f'/student/{student.id}/rotate_qr').get_json()['qr_version'] == 2
+        db.session.expire_all()
+        student = db.session.get(User, student.id)
+        assert client.post('/mark_attendance', json={'qr_data': signed}).status_code == 404
+        assert client.post('/mark_attendance', json={'qr_data': legacy}).status_code == 404
+        new_code = student.generate_qr_code_data()
+        assert new_code != signed
+        assert client.post('/mark_attendance', json={'qr_data': new_code}).get_json()['success']
+
+        # Printing falls back to the legacy format when signing is off
+        app.config['QR_SIGNED_CODES'] = False
+        assert student.generate_qr_code_data() == f"student:{student.qr_code_id}"
@@ -0,0 +1,107 @@
+"""
+Test script to verify the student calendar's query count does not grow with history
+
+Gives a student years of attendance marked by several teachers on a throwaway
+SQLite database, then loads the calendar page and its monthly events feed.
+Checks that the page takes a fixed number of queries, that the feed only returns
+the requested window with the right teacher names, and that the 12-month
+stats match a count done in Python.
+"""
+
+import os
+import calendar
+from datetime import timedelta
+from app import db
+import app.routes as routes
+from app.models import Attendance, get_pacific_date
+
+HISTORY_DAYS = int(os.environ.get('BENCH_HISTORY_DAYS', 1500))
+
+def test_student_calendar_queries(make_app, make_user, login, sql_statements):
+    app = make_app()
+    with app.app_context():
+        teachers = [
+            make_user(f'teacher{i}', role='teacher', with_password=i == 0, first_name='Teacher', last_name=str(i))
+            for i in range(3)
+        ]
+        student = make_user('student', first_name='Long', last_name='Timer')
+        newcomer = make_user('newcomer', first_name='New', last_name='Comer')
+        db.session.add_all(teachers + [student, newcomer])
+        db.session.flush()
+
+        today = get_pacific_date()
+        statuses = ['present', 'present', 'late', 'absent']
+        db.session.add_all([
+            Attendance(student_id=student.id, date=today - timedelta(days=day), status=statuses[day % 4],
+                       notes=f'day {day}', created_by=teachers[day % 3].id)
+            for day in range(HISTORY_DAYS)
+        ])
+        db.session.add(Attendance(student_id=newcomer.id, date=today, status='present', created_by=teachers[0].id))
+        db.session.commit()
+        student_id, newcomer_id = student.id, newcomer.id
+        engine = db.engine
+
+        # Expected 12-month stats, counted in Python
+        expected = {}
+        for i in range(12):
+            month = (today.month - i - 1) % 12 + 1
+            year = today.year if today.month - i > 0 else today.year - 1
+            expected[f"{calendar.month_abbr[month]} {str(year)[2:]}"] = 0
+        for day in range(HISTORY_DAYS):
+            if statuses[day % 4] == 'present':
+                d = today - timedelta(days=day)
+                label = f"{calendar.month_abbr[d.month]} {str(d.year)[2:]}"
+                if label in expected:
+                    expected[label] += 1
+
+    client = login(app, 'teacher0')
+
+    def statement_count(func):
+        result, statements = sql_statements(engine, func)
+        return result, len(statements)
+
+    # Requests run outside an app context so each one loads the logged-in user as in production
+    captured = {}
+    def render(template, **context):
+        captured.update(context)
+        return ''
+    original_render = routes.render_template
+    routes.render_template = render
+    try:
+        response, long_statements = statement_count(lambda: client.get(f'/student/{student_id}/calendar'))
+        stats = captured['attendance_stats']
+        _, short_statements = statement_count(lambda: client.get(f'/student/{newcomer_id}/calendar'))
+    finally:
+        routes.render_template = original_render
+    assert response.status_code == 200
+    assert dict(stats) == expected
+    assert list(stats)[0] == f"{calendar.month_abbr[today.month]} {str(today.year)[2:]}"
+    assert 'attendance_events' not in captured
+    assert long_statements == short_statements, (long_statements, short_statements)
+
+    with app.app_context():
+        month_start = today.replace(day=1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        url = f'/student/{student_id}/attendance_events?start={month_start}&end={month_end}'
+        response = client.get(url)
+        events = response.get_json()
+        assert len(events) == (today - month_start).days + 1
+        assert all(month_start.isoformat() <= e['start'] < month_end.isoformat() for e in events)
+        by_date = {e['start']: e for e in events}
+        today_event = by_date[today.isoformat()]
+        assert today_event['marked_by'] == 'Teacher 0' and today_event['title'] == 'Present' and today_event['notes'] == 'day 0'
+        assert all(e['marked_by'].startswith('Teacher ') for e in events)
+
+        # FullCalendar sends full ISO datetimes
+        iso = client.get(f'/student/{student_id}/attendance_events?start={month_start}T00:00:00-07:00&end={month_end}T00:00:00-07:00')
+        assert iso.get_json() == events
+
+        # A deleted teacher's records still show
+        Attendance.query.filter_by(student_id=newcomer_id).update({'created_by': 999999})
+        db.session.commit()
+        orphan = client.get(f'/student/{newcomer_id}/attendance_events?start={today}&end={today + timedelta(days=1)}').get_json()
+        assert orphan[0]['marked_by'] == 'Unknown'
+
+        assert client.get(f'/student/{student_id}/attendance_events').status_code == 400
+        assert client.get(f'/student/{student_id}/attendance_events?start={month_end}&end={month_start}').status_code == 400
+        assert client.get(f'/student/{student_id}/attendance_events?start=2000-01-01&end=2030-01-01').status_code == 400
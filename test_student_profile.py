@@ -0,0 +1,102 @@
+"""
+Test script to verify the student profile bundle
+
+Gives a student a plan, belt history and a year of attendance (free classes,
+classes before the plan and classes marked by a since-deleted teacher) on a
+throwaway SQLite database. Checks that /student/<id>/profile returns exactly
+what the separate belt_history, attendance_history, plan and plan details
+endpoints return, that field selection works, and that the bundle takes
+fewer queries than the separate requests did.
+"""
+
+import os
+from datetime import datetime, timedelta
+from app import db
+from app.models import Attendance, BeltHistory, Plan, get_pacific_date
+from app.summary import reconcile_plan_usage
+
+HISTORY_DAYS = int(os.environ.get('BENCH_HISTORY_DAYS', 365))
+
+def test_student_profile_bundle(make_app, make_user, login, sql_statements):
+    app = make_app()
+    with app.app_context():
+        teacher = make_user('teacher', role='teacher', with_password=True)
+        today = get_pacific_date()
+        student = make_user('student', with_password=True)
+        db.session.add_all([teacher, student])
+        db.session.flush()
+        # A renewal: the earlier plan is kept as history
+        for effective_from in (today - timedelta(days=300), today - timedelta(days=100)):
+            plan = Plan(student_id=student.id, program='6 months', plan='Unlimited', classes=48, effective_from=effective_from)
+            plan.set_window()
+            db.session.add(plan)
+        db.session.add_all([
+            BeltHistory(student_id=student.id, belt_level=level, date_obtained=today - timedelta(days=days))
+            for level, days in [('White', 300), ('Yellow', 150), ('Orange', 20)]
+        ])
+        for day in range(HISTORY_DAYS):
+            attended = today - timedelta(days=day)
+            db.session.add(Attendance(
+                student_id=student.id, date=attended, status='present', notes=f'day {day}' if day % 2 else None,
+                created_by=teacher.id if day % 5 else 999999, free_class=day % 7 == 0,
+                created_at=datetime.combine(attended, datetime.min.time()) + timedelta(hours=18)
+            ))
+        db.session.commit()
+        reconcile_plan_usage()
+        student_id = student.id
+        plan_id = student.current_plan().id
+        engine = db.engine
+
+    # Requests run outside an app context so each one loads the logged-in user as in production
+    client = login(app, 'teacher')
+
+    def count_statements(func):
+        result, statements = sql_statements(engine, func)
+        return result, len(statements)
+
+    separate_urls = [
+        f'/student/{student_id}/belt_history',
+        f'/student/{student_id}/attendance_history',
+        f'/student/{student_id}/plan',
+        f'/student/{student_id}/plan/{plan_id}/details',
+    ]
+    separate = {}
+    separate_statements = 0
+    for url in separate_urls:
+        response, statements = count_statements(lambda: client.get(url))
+        separate[url] = response.get_json()
+        separate_statements += statements
+    # The page used to fetch plan/<id>/remaining as well
+    _, statements = count_statements(lambda: client.get(f'/student/{student_id}/plan/{plan_id}/remaining'))
+    separate_statements += statements
+
+    response, bundle_statements = count_statements(lambda: client.get(f'/student/{student_id}/profile'))
+    bundle = response.get_json()
+    assert bundle['success']
+    assert bundle['belt_history'] == separate[separate_urls[0]]['belt_history']
+    assert bundle['attendance_history'] == separate[separate_urls[1]]['attendance_history']
+    assert bundle['plans'] == separate[separate_urls[2]]['plans']
+    assert [plan['id'] for plan in bundle['plans']][0] == plan_id and len(bundle['plans']) == 2
+    assert bundle['plan_usage'] == separate[separate_urls[3]]
+    assert 'Unknown' in {row['teacher_name'] for row in bundle['attendance_history']}
+    assert 0 < bundle['plan_usage']['attended'] < HISTORY_DAYS
+    assert bundle_statements < separate_statements
+
+    # Field selection
+    belts_only = client.get(f'/student/{student_id}/profile?fields=belt_history').get_json()
+    assert set(belts_only) == {'success', 'belt_history'}
+    usage_only = client.get(f'/student/{student_id}/profile?fields=plan_usage').get_json()
+    assert set(usage_only) == {'success', 'plan_usage'}
+    assert client.get(f'/student/{student_id}/profile?fields=belt_history,password').status_code == 400
+    assert client.get('/student/999999/profile').status_code == 404
+
+    # Students cannot read profiles
+    student_client = login(app, 'student')
+    assert student_client.get(f'/student/{student_id}/profile').status_code == 403
+
+    with app.app_context():
+        # Without a plan the usage panel says so, like plan/<id>/remaining did
+        Plan.query.filter_by(student_id=student_id).delete()
+        db.session.commit()
+    usage = client.get(f'/student/{student_id}/profile?fields=plan_usage').get_json()['plan_usage']
+    assert usage == {'success': False, 'remaining': 0, 'message': 'No plan data found'}
@@ -0,0 +1,70 @@
+"""
+Test script to verify ordinary User loads never fetch profile picture bytes
+
+Seeds a throwaway SQLite database with students who all have avatars, then
+counts the bytes returned by the dashboard roster query and by a plain
+User.query.all(), and compares peak memory against loading the same students
+together with their picture bytes (what every User load cost when pictures were
+stored base64 in the user row). Set BENCH_STUDENTS to change the roster size.
+"""
+
+import os
+import tracemalloc
+from app import db
+from app.models import User, ImageBlob
+from app.routes import student_roster_query
+
+STUDENT_COUNT = int(os.environ.get('BENCH_STUDENTS', 5000))
+AVATAR_BYTES = 8 * 1024
+
+def seed(make_user):
+    for i in range(STUDENT_COUNT):
+        sha256 = f'{i:064x}'
+        db.session.add(ImageBlob(sha256=sha256, content_type='image/jpeg', size=AVATAR_BYTES, data=os.urandom(AVATAR_BYTES)))
+        db.session.add(make_user(f'student{i}', first_name=f'First{i}', last_name=f'Last{i}', profile_picture_hash=sha256))
+        if i % 1000 == 999:
+            db.session.commit()
+    db.session.commit()
+
+def fetched_bytes(query):
+    """Total size of the values in every row returned by a query's SQL"""
+    total = 0
+    for row in db.session.execute(query.statement):
+        for value in row:
+            if isinstance(value, (bytes, str)):
+                total += len(value)
+            elif hasattr(value, '__table__'):
+                # ORM entity: count its loaded column values
+                for column in value.__table__.columns:
+                    loaded = value.__dict__.get(column.key)
+                    if isinstance(loaded, (bytes, str)):
+                        total += len(loaded)
+    db.session.expunge_all()
+    return total
+
+def measure(load):
+    db.session.expunge_all()
+    tracemalloc.start()
+    rows = load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    db.session.expunge_all()
+    return peak
+
+def test_user_loads_skip_picture_bytes(make_app, make_user):
+    app = make_app()
+    with app.app_context():
+        seed(make_user)
+
+        roster_bytes = fetched_bytes(student_roster_query())
+        users_bytes = fetched_bytes(User.query.filter_by(role='student'))
+        # Names, emails and hashes only; a single avatar per student would exceed this
+        assert roster_bytes < STUDENT_COUNT * AVATAR_BYTES / 10
+        assert users_bytes < STUDENT_COUNT * AVATAR_BYTES / 10
+
+        with_pictures_peak = measure(lambda: db.session.query(User, ImageBlob).options(
+            db.undefer(ImageBlob.data)
+        ).join(ImageBlob, User.profile_picture_hash == ImageBlob.sha256).all())
+        users_peak = measure(lambda: User.query.filter_by(role='student').all())
+        assert users_peak < with_pictures_peak